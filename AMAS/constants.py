@@ -5,11 +5,24 @@ Constants for modlues
 
 import collections
 import compress_pickle
+import functools
 import os
+import threading
 
 # Folder for reference data
 CUR_DIR = os.path.dirname(os.path.realpath(__file__))
 REF_DIR = os.path.join(CUR_DIR, 'files')
+# Environment variable with the folder of the reference bundle,
+# if it is not the default one
+BUNDLE_DIR_ENV = 'AMAS_BUNDLE_DIR'
+# Folder for uncompressed reference bundle (see reference_bundle.py)
+BUNDLE_DIR = os.environ.get(BUNDLE_DIR_ENV) or os.path.join(REF_DIR, 'bundle')
+# Environment variable with the name of a shared memory
+# reference store to attach to (see shared_reference.py)
+REFERENCE_STORE_ENV = 'AMAS_REFERENCE_STORE'
+# Environment variable with the path of an SQLite file
+# caching scores of species names and reactions (see score_cache.py)
+SCORE_CACHE_ENV = 'AMAS_SCORE_CACHE'
 TEST_DIR = os.path.join(CUR_DIR, os.pardir, 'tests')
 
 # Strings used in the modules
@@ -47,20 +60,148 @@ RHEA_DEFAULT_URL = 'https://www.rhea-db.org/rhea/'
 Recommendation = collections.namedtuple('Recommendation',
                                         ['id', 'candidates', 'urls', 'labels'])
 
-with open(os.path.join(REF_DIR, 'chebi_shortened_formula_comp.lzma'), 'rb') as f:
-  REF_CHEBI2FORMULA = compress_pickle.load(f)
-with open(os.path.join(REF_DIR, 'chebi2label.lzma'), 'rb') as f:
-  REF_CHEBI2LABEL = compress_pickle.load(f)
-with open(os.path.join(REF_DIR, 'ec2mrhea.lzma'), 'rb') as handle:
-  REF_EC2RHEA = compress_pickle.load(handle)
-with open(os.path.join(REF_DIR, 'kegg2mrhea.lzma'), 'rb') as handle:
-  REF_KEGG2RHEA = compress_pickle.load(handle)
-with open(os.path.join(REF_DIR, 'rhea_all2master.lzma'), 'rb') as f:
-  REF_RHEA2MASTER = compress_pickle.load(f)
-with open(os.path.join(REF_DIR, 'mrhea2chebi_prime.lzma'), 'rb') as f:
-  REF_RHEA2CHEBI = compress_pickle.load(f)
-with open(os.path.join(REF_DIR, 'rhea2label.lzma'), 'rb') as f:
-  REF_RHEA2LABEL = compress_pickle.load(f)  
-with open(os.path.join(REF_DIR, 'mrhea2eckegg.lzma'), 'rb') as f:
-  REF_RHEA2ECKEGG = compress_pickle.load(f)  
+# Reference tables are loaded lazily;
+# each table is read from REF_DIR only on its first access
+# (e.g., cn.REF_CHEBI2FORMULA) and the same object is shared afterwards.
+_REF_LOADERS = dict()
+_REF_CACHE = dict()
+_REF_LOCK = threading.RLock()
 
+
+def loadLZMAReference(fname):
+  """
+  Load a compressed (lzma) pickle
+  from the reference folder.
+
+  Parameters
+  ----------
+  fname: str
+      File name under REF_DIR
+
+  Returns
+  -------
+  : object
+  """
+  with open(os.path.join(REF_DIR, fname), 'rb') as f:
+    return compress_pickle.load(f, compression='lzma')
+
+def loadFileReference(name, fname):
+  """
+  Load a reference table from the
+  precompiled bundle (memory-mapped) if it exists,
+  otherwise from its compressed pickle.
+
+  Parameters
+  ----------
+  name: str
+      Name of the reference table
+  fname: str
+      File name of the pickle under REF_DIR
+
+  Returns
+  -------
+  : object
+  """
+  # imported here; reference_bundle imports constants
+  from AMAS import reference_bundle as rb
+  if rb.hasBundledReference(name):
+    return rb.loadBundledReference(name)
+  return loadLZMAReference(fname)
+
+def registerReference(name, loader):
+  """
+  Register a reference table
+  to be loaded on demand.
+
+  Parameters
+  ----------
+  name: str
+      Name of the reference table
+  loader: callable
+      Function without arguments returning the table
+  """
+  with _REF_LOCK:
+    _REF_LOADERS[name] = loader
+
+def loadReference(name, cache=True):
+  """
+  Get a reference table by its name.
+  It is loaded at the first call
+  and cached for later calls.
+
+  Parameters
+  ----------
+  name: str
+      Name of a registered reference table
+  cache: bool
+      If False, a table that is not loaded yet
+      is returned without being cached
+      (e.g., to derive another table from it)
+
+  Returns
+  -------
+  : object
+  """
+  try:
+    return _REF_CACHE[name]
+  except KeyError:
+    pass
+  if not cache:
+    return _REF_LOADERS[name]()
+  with _REF_LOCK:
+    if name not in _REF_CACHE:
+      _REF_CACHE[name] = _REF_LOADERS[name]()
+    return _REF_CACHE[name]
+
+def setReference(name, value):
+  """
+  Cache a reference table
+  that was loaded elsewhere
+  (e.g., attached from shared memory),
+  replacing a cached one.
+
+  Parameters
+  ----------
+  name: str
+      Name of the reference table
+  value: object
+  """
+  with _REF_LOCK:
+    _REF_CACHE[name] = value
+
+def isReferenceLoaded(name):
+  """
+  Check whether a reference table
+  was already loaded.
+
+  Parameters
+  ----------
+  name: str
+
+  Returns
+  -------
+  bool
+  """
+  return name in _REF_CACHE
+
+
+REF_FILES = {'REF_CHEBI2FORMULA': 'chebi_shortened_formula_comp.lzma',
+             'REF_CHEBI2LABEL': 'chebi2label.lzma',
+             'REF_EC2RHEA': 'ec2mrhea.lzma',
+             'REF_KEGG2RHEA': 'kegg2mrhea.lzma',
+             'REF_RHEA2MASTER': 'rhea_all2master.lzma',
+             'REF_RHEA2CHEBI': 'mrhea2chebi_prime.lzma',
+             'REF_RHEA2LABEL': 'rhea2label.lzma',
+             'REF_RHEA2ECKEGG': 'mrhea2eckegg.lzma'}
+for _name, _fname in REF_FILES.items():
+  registerReference(_name, functools.partial(loadFileReference, _name, _fname))
+
+
+def __getattr__(name):
+  if name in REF_FILES:
+    # bind as a module attribute, so that
+    # __getattr__ is not called again for the same name
+    value = loadReference(name)
+    globals()[name] = value
+    return value
+  raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
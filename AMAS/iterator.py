@@ -70,6 +70,34 @@ class Iterator(object):
       self.r2upd = reactions_to_update
     else:
       self.r2upd = list(reaction_cl.candidates.keys())
+    # scorer keeping the state of self.r2upd, so the state
+    # of self.reactions (shared with other callers) is not changed
+    self.rscorer = copy.copy(reaction_cl)
+    self.rscorer.resetRScoreState()
+    # rScores of self.r2upd with self.orig_spec_formula;
+    # see self.getOrigRScores()
+    self.orig_rscores = None
+
+  def getOrigRScores(self):
+    """
+    Get rScores (mssc='top', cutoff=0.0)
+    of reactions to update with the current formulas
+    (self.orig_spec_formula). They are computed once, keeping
+    the state in self.rscorer, and patched
+    when self.match() updates formulas.
+
+    Returns
+    -------
+    : dict
+        {reaction_id: [(Rhea:XXXXX, 1.0), ...]}
+    """
+    if self.orig_rscores is None:
+      self.orig_rscores = self.rscorer.getRScores(spec_dict=self.orig_spec_formula,
+                                                  reacs=list(self.r2upd),
+                                                  mssc='top',
+                                                  cutoff=0.0,
+                                                  keep_state=True)
+    return self.orig_rscores
 
   def getDictOfRheaComponentFormula(self, inp_rhea):
     """
@@ -187,14 +215,11 @@ class Iterator(object):
     : dict
     """
     cur_spec_formulas.update(inp_spec2formula_dict)
-    new_pred_res = self.reactions.getRScores(spec_dict=cur_spec_formulas,
-                                             reacs=list(self.r2upd),
-                                             mssc='top',
-                                             cutoff=0.0)
-    old_pred_res = self.reactions.getRScores(spec_dict=self.orig_spec_formula,
-                                             reacs=list(self.r2upd),
-                                             mssc='top',
-                                             cutoff=0.0)
+    old_pred_res = self.getOrigRScores()
+    # only reactions with changed species are re-scored
+    new_pred_res = dict(old_pred_res)
+    patched = self.rscorer.getPatchedRScores(spec_dict=cur_spec_formulas)
+    new_pred_res.update({k:patched[k] for k in self.r2upd if k in patched})
     # since candidates are already sorted, 
     # just check the match score (index '1') of the very first candidate tuple (index '0')
     new_pred_val = np.mean([new_pred_res[k][0][1] \
@@ -221,6 +246,10 @@ class Iterator(object):
           self.orig_spec_formula[one_k] = [cn.REF_CHEBI2FORMULA[val] \
                                            for val in upd_spec_chebi[one_k] \
                                            if val in cn.REF_CHEBI2FORMULA.keys()]
+        if self.orig_rscores is not None:
+          self.rscorer.updateSpeciesFormulas(spec_dict={k:self.orig_spec_formula[k] \
+                                                        for k in upd_spec_chebi.keys()},
+                                             candidates=self.orig_rscores)
       else:
         break
     # Maybe run reaction once, and return final results :) 
@@ -8,33 +8,289 @@ annotations predicted via species_annotation.
 """
 
 from AMAS import constants as cn
+from AMAS import reference_bundle as rb
+from AMAS import score_cache as sc
 from AMAS import tools
 
-import compress_pickle
+import collections
+import functools
 import itertools
+import json
 import libsbml
 import numpy as np
-import operator
 import os
 import pandas as pd
+from scipy import sparse
 
 
-with open(os.path.join(cn.REF_DIR, 'data2ref_mat.lzma'), 'rb') as handle:
-  REF_DAT = compress_pickle.load(handle)
+# File of REF_DAT (REF_MAT_SPARSE); rScores depend only on it
+REF_DAT_FNAME = 'data2ref_mat.lzma'
+# Default number of reactions scored at once in iterRScores;
+# memory of each chunk is bounded by the number of
+# its reactions and their candidates
+RSCORE_CHUNK_SIZE = 1000
+# Table of rScores in the SQLite file of cn.SCORE_CACHE_ENV
+RSCORE_CACHE_TABLE = 'rscores'
+# rScores of formula sets shared by ReactionAnnotation objects
+# of all processes, in the SQLite file of cn.SCORE_CACHE_ENV;
+# None if it is not set
+if os.environ.get(cn.SCORE_CACHE_ENV):
+  RSCORE_CACHE = sc.DiskScoreCache(os.environ[cn.SCORE_CACHE_ENV],
+                                   ref_fnames=[REF_DAT_FNAME],
+                                   table=RSCORE_CACHE_TABLE)
+else:
+  RSCORE_CACHE = None
+
+
+def buildReferenceMatrix():
+  """
+  Build the reference (Rhea x formula)
+  matrix as a scipy.sparse CSR matrix,
+  directly from CSR triplets of the bundle
+  or from the (column, [non-zero rows]) pairs of REF_DAT.
+
+  Returns
+  -------
+  : scipy.sparse.csr_matrix
+  """
+  if rb.hasBundledReference('REF_DAT'):
+    indptr, indices, rows, cols = rb.loadSparseArrays('REF_DAT')
+    return sparse.csr_matrix((np.ones(len(indices), dtype=np.int32), indices, indptr),
+                             shape=(len(rows), len(cols)))
+  ref_dat = cn.loadReference('REF_DAT')
+  # first of list is list of columns
+  cols = ref_dat[0]
+  # second, list of indices
+  inds = ref_dat[1]
+  # third, list of index (column, [non-zero rows])
+  ref_mat_pairs = ref_dat[2]
+  row_idx = np.concatenate([np.asarray(val[1], dtype=np.int64) for val in ref_mat_pairs])
+  col_idx = np.concatenate([np.full(len(val[1]), val[0], dtype=np.int64) \
+                            for val in ref_mat_pairs])
+  ref_mat = sparse.csr_matrix((np.ones(len(row_idx), dtype=np.int32), (row_idx, col_idx)),
+                              shape=(len(inds), len(cols)))
+  # duplicated pairs are summed up; values should be 1
+  ref_mat.data[:] = 1
+  return ref_mat
+
+def buildReferenceFrame():
+  """
+  Build the reference (Rhea x formula)
+  matrix as a labelled pandas.DataFrame
+  of 0/1 (dense), from REF_MAT_SPARSE.
+
+  Returns
+  -------
+  : pandas.DataFrame
+  """
+  return pd.DataFrame(cn.loadReference('REF_MAT_SPARSE').toarray().astype(np.int64),
+                      index=cn.loadReference('REF_MAT_INDEX'),
+                      columns=cn.loadReference('REF_MAT_COLUMNS'))
+
+def loadReferenceLabels(axis):
+  """
+  Load labels of REF_MAT_SPARSE;
+  Rhea terms (axis=0) or formulas (axis=1).
+
+  Parameters
+  ----------
+  axis: int
+
+  Returns
+  -------
+  : pandas.Index
+  """
+  if rb.hasBundledReference('REF_DAT'):
+    _, _, rows, cols = rb.loadSparseArrays('REF_DAT')
+    labels = rows if axis==0 else cols
+    return pd.Index(labels.tolist())
+  ref_dat = cn.loadReference('REF_DAT')
+  return pd.Index(ref_dat[1] if axis==0 else ref_dat[0])
+
+def getReferenceMatrix(ref_mat=None):
+  """
+  Get a reference matrix with its labels.
+  If a pandas.DataFrame is given,
+  it is converted into a sparse matrix.
+
+  Parameters
+  ----------
+  ref_mat: pandas.DataFrame/None
+      If None, use REF_MAT_SPARSE
+
+  Returns
+  -------
+  : scipy.sparse.csr_matrix
+      (Rhea x formula)
+  : pandas.Index
+      Rhea terms
+  : pandas.Index
+      Formulas
+  : numpy.ndarray
+      Number of non-zero elements (formulas) per Rhea
+  """
+  if ref_mat is None:
+    return (cn.loadReference('REF_MAT_SPARSE'),
+            cn.loadReference('REF_MAT_INDEX'),
+            cn.loadReference('REF_MAT_COLUMNS'),
+            cn.loadReference('REF_MAT_ROW_NNZ'))
+  mat = sparse.csr_matrix(ref_mat.to_numpy())
+  return mat, ref_mat.index, ref_mat.columns, mat.getnnz(axis=1)
+
+def getRheaOverlaps(postings, formula_idxs):
+  """
+  Count the formulas of a query
+  shared by each Rhea term, using
+  only the posting lists of the formulas.
+
+  Parameters
+  ----------
+  postings: scipy.sparse.csc_matrix
+      (Rhea x formula) reference matrix;
+      column j lists the Rhea terms with formula j
+  formula_idxs: numpy.ndarray
+      Unique column indices of the query formulas
+
+  Returns
+  -------
+  : numpy.ndarray
+      Sorted indices of Rhea terms with
+      at least one of the formulas
+  : numpy.ndarray
+      Number of shared formulas of each
+  """
+  if len(formula_idxs) == 0:
+    return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+  rows = np.concatenate([postings.indices[postings.indptr[idx]:postings.indptr[idx+1]] \
+                         for idx in formula_idxs])
+  return np.unique(rows, return_counts=True)
+
+def getOverlapRScores(rows, counts, row_nnz, rhea_labels, mssc, cutoff):
+  """
+  Get rScores of a query from its overlaps
+  (getRheaOverlaps), i.e., the number of shared formulas
+  divided by the minimum number of formulas among Rhea terms
+  with the maximum overlap. Rhea terms without overlap
+  score 0 and are included only if the cutoff
+  allows them.
+
+  Parameters
+  ----------
+  rows: numpy.ndarray
+  counts: numpy.ndarray
+  row_nnz: numpy.ndarray
+      Number of formulas of each Rhea term
+  rhea_labels: numpy.ndarray
+  mssc: str
+  cutoff: float
+
+  Returns
+  -------
+  : list-tuple
+      [(RHEA:XXXXX, 1.0), ...]
+  """
+  if len(rows) > 0:
+    denom = row_nnz[rows[counts == counts.max()]].min()
+  else:
+    denom = row_nnz.min() if len(row_nnz) > 0 else np.inf
+  with np.errstate(divide='ignore', invalid='ignore'):
+    scores = counts / np.float64(denom)
+    zero_score = 0 / np.float64(denom)
+  if zero_score >= cutoff and (mssc != 'top' or len(rows) == 0):
+    all_scores = np.full(len(rhea_labels), zero_score)
+    all_scores[rows] = scores
+    return tools.applyMSSCToArray(labels=rhea_labels,
+                                  scores=all_scores,
+                                  mssc=mssc,
+                                  cutoff=cutoff)
+  return tools.applyMSSCToArray(labels=rhea_labels[rows],
+                                scores=scores,
+                                mssc=mssc,
+                                cutoff=cutoff)
+
+def patchRheaOverlaps(postings, rows, counts, added_idxs, removed_idxs):
+  """
+  Update overlaps (getRheaOverlaps) of a query
+  when formulas are added to or removed from it.
+
+  Parameters
+  ----------
+  postings: scipy.sparse.csc_matrix
+  rows: numpy.ndarray
+  counts: numpy.ndarray
+  added_idxs: list-int
+      Column indices of formulas new to the query
+  removed_idxs: list-int
+      Column indices of formulas no longer in the query
+
+  Returns
+  -------
+  : numpy.ndarray
+  : numpy.ndarray
+  """
+  added, added_counts = getRheaOverlaps(postings, np.asarray(added_idxs, dtype=np.int64))
+  removed, removed_counts = getRheaOverlaps(postings, np.asarray(removed_idxs, dtype=np.int64))
+  all_rows = np.concatenate([rows, added, removed])
+  # a Rhea term may have several of the added (or removed) formulas
+  weights = np.concatenate([counts, added_counts, -removed_counts]).astype(np.float64)
+  all_rows, inverse = np.unique(all_rows, return_inverse=True)
+  all_counts = np.rint(np.bincount(inverse, weights=weights,
+                                   minlength=len(all_rows))).astype(np.int64)
+  return all_rows[all_counts > 0], all_counts[all_counts > 0]
+
+def getSpeciesReactions(reaction_components):
+  """
+  Get the reverse index of reaction components.
+
+  Parameters
+  ----------
+  reaction_components: dict
+      {reaction_id: [species ids]}
+
+  Returns
+  -------
+  : dict
+      {species_id: [reaction ids]}
+  """
+  species_reactions = collections.defaultdict(list)
+  if reaction_components:
+    for one_rid, specs in reaction_components.items():
+      for spec in specs:
+        species_reactions[spec].append(one_rid)
+  return dict(species_reactions)
+
+
+# Reference tables, loaded on first access (e.g., ra.REF_MAT)
+REACTION_REFERENCES = ['REF_DAT', 'REF_NONZERO_COLS',
+                       'REF_MAT', 'REF_MAT_SPARSE',
+                       'REF_MAT_INDEX', 'REF_MAT_COLUMNS',
+                       'REF_MAT_ROW_NNZ', 'REF_MAT_POSTINGS']
+cn.registerReference('REF_DAT',
+                     functools.partial(cn.loadFileReference, 'REF_DAT', REF_DAT_FNAME))
 # might need to be deleted after trying Jaccard Index
-REF_NONZERO_COLS = compress_pickle.load(os.path.join(cn.REF_DIR, 'ref_nonzero_cols.lzma'),
-                        compression="lzma",
-                        set_default_extension=False)
+cn.registerReference('REF_NONZERO_COLS',
+                     functools.partial(cn.loadLZMAReference, 'ref_nonzero_cols.lzma'))
+# REF_MAT_SPARSE is a sparse (Rhea x formula) matrix;
+# its row and column labels are REF_MAT_INDEX and REF_MAT_COLUMNS.
+# REF_MAT is the same matrix as a (dense) DataFrame with the labels,
+# as in earlier versions; it is not used for scoring
+cn.registerReference('REF_MAT_SPARSE', buildReferenceMatrix)
+cn.registerReference('REF_MAT', buildReferenceFrame)
+cn.registerReference('REF_MAT_INDEX', functools.partial(loadReferenceLabels, 0))
+cn.registerReference('REF_MAT_COLUMNS', functools.partial(loadReferenceLabels, 1))
+# number of formulas of each Rhea, i.e., denominators of rScores
+cn.registerReference('REF_MAT_ROW_NNZ',
+                     lambda: cn.loadReference('REF_MAT_SPARSE').getnnz(axis=1))
+# inverted index of REF_MAT_SPARSE; formula -> Rhea terms (CSC)
+cn.registerReference('REF_MAT_POSTINGS',
+                     lambda: cn.loadReference('REF_MAT_SPARSE').tocsc())
 
-# first of list is list of columns
-cols = REF_DAT[0]
-# second, list of indices
-inds = REF_DAT[1]
-# third, list of index (column, [non-zero rows])
-ref_mat_pairs = REF_DAT[2]
-REF_MAT = pd.DataFrame(0, index=inds, columns=cols)
-for val in ref_mat_pairs:
-  REF_MAT.iloc[val[1], val[0]] = 1
+def __getattr__(name):
+  if name in REACTION_REFERENCES:
+    value = cn.loadReference(name)
+    globals()[name] = value
+    return value
+  raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
 
 
 class ReactionAnnotation(object):
@@ -73,6 +329,29 @@ class ReactionAnnotation(object):
     # Attributes after prediction
     self.candidates = None
     self.query_df = None
+    # rScores of formula sets on disk (sc.DiskScoreCache);
+    # None not to cache them
+    self.rscore_cache = RSCORE_CACHE
+    # Number of reactions scored at once in iterRScores
+    self.rscore_chunk_size = RSCORE_CHUNK_SIZE
+    # {species_id: [reaction ids]}
+    self.species_reactions = getSpeciesReactions(self.reaction_components)
+    self.resetRScoreState()
+
+  def resetRScoreState(self):
+    """
+    Remove the state of getRScores(keep_state=True).
+    New objects are assigned, so a (shallow) copy
+    of this object gets a state of its own.
+    """
+    # formulas of species, {species_id: set of formulas},
+    # and overlaps of reactions, {reaction_id:
+    # (Counter of formula indices, Rhea rows, overlap counts)};
+    # updated by updateSpeciesFormulas
+    self.spec_formulas = dict()
+    self.overlaps = dict()
+    # (mssc, cutoff) of the kept reactions
+    self.rscore_params = None
 
   def getReactionComponents(self,
                             inp_reaction):
@@ -106,11 +385,18 @@ class ReactionAnnotation(object):
                  reacs,
                  mssc,
                  cutoff,
-                 ref_mat=REF_MAT):
+                 ref_mat=None,
+                 keep_state=False,
+                 use_cache=True):
     """
     Get a sorted list of
     Rhea-rScore tuples.
     [(RHEA:XXXXX, 1.0), etc.]
+    With keep_state=True, formulas of species and
+    overlaps of reactions are kept, so that
+    reactions can be re-scored when formulas of species
+    change (getPatchedRScores, updateSpeciesFormulas).
+    To score many reactions in chunks, use iterRScores.
   
     Parameters
     ----------
@@ -127,7 +413,14 @@ class ReactionAnnotation(object):
         Cutoff value; only candidates with match score
         at or above the cutoff will be recommended.
     ref_mat: pd.DataFrame
-        Reference matrix
+        Reference matrix;
+        if None, use REF_MAT_SPARSE
+    keep_state: bool
+        If True, keep the state of reacs
+        (only with REF_MAT_SPARSE), replacing any earlier state
+    use_cache: bool
+        If True, rScores of formula sets are served from
+        (and saved in) self.rscore_cache (only with REF_MAT_SPARSE)
       
     Returns
     -------
@@ -167,43 +460,286 @@ class ReactionAnnotation(object):
     # return j_rscores
 
     # BELOW IS THE ORIGINAL MINI-MAX VERSION
-    # Get dictionary of reaction ID: species component
-    r2pred_spec_formulas = dict()
-    for one_rid in reacs:
-      r2pred_spec_formulas[one_rid] = {spec:spec_dict[spec] \
-                                       for spec in self.reaction_components[one_rid]}
-    # prepare query df for prediction
-    query_df = pd.DataFrame(0, 
-                            index=ref_mat.columns,
-                            columns=reacs)
-    for one_rid in reacs:
-      one_set_species = r2pred_spec_formulas[one_rid]
-      # for each species element of the select reaction
-      for spec_key in one_set_species.keys():
-        one_spec = one_set_species[spec_key]
-        # For each one_rid, set the values 1.0
-        query_df.loc[[val for val in one_spec if val in query_df.index], one_rid] = 1
-    multi_mat = ref_mat.dot(query_df)
-    # new minimax of reference value
-    # max_multi_mat = np.max(multi_mat)
-    max_multi_mat = multi_mat.max()
-    query_colsum = pd.Series(0, index=max_multi_mat.index)
-    for idx in query_colsum.index:
-      query_colsum.at[idx] = np.min(np.sum(ref_mat.loc[multi_mat[multi_mat[idx]==max_multi_mat[idx]][idx].index,:],1))
-    # divided 
-    div_mat = multi_mat.divide(query_colsum, axis=1)
+    keep_state = keep_state and ref_mat is None
+    if keep_state:
+      self.resetRScoreState()
+    mat, rheas, formulas, row_nnz = getReferenceMatrix(ref_mat)
+    # overlaps are counted over the posting lists
+    # (Rhea terms) of the formulas of each reaction
+    if ref_mat is None:
+      postings = cn.loadReference('REF_MAT_POSTINGS')
+    else:
+      postings = mat.tocsc()
+    rhea_labels = rheas.to_numpy(dtype=object)
+    specs = set(itertools.chain(*[self.reaction_components[val] for val in reacs]))
+    spec_idxs = {spec:self.getFormulaIndices(spec_dict[spec], formulas) for spec in specs}
+    # number of species of each reaction with each formula
+    formula_counts = {one_rid:collections.Counter(itertools.chain(*[spec_idxs[spec] \
+                                                  for spec in self.reaction_components[one_rid]])) \
+                      for one_rid in reacs}
+    # reactions with the same set of (known) formulas,
+    # e.g., transports between compartments, are scored once;
+    # {frozenset of formula indices: rScores}
+    formula_sets = {one_rid:frozenset(formula_counts[one_rid].keys()) for one_rid in reacs}
+    groups = dict()
+    use_cache = use_cache and self.rscore_cache is not None and ref_mat is None
+    if use_cache:
+      set_names = {val:self.getFormulaSetName(val, formulas) \
+                   for val in dict.fromkeys(formula_sets.values())}
+      found = self.rscore_cache.get(list(set_names.values()), 'rscore', mssc, cutoff)
+      for one_set, one_name in set_names.items():
+        if one_name in found:
+          groups[one_set] = sc.filterScores(found[one_name][1], cutoff)
+    # {frozenset of formula indices: (Rhea rows, overlap counts)}
+    overlaps = dict()
+    computed = dict()
+    for one_set in dict.fromkeys(formula_sets.values()):
+      if one_set in groups and not keep_state:
+        continue
+      overlaps[one_set] = getRheaOverlaps(postings, np.fromiter(one_set, dtype=np.int64))
+      if one_set not in groups:
+        rows, counts = overlaps[one_set]
+        # new minimax of reference value
+        groups[one_set] = getOverlapRScores(rows=rows,
+                                            counts=counts,
+                                            row_nnz=row_nnz,
+                                            rhea_labels=rhea_labels,
+                                            mssc=mssc,
+                                            cutoff=cutoff)
+        if use_cache:
+          computed[set_names[one_set]] = groups[one_set]
+    if computed:
+      self.rscore_cache.put(computed, 'rscore', mssc, cutoff)
     rscores = dict()
-    for reac in reacs:
-      reac_rscore = tools.applyMSSC(pred=zip(div_mat.index, div_mat[reac]),
-                                    mssc=mssc,
-                                    cutoff=cutoff)
-      reac_rscore.sort(key=operator.itemgetter(1), reverse=True)
-      rscores[reac] = reac_rscore    
+    for one_rid in reacs:
+      if keep_state:
+        self.overlaps[one_rid] = (formula_counts[one_rid],) + overlaps[formula_sets[one_rid]]
+      rscores[one_rid] = list(groups[formula_sets[one_rid]])
+    if keep_state:
+      self.spec_formulas.update({spec:set(spec_dict[spec]) for spec in specs})
+      self.rscore_params = (mssc, cutoff)
+    return rscores
+
+  def iterRScores(self,
+                  spec_dict,
+                  reacs,
+                  mssc,
+                  cutoff,
+                  chunk_size=None,
+                  use_cache=True):
+    """
+    Score reactions in chunks (getRScores),
+    yielding the result of each chunk,
+    so that results of all reactions
+    don't have to be kept at once (e.g.,
+    for genome-scale models).
+    Reactions with the same formulas are
+    scored once within each chunk; use
+    self.rscore_cache to share them across chunks.
+
+    Parameters
+    ----------
+    spec_dict: dict
+        {species id: formula(str-list)}
+    reacs: str-list
+        IDs of reactions
+    mssc: str
+    cutoff: float
+    chunk_size: int
+        Number of reactions in a chunk;
+        if None, use self.rscore_chunk_size
+    use_cache: bool
+        See getRScores
+
+    Yields
+    ------
+    :dict
+        {reaction_id: [(Rhea:XXXXX, 1.0), ...]}
+        of reactions in a chunk, in the order of reacs
+    """
+    if chunk_size is None:
+      chunk_size = self.rscore_chunk_size
+    reacs = list(reacs)
+    if not chunk_size:
+      chunk_size = max(len(reacs), 1)
+    for chunk_start in range(0, len(reacs), chunk_size):
+      yield self.getRScores(spec_dict=spec_dict,
+                            reacs=reacs[chunk_start:chunk_start+chunk_size],
+                            mssc=mssc,
+                            cutoff=cutoff,
+                            use_cache=use_cache)
+
+  def getFormulaSetName(self, formula_set, formulas=None):
+    """
+    Get the canonical name of a set of formulas,
+    used as the key of self.rscore_cache.
+
+    Parameters
+    ----------
+    formula_set: frozenset-int
+        Column indices of formulas
+    formulas: pandas.Index
+        If None, use REF_MAT_COLUMNS
+
+    Returns
+    -------
+    str
+        Sorted formulas in JSON
+    """
+    if formulas is None:
+      formulas = cn.loadReference('REF_MAT_COLUMNS')
+    return json.dumps(sorted(formulas[idx] for idx in formula_set))
+
+  def getFormulaIndices(self, one_formulas, formulas=None):
+    """
+    Get column indices of formulas
+    in the reference matrix,
+    ignoring unknown formulas.
+
+    Parameters
+    ----------
+    one_formulas: list-str
+    formulas: pandas.Index
+        If None, use REF_MAT_COLUMNS
+
+    Returns
+    -------
+    : list-int
+        Unique indices
+    """
+    if formulas is None:
+      formulas = cn.loadReference('REF_MAT_COLUMNS')
+    col_idx = formulas.get_indexer(list(set(one_formulas)))
+    return col_idx[col_idx >= 0].tolist()
+
+  def getPatchedOverlaps(self, spec_dict):
+    """
+    Get overlaps of kept reactions
+    (getRScores with keep_state=True)
+    after formulas of species change;
+    only reactions with the changed species are
+    patched (patchRheaOverlaps). The state is not changed.
+
+    Parameters
+    ----------
+    spec_dict: dict
+        {species id: formula(str-list)};
+        species that are not kept, or
+        with the same formulas, are ignored
+
+    Returns
+    -------
+    changed: dict
+        {species_id: set of formulas}
+    patched: dict
+        {reaction_id: (Counter of formula indices,
+                       Rhea rows, overlap counts)}
+    """
+    postings = cn.loadReference('REF_MAT_POSTINGS')
+    changed = {spec:set(val) for spec, val in spec_dict.items() \
+               if spec in self.spec_formulas and set(val) != self.spec_formulas[spec]}
+    patched = dict()
+    for spec, new_formulas in changed.items():
+      old_idxs = set(self.getFormulaIndices(self.spec_formulas[spec]))
+      new_idxs = set(self.getFormulaIndices(new_formulas))
+      for one_rid in self.species_reactions.get(spec, []):
+        if one_rid not in self.overlaps:
+          continue
+        formula_counts, rows, counts = patched.get(one_rid, self.overlaps[one_rid])
+        formula_counts = formula_counts.copy()
+        # formulas entering or leaving the reaction
+        added = [idx for idx in new_idxs - old_idxs if formula_counts[idx] == 0]
+        formula_counts.update(new_idxs - old_idxs)
+        formula_counts.subtract(old_idxs - new_idxs)
+        removed = [idx for idx in old_idxs - new_idxs if formula_counts[idx] == 0]
+        rows, counts = patchRheaOverlaps(postings, rows, counts, added, removed)
+        patched[one_rid] = (+formula_counts, rows, counts)
+    return changed, patched
+
+  def getPatchedRScores(self, spec_dict):
+    """
+    Get rScores of kept reactions
+    that contain species whose formulas change,
+    with the mssc and cutoff they were scored with;
+    other reactions keep their rScores.
+    The state is not changed.
+
+    Parameters
+    ----------
+    spec_dict: dict
+        {species id: formula(str-list)}
+
+    Returns
+    -------
+    :dict
+        {reaction_id: [(Rhea:XXXXX, 1.0), ...]}
+        of re-scored reactions
+    """
+    _, patched = self.getPatchedOverlaps(spec_dict)
+    return self.getKeptRScores(patched)
+
+  def updateSpeciesFormulas(self, spec_dict, candidates=None):
+    """
+    Change formulas of species in the state,
+    re-score only the kept reactions containing them,
+    and patch their candidates in place.
+
+    Parameters
+    ----------
+    spec_dict: dict
+        {species id: formula(str-list)}
+    candidates: dict
+        {reaction_id: [(Rhea:XXXXX, 1.0), ...]};
+        if None, use self.candidates
+
+    Returns
+    -------
+    :dict
+        {reaction_id: [(Rhea:XXXXX, 1.0), ...]}
+        of re-scored reactions
+    """
+    changed, patched = self.getPatchedOverlaps(spec_dict)
+    self.spec_formulas.update(changed)
+    self.overlaps.update(patched)
+    rscores = self.getKeptRScores(patched)
+    if candidates is None:
+      candidates = self.candidates
+    if candidates is not None:
+      candidates.update(rscores)
     return rscores
 
+  def getKeptRScores(self, overlaps):
+    """
+    Get rScores from overlaps
+    with the kept mssc and cutoff.
+
+    Parameters
+    ----------
+    overlaps: dict
+        {reaction_id: (Counter of formula indices,
+                       Rhea rows, overlap counts)}
+
+    Returns
+    -------
+    :dict
+        {reaction_id: [(Rhea:XXXXX, 1.0), ...]}
+    """
+    if not overlaps:
+      return dict()
+    mssc, cutoff = self.rscore_params
+    row_nnz = cn.loadReference('REF_MAT_ROW_NNZ')
+    rhea_labels = cn.loadReference('REF_MAT_INDEX').to_numpy(dtype=object)
+    return {one_rid:getOverlapRScores(rows=rows,
+                                      counts=counts,
+                                      row_nnz=row_nnz,
+                                      rhea_labels=rhea_labels,
+                                      mssc=mssc,
+                                      cutoff=cutoff) \
+            for one_rid, (_, rows, counts) in overlaps.items()}
+
   def getRheaElementNum(self,
                         inp_rhea,
-                        inp_df=REF_MAT):
+                        inp_df=None):
     """
     Get Number of elements of
     the given rhea term.
@@ -211,11 +747,13 @@ class ReactionAnnotation(object):
     Parameters
     ----------
     inp_rhea: str
+    inp_df: pd.DataFrame
+        Reference matrix;
+        if None, use REF_MAT_SPARSE
     
     Returns
     -------
     : int
     """
-    return len(inp_df.loc[inp_rhea, :].to_numpy().nonzero()[0])
-
-
+    _, rheas, _, row_nnz = getReferenceMatrix(inp_df)
+    return int(row_nnz[rheas.get_loc(inp_rhea)])
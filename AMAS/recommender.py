@@ -197,9 +197,11 @@ class Recommender(object):
     pred_id: str
         ID of species (search for name using it)
     method: str
-        One of ['cdist', 'edist']
+        One of ['cdist', 'edist', 'hybrid']
         'cdist' represents Cosine Similarity
         'edist' represents Edit Distance.
+        'hybrid' re-ranks candidates of 'cdist'
+        with Edit Distance.
         Default method id 'cdist'
     mssc: match score selection criteria
         'top' will recommend candidates with
@@ -281,7 +283,8 @@ class Recommender(object):
                                    mssc='top',
                                    cutoff=0.0,
                                    update=True,
-                                   get_df=False):
+                                   get_df=False,
+                                   workers=1):
     """
     Get annotation of multiple species,
     given as a list (or an iterable object).
@@ -296,9 +299,11 @@ class Recommender(object):
         :Species IDs to predict annotations with
          (model info should have been already loaded)
     method: str
-        One of ['cdist', 'edist']
+        One of ['cdist', 'edist', 'hybrid']
         'cdist' represents Cosine Similarity
         'edist' represents Edit Distance.
+        'hybrid' re-ranks candidates of 'cdist'
+        with Edit Distance.
         Default method id 'cdist'
     mssc: match score selection criteria
         'top' will recommend candidates with
@@ -315,13 +320,16 @@ class Recommender(object):
     get_df: bool
         If True, return a list of pandas.DataFrame.
         If False, return a list of cn.Recommendation
+    workers: int
+        Number of processes to compute match scores;
+        if more than 1, unique names are split across
+        a process pool attached to the reference tables
+        in shared memory (see SpeciesAnnotation.getParallelScores)
 
     Returns
     -------
     list-Recommendation (list-namedtuple) / list-str
     """
-    scoring_methods = {'edist': self.species.getEScores,
-                       'cdist': self.species.getCScores} 
     if pred_strs: 
       ids_dict = {k:k for k in pred_strs}
       inp_strs = pred_strs
@@ -329,18 +337,28 @@ class Recommender(object):
       ids_dict = {k:self.species.getNameToUse(inp_id=k) \
                   for k in pred_ids}
       inp_strs = [ids_dict[k] for k in ids_dict.keys()]
-    pred_res = scoring_methods[method](inp_strs=inp_strs,
-                                       mssc=mssc,
-                                       cutoff=cutoff)
+    # exact matches are resolved before scoring;
+    # see self.species.tier_counts
+    pred_res = self.species.getTieredScores(inp_strs=inp_strs,
+                                            method=method,
+                                            mssc=mssc,
+                                            cutoff=cutoff,
+                                            workers=workers)
+    # species sharing a name (e.g., in different compartments)
+    # share candidates, URLs and labels, made once per name
+    name_recoms = dict()
+    for one_name in dict.fromkeys(ids_dict.values()):
+      name_recoms[one_name] = ([(val[0], np.round(val[1], cn.ROUND_DIGITS)) \
+                                for val in pred_res[one_name]],
+                               [cn.CHEBI_DEFAULT_URL + val[0][6:] for val in pred_res[one_name]],
+                               [cn.REF_CHEBI2LABEL[val[0]] for val in pred_res[one_name]])
     result = []
     for spec in ids_dict.keys():
-      urls = [cn.CHEBI_DEFAULT_URL + val[0][6:] for val in pred_res[ids_dict[spec]]]
-      labels = [cn.REF_CHEBI2LABEL[val[0]] for val in pred_res[ids_dict[spec]]]
+      cands, urls, labels = name_recoms[ids_dict[spec]]
       one_recom = cn.Recommendation(spec,
-                                    [(val[0], np.round(val[1], cn.ROUND_DIGITS)) \
-                                     for val in pred_res[ids_dict[spec]]],
-                                    urls,
-                                    labels)
+                                    list(cands),
+                                    list(urls),
+                                    list(labels))
       result.append(one_recom)
       if update:
          _ = self.species.updateSpeciesWithRecommendation(one_recom)
@@ -376,6 +394,7 @@ class Recommender(object):
         Method to use if to directly predict species annotation;
         if 'cdist' Cosine Similarity
         if 'edist' Edit distance
+        if 'hybrid' Cosine Similarity re-ranked by Edit distance
     mssc: match score selection criteria
         'top' will recommend candidates with
         the highest match score above cutoff
@@ -482,6 +501,7 @@ class Recommender(object):
         Method to use if to directly predict species annotation;
         if 'cdist' Cosine Similarity
         if 'edist' Edit distance
+        if 'hybrid' Cosine Similarity re-ranked by Edit distance
     mssc: match score selection criteria
         'top' will recommend candidates with
         the highest match score above cutoff
@@ -0,0 +1,610 @@
+# reference_bundle.py
+"""
+Precompiled reference bundle.
+buildBundle() converts the compressed (lzma) pickles
+in cn.REF_DIR into an uncompressed, columnar bundle
+(numpy .npy arrays, offset-indexed string tables
+and CSR triplets) under cn.BUNDLE_DIR
+(or the folder in the environment variable AMAS_BUNDLE_DIR).
+Once built, reference tables are opened with mmap
+instead of being decompressed by every process,
+so the OS page cache is shared between processes.
+
+Usage: python -m AMAS.reference_bundle [-o BUNDLE_DIR]
+"""
+
+import argparse
+import json
+import numpy as np
+import os
+import pandas as pd
+import shutil
+import tempfile
+import warnings
+
+from AMAS import constants as cn
+
+
+MANIFEST = 'manifest.json'
+# Increase when the layout of the bundle changes
+BUNDLE_FORMAT = 3
+
+# Kinds of reference tables
+MAPPING = 'mapping'      # {str: str}
+MULTIMAP = 'multimap'    # {str: [str]}
+SPARSE = 'sparse'        # REF_DAT; (columns, indices, [(column, [rows])])
+FRAME = 'frame'          # pandas.DataFrame of numeric and string columns
+COMPACT = 'compact'      # species_annotation.CompactCharCount
+SYNONYMS = 'synonyms'    # synonym_index.SynonymIndex
+BLOCKS = 'blocks'        # species_annotation.CosineBlockIndex
+PROFILES = 'profiles'    # species_annotation.CountProfileIndex
+
+# {name of reference: (source file, kind)}
+BUNDLE_SOURCES = {'REF_CHEBI2FORMULA': ('chebi_shortened_formula_comp.lzma', MAPPING),
+                  'REF_CHEBI2LABEL': ('chebi2label.lzma', MAPPING),
+                  'REF_EC2RHEA': ('ec2mrhea.lzma', MULTIMAP),
+                  'REF_KEGG2RHEA': ('kegg2mrhea.lzma', MULTIMAP),
+                  'REF_RHEA2MASTER': ('rhea_all2master.lzma', MAPPING),
+                  'REF_RHEA2CHEBI': ('mrhea2chebi_prime.lzma', MULTIMAP),
+                  'REF_RHEA2LABEL': ('rhea2label.lzma', MAPPING),
+                  'REF_RHEA2ECKEGG': ('mrhea2eckegg.lzma', MULTIMAP),
+                  'CHEBI_LOW_SYNONYMS': ('chebi_low_synonyms_comp.lzma', MULTIMAP),
+                  'CHARCOUNT_COMB_DF': ('charcount_df_scaled.lzma', FRAME),
+                  'CHARCOUNT_COMPACT': ('charcount_df_scaled.lzma', COMPACT),
+                  'CHARCOUNT_BLOCKS': ('charcount_df_scaled.lzma', BLOCKS),
+                  'CHARCOUNT_PROFILES': ('charcount_df_scaled.lzma', PROFILES),
+                  'SYNONYM_INDEX': ('chebi_low_synonyms_comp.lzma', SYNONYMS),
+                  'REF_DAT': ('data2ref_mat.lzma', SPARSE)}
+
+# Loaded manifest, {bundle_dir: dict}
+_MANIFESTS = dict()
+# Arrays of bundles attached from shared memory
+# (see shared_reference.py), used instead of the files;
+# {bundle_dir: {'NAME.part': numpy.ndarray}}
+_SHARED_ARRAYS = dict()
+
+
+class StringTable(object):
+  """
+  Read-only table of strings
+  stored as one utf-8 buffer (uint8)
+  and an offset array (int64) of length n+1;
+  i-th string is data[offsets[i]:offsets[i+1]].
+  """
+
+  def __init__(self, data, offsets):
+    """
+    Parameters
+    ----------
+    data: numpy.ndarray (uint8)
+    offsets: numpy.ndarray (int64)
+    """
+    self.data = data
+    self.offsets = offsets
+
+  def __len__(self):
+    return len(self.offsets) - 1
+
+  def __getitem__(self, idx):
+    start, end = self.offsets[idx], self.offsets[idx+1]
+    return self.data[start:end].tobytes().decode('utf-8')
+
+  def tolist(self):
+    """
+    Decode all strings at once.
+
+    Returns
+    -------
+    : list-str
+    """
+    raw = self.data.tobytes()
+    offs = self.offsets.tolist()
+    # byte offsets are character offsets of ascii text
+    if raw.isascii():
+      text = raw.decode('ascii')
+      return [text[start:end] for start, end in zip(offs[:-1], offs[1:])]
+    return [raw[start:end].decode('utf-8') \
+            for start, end in zip(offs[:-1], offs[1:])]
+
+
+def getSourceInfo(fname):
+  """
+  Get size and modification time
+  of a source file in cn.REF_DIR,
+  used to detect a stale bundle.
+
+  Parameters
+  ----------
+  fname: str
+
+  Returns
+  -------
+  : dict/None
+  """
+  fpath = os.path.join(cn.REF_DIR, fname)
+  if not os.path.exists(fpath):
+    return None
+  stat = os.stat(fpath)
+  return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def _getPath(bundle_dir, name, part):
+  return os.path.join(bundle_dir, '%s.%s.npy' % (name, part))
+
+def _saveArray(bundle_dir, name, part, arr):
+  np.save(_getPath(bundle_dir, name, part), arr, allow_pickle=False)
+
+def _loadArray(bundle_dir, name, part):
+  if bundle_dir in _SHARED_ARRAYS:
+    return _SHARED_ARRAYS[bundle_dir]['%s.%s' % (name, part)]
+  return np.load(_getPath(bundle_dir, name, part), mmap_mode='r', allow_pickle=False)
+
+def encodeStringTable(strs):
+  """
+  Encode strings as the two arrays
+  of a StringTable.
+
+  Parameters
+  ----------
+  strs: list-str
+
+  Returns
+  -------
+  data: numpy.ndarray (uint8)
+  offsets: numpy.ndarray (int64)
+  """
+  encoded = [val.encode('utf-8') for val in strs]
+  offsets = np.zeros(len(encoded)+1, dtype=np.int64)
+  np.cumsum([len(val) for val in encoded], out=offsets[1:])
+  data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+  return data, offsets
+
+def _saveStringTable(bundle_dir, name, part, strs):
+  data, offsets = encodeStringTable(strs)
+  _saveArray(bundle_dir, name, part + '_data', data)
+  _saveArray(bundle_dir, name, part + '_offsets', offsets)
+
+def loadStringTable(bundle_dir, name, part):
+  """
+  Open a string table of the bundle.
+
+  Parameters
+  ----------
+  bundle_dir: str
+  name: str
+      Name of reference
+  part: str
+      Name of the string table
+
+  Returns
+  -------
+  : StringTable
+  """
+  return StringTable(data=_loadArray(bundle_dir, name, part + '_data'),
+                     offsets=_loadArray(bundle_dir, name, part + '_offsets'))
+
+def _saveMapping(bundle_dir, name, ref):
+  _saveStringTable(bundle_dir, name, 'keys', list(ref.keys()))
+  _saveStringTable(bundle_dir, name, 'values', list(ref.values()))
+  return {}
+
+def _saveMultimap(bundle_dir, name, ref):
+  keys = list(ref.keys())
+  indptr = np.zeros(len(keys)+1, dtype=np.int64)
+  np.cumsum([len(ref[k]) for k in keys], out=indptr[1:])
+  _saveStringTable(bundle_dir, name, 'keys', keys)
+  _saveArray(bundle_dir, name, 'indptr', indptr)
+  _saveStringTable(bundle_dir, name, 'values', [val for k in keys for val in ref[k]])
+  return {}
+
+def _saveSparse(bundle_dir, name, ref):
+  cols, inds, pairs = ref
+  # (row, column) coordinates of non-zero values
+  row_idx = np.concatenate([np.asarray(val[1], dtype=np.int64) for val in pairs])
+  col_idx = np.concatenate([np.full(len(val[1]), val[0], dtype=np.int64) for val in pairs])
+  # CSR, rows ordered and columns sorted within each row;
+  # duplicated pairs are stored once (values are 1)
+  coords = np.unique(np.column_stack([row_idx, col_idx]), axis=0)
+  indptr = np.zeros(len(inds)+1, dtype=np.int64)
+  np.cumsum(np.bincount(coords[:, 0], minlength=len(inds)), out=indptr[1:])
+  _saveArray(bundle_dir, name, 'indptr', indptr)
+  _saveArray(bundle_dir, name, 'indices', coords[:, 1].astype(np.int32))
+  _saveStringTable(bundle_dir, name, 'rows', list(inds))
+  _saveStringTable(bundle_dir, name, 'columns', list(cols))
+  return {}
+
+def _saveFrame(bundle_dir, name, ref):
+  num_cols = [val for val in ref.columns \
+              if pd.api.types.is_numeric_dtype(ref[val])]
+  obj_cols = [val for val in ref.columns if val not in num_cols]
+  _saveArray(bundle_dir, name, 'values',
+             np.ascontiguousarray(ref.loc[:, num_cols].to_numpy()))
+  _saveStringTable(bundle_dir, name, 'columns', [str(val) for val in num_cols])
+  for idx, one_col in enumerate(obj_cols):
+    _saveStringTable(bundle_dir, name, 'object%d' % idx,
+                     [str(val) for val in ref[one_col]])
+  if pd.api.types.is_integer_dtype(ref.index):
+    _saveArray(bundle_dir, name, 'index', ref.index.to_numpy(dtype=np.int64))
+    index_kind = 'int'
+  else:
+    _saveStringTable(bundle_dir, name, 'index', [str(val) for val in ref.index])
+    index_kind = 'str'
+  return {'object_columns': [str(val) for val in obj_cols],
+          'index': index_kind}
+
+def _saveCompact(bundle_dir, name, ref):
+  # imported here; species_annotation imports this module
+  from AMAS import species_annotation as sa
+  compact = sa.buildCompactCharCount(ref.iloc[:, :-2], ref.iloc[:, -2:])
+  for part in ['counts', 'sq_norms', 'codes', 'starts']:
+    _saveArray(bundle_dir, name, part, getattr(compact, part))
+  _saveStringTable(bundle_dir, name, 'labels', list(compact.labels))
+  _saveStringTable(bundle_dir, name, 'columns', list(compact.columns))
+  return {}
+
+# Arrays of synonym_index.SynonymIndex
+SYNONYM_ARRAYS = ['owners', 'lens', 'len_starts', 'gram_keys',
+                  'gram_starts', 'post_strs', 'post_counts',
+                  'chars', 'char_ids', 'str_starts',
+                  'del_keys', 'del_strs']
+
+def _saveSynonyms(bundle_dir, name, ref):
+  from AMAS import synonym_index as si
+  syn_index = si.SynonymIndex.build(ref)
+  for part in SYNONYM_ARRAYS:
+    _saveArray(bundle_dir, name, part, np.asarray(getattr(syn_index, part)))
+  _saveStringTable(bundle_dir, name, 'strs', syn_index.strs)
+  _saveStringTable(bundle_dir, name, 'labels', list(syn_index.labels))
+  return {'q': syn_index.q}
+
+# Arrays of species_annotation.CosineBlockIndex
+BLOCK_ARRAYS = ['rows', 'starts', 'lower', 'upper',
+                'counts', 'sq_norms', 'codes']
+
+def _saveBlocks(bundle_dir, name, ref):
+  from AMAS import species_annotation as sa
+  index = sa.buildCosineBlockIndex(sa.buildCompactCharCount(ref.iloc[:, :-2], ref.iloc[:, -2:]))
+  for part in BLOCK_ARRAYS:
+    _saveArray(bundle_dir, name, part, getattr(index, part))
+  return {}
+
+# Arrays of species_annotation.CountProfileIndex
+PROFILE_ARRAYS = ['keys', 'rows']
+
+def _saveProfiles(bundle_dir, name, ref):
+  from AMAS import species_annotation as sa
+  index = sa.buildCountProfileIndex(sa.buildCompactCharCount(ref.iloc[:, :-2], ref.iloc[:, -2:]))
+  for part in PROFILE_ARRAYS:
+    _saveArray(bundle_dir, name, part, getattr(index, part))
+  return {}
+
+_SAVERS = {MAPPING: _saveMapping,
+           MULTIMAP: _saveMultimap,
+           SPARSE: _saveSparse,
+           FRAME: _saveFrame,
+           COMPACT: _saveCompact,
+           SYNONYMS: _saveSynonyms,
+           BLOCKS: _saveBlocks,
+           PROFILES: _saveProfiles}
+
+
+def _linkParts(src_dir, dst_dir, name):
+  # hard links (or copies) of the files of a reference
+  for fname in os.listdir(src_dir):
+    if fname.startswith(name + '.') and fname.endswith('.npy'):
+      try:
+        os.link(os.path.join(src_dir, fname), os.path.join(dst_dir, fname))
+      except OSError:
+        shutil.copy2(os.path.join(src_dir, fname), os.path.join(dst_dir, fname))
+
+def buildBundle(bundle_dir=None, names=None):
+  """
+  Convert reference pickles into
+  the uncompressed bundle.
+  Missing source files are skipped.
+  The bundle is written into a temporary folder,
+  which then replaces bundle_dir, so that files
+  of the old bundle (e.g., memory-mapped by other
+  processes) are never overwritten.
+
+  Parameters
+  ----------
+  bundle_dir: str
+      Output folder; if None, use cn.BUNDLE_DIR
+  names: list-str
+      Names of references to convert;
+      if None, use all of BUNDLE_SOURCES
+
+  Returns
+  -------
+  : list-str
+      Names of converted references
+  """
+  if bundle_dir is None:
+    bundle_dir = cn.BUNDLE_DIR
+  if names is None:
+    names = list(BUNDLE_SOURCES.keys())
+  parent_dir = os.path.dirname(os.path.abspath(bundle_dir))
+  os.makedirs(parent_dir, exist_ok=True)
+  manifest_path = os.path.join(bundle_dir, MANIFEST)
+  manifest = {'format': BUNDLE_FORMAT, 'references': dict()}
+  if os.path.exists(manifest_path):
+    with open(manifest_path, 'r') as f:
+      old_manifest = json.load(f)
+    if old_manifest.get('format') == BUNDLE_FORMAT:
+      manifest = old_manifest
+  base_name = os.path.basename(os.path.abspath(bundle_dir))
+  new_dir = tempfile.mkdtemp(dir=parent_dir, prefix='.%s-' % base_name)
+  try:
+    converted = []
+    # {source file: loaded object}; a file can be used more than once
+    loaded = dict()
+    for name in names:
+      fname, kind = BUNDLE_SOURCES[name]
+      source = getSourceInfo(fname)
+      if source is None:
+        warnings.warn('%s was not found; %s is not bundled.' % (fname, name))
+        continue
+      if fname not in loaded:
+        loaded[fname] = cn.loadLZMAReference(fname)
+      info = _SAVERS[kind](new_dir, name, loaded[fname])
+      info.update({'kind': kind, 'source': fname})
+      info.update(source)
+      manifest['references'][name] = info
+      converted.append(name)
+    # other references of the old bundle are kept
+    for name in manifest['references'].keys():
+      if name not in converted:
+        _linkParts(bundle_dir, new_dir, name)
+    with open(os.path.join(new_dir, MANIFEST), 'w') as f:
+      json.dump(manifest, f, indent=1)
+    # a folder cannot replace a non-empty one
+    old_dir = None
+    if os.path.exists(bundle_dir):
+      old_dir = tempfile.mkdtemp(dir=parent_dir, prefix='.%s-old-' % base_name)
+      os.replace(bundle_dir, os.path.join(old_dir, 'bundle'))
+    os.replace(new_dir, bundle_dir)
+  except BaseException:
+    shutil.rmtree(new_dir, ignore_errors=True)
+    raise
+  if old_dir is not None:
+    # files still mapped by other processes stay valid until unmapped
+    shutil.rmtree(old_dir, ignore_errors=True)
+  _MANIFESTS.pop(bundle_dir, None)
+  return converted
+
+def getManifest(bundle_dir=None):
+  """
+  Read (and cache) the manifest of a bundle.
+
+  Parameters
+  ----------
+  bundle_dir: str
+      If None, use cn.BUNDLE_DIR
+
+  Returns
+  -------
+  : dict/None
+      None if the bundle doesn't exist
+      or is in an unsupported format
+  """
+  if bundle_dir is None:
+    bundle_dir = cn.BUNDLE_DIR
+    if bundle_dir not in _MANIFESTS and os.environ.get(cn.REFERENCE_STORE_ENV):
+      # imported here; shared_reference imports this module
+      from AMAS import shared_reference as sr
+      sr.attachStore(os.environ[cn.REFERENCE_STORE_ENV])
+  if bundle_dir not in _MANIFESTS:
+    manifest = None
+    manifest_path = os.path.join(bundle_dir, MANIFEST)
+    if os.path.exists(manifest_path):
+      with open(manifest_path, 'r') as f:
+        manifest = json.load(f)
+      if manifest.get('format') != BUNDLE_FORMAT:
+        manifest = None
+    _MANIFESTS[bundle_dir] = manifest
+  return _MANIFESTS[bundle_dir]
+
+def attachSharedBundle(manifest, arrays, bundle_dir=None):
+  """
+  Use arrays (e.g., in shared memory)
+  instead of the files of a bundle.
+
+  Parameters
+  ----------
+  manifest: dict
+      Manifest of the bundle
+  arrays: dict
+      {'NAME.part': numpy.ndarray}
+  bundle_dir: str
+      If None, use cn.BUNDLE_DIR
+  """
+  if bundle_dir is None:
+    bundle_dir = cn.BUNDLE_DIR
+  _SHARED_ARRAYS[bundle_dir] = arrays
+  _MANIFESTS[bundle_dir] = manifest
+
+def getBundledParts(name, bundle_dir=None):
+  """
+  Get names of the arrays (parts)
+  of a bundled reference.
+
+  Parameters
+  ----------
+  name: str
+  bundle_dir: str
+
+  Returns
+  -------
+  : list-str
+  """
+  if bundle_dir is None:
+    bundle_dir = cn.BUNDLE_DIR
+  if bundle_dir in _SHARED_ARRAYS:
+    keys = _SHARED_ARRAYS[bundle_dir].keys()
+  else:
+    keys = [val[:-len('.npy')] for val in os.listdir(bundle_dir) if val.endswith('.npy')]
+  return sorted(val[len(name)+1:] for val in keys if val.startswith(name + '.'))
+
+def hasBundledReference(name, bundle_dir=None):
+  """
+  Check whether an up-to-date
+  bundled version of a reference exists.
+  If the source file changed after the bundle
+  was built, the bundled version is not used.
+
+  Parameters
+  ----------
+  name: str
+  bundle_dir: str
+
+  Returns
+  -------
+  bool
+  """
+  manifest = getManifest(bundle_dir)
+  if manifest is None or name not in manifest['references']:
+    return False
+  info = manifest['references'][name]
+  source = getSourceInfo(info['source'])
+  if source is not None and \
+     (source['size'] != info['size'] or source['mtime_ns'] != info['mtime_ns']):
+    warnings.warn('Bundled %s is older than %s; rebuild the bundle.' % (name, info['source']))
+    return False
+  return True
+
+def loadSparseArrays(name, bundle_dir=None):
+  """
+  Open CSR triplets of a sparse reference
+  without building Python objects.
+
+  Parameters
+  ----------
+  name: str
+  bundle_dir: str
+
+  Returns
+  -------
+  indptr: numpy.ndarray
+  indices: numpy.ndarray
+  rows: StringTable
+  columns: StringTable
+  """
+  if bundle_dir is None:
+    bundle_dir = cn.BUNDLE_DIR
+  return (_loadArray(bundle_dir, name, 'indptr'),
+          _loadArray(bundle_dir, name, 'indices'),
+          loadStringTable(bundle_dir, name, 'rows'),
+          loadStringTable(bundle_dir, name, 'columns'))
+
+def loadBundledFrame(name, part=None, bundle_dir=None):
+  """
+  Open a bundled DataFrame.
+  Numeric values are a memory-mapped array.
+
+  Parameters
+  ----------
+  name: str
+  part: str
+      'numeric': numeric columns only
+      'object': string columns only
+      None: all columns (numeric first)
+  bundle_dir: str
+
+  Returns
+  -------
+  : pandas.DataFrame
+  """
+  if bundle_dir is None:
+    bundle_dir = cn.BUNDLE_DIR
+  info = getManifest(bundle_dir)['references'][name]
+  if info['index'] == 'int':
+    index = pd.Index(np.asarray(_loadArray(bundle_dir, name, 'index')))
+  else:
+    index = pd.Index(loadStringTable(bundle_dir, name, 'index').tolist())
+  frames = []
+  if part in (None, 'numeric'):
+    frames.append(pd.DataFrame(_loadArray(bundle_dir, name, 'values'),
+                               index=index,
+                               columns=loadStringTable(bundle_dir, name, 'columns').tolist(),
+                               copy=False))
+  if part in (None, 'object'):
+    frames.append(pd.DataFrame({one_col:loadStringTable(bundle_dir, name, 'object%d' % idx).tolist() \
+                                for idx, one_col in enumerate(info['object_columns'])},
+                               index=index))
+  if len(frames) == 1:
+    return frames[0]
+  return pd.concat(frames, axis=1)
+
+def loadBundledReference(name, bundle_dir=None):
+  """
+  Load a reference table from the bundle
+  in the same form as its pickled version.
+
+  Parameters
+  ----------
+  name: str
+  bundle_dir: str
+
+  Returns
+  -------
+  : dict/tuple/pandas.DataFrame
+      For COMPACT (SYNONYMS, BLOCKS, PROFILES), a dictionary
+      of fields of species_annotation.CompactCharCount
+      (arguments of synonym_index.SynonymIndex, fields of
+      species_annotation.CosineBlockIndex/CountProfileIndex)
+  """
+  if bundle_dir is None:
+    bundle_dir = cn.BUNDLE_DIR
+  info = getManifest(bundle_dir)['references'][name]
+  kind = info['kind']
+  if kind == MAPPING:
+    return dict(zip(loadStringTable(bundle_dir, name, 'keys').tolist(),
+                    loadStringTable(bundle_dir, name, 'values').tolist()))
+  elif kind == MULTIMAP:
+    keys = loadStringTable(bundle_dir, name, 'keys').tolist()
+    indptr = _loadArray(bundle_dir, name, 'indptr').tolist()
+    values = loadStringTable(bundle_dir, name, 'values').tolist()
+    return {k:values[indptr[idx]:indptr[idx+1]] for idx, k in enumerate(keys)}
+  elif kind == SPARSE:
+    indptr, indices, rows, cols = loadSparseArrays(name, bundle_dir)
+    row_idx = np.repeat(np.arange(len(rows)), np.diff(indptr))
+    order = np.argsort(indices, kind='stable')
+    col_counts = np.bincount(indices, minlength=len(cols))
+    pairs = [(col, val.tolist()) for col, val in \
+             enumerate(np.split(row_idx[order], np.cumsum(col_counts)[:-1])) \
+             if len(val) > 0]
+    return (cols.tolist(), rows.tolist(), pairs)
+  elif kind == FRAME:
+    return loadBundledFrame(name, bundle_dir=bundle_dir)
+  elif kind == COMPACT:
+    compact = {part:_loadArray(bundle_dir, name, part) \
+               for part in ['counts', 'sq_norms', 'codes', 'starts']}
+    compact['labels'] = np.array(loadStringTable(bundle_dir, name, 'labels').tolist(),
+                                 dtype=object)
+    compact['columns'] = loadStringTable(bundle_dir, name, 'columns').tolist()
+    return compact
+  elif kind == SYNONYMS:
+    syn_index = {part:_loadArray(bundle_dir, name, part) for part in SYNONYM_ARRAYS}
+    syn_index['strs'] = loadStringTable(bundle_dir, name, 'strs').tolist()
+    syn_index['labels'] = loadStringTable(bundle_dir, name, 'labels').tolist()
+    syn_index['q'] = info['q']
+    return syn_index
+  elif kind == BLOCKS:
+    return {part:_loadArray(bundle_dir, name, part) for part in BLOCK_ARRAYS}
+  elif kind == PROFILES:
+    return {part:_loadArray(bundle_dir, name, part) for part in PROFILE_ARRAYS}
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Build an uncompressed, memory-mappable reference bundle')
+  parser.add_argument('--outdir', '-o', type=str, default=cn.BUNDLE_DIR,
+                      help='folder to save the bundle; default is %s' % cn.BUNDLE_DIR)
+  args = parser.parse_args()
+  converted = buildBundle(bundle_dir=args.outdir)
+  print("Bundled %d references in %s" % (len(converted), args.outdir))
+  if os.path.abspath(args.outdir) != os.path.abspath(cn.BUNDLE_DIR):
+    print("Set %s=%s in processes using it" % (cn.BUNDLE_DIR_ENV, os.path.abspath(args.outdir)))
+
+
+if __name__ == '__main__':
+  main()
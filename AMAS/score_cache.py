@@ -0,0 +1,379 @@
+# score_cache.py
+"""
+In-process LRU cache of match scores
+of species names, used in front of
+SpeciesAnnotation.getCScores/getEScores/getHybridScores,
+optionally backed by an on-disk (SQLite) cache
+that is shared by processes and runs.
+Entries on disk are keyed by a hash of
+the reference data (REF_DIR/*.lzma),
+so they are not used once the data change.
+The same file can also cache rScores of reactions
+(ReactionAnnotation.getRScores) in another table.
+"""
+
+import collections
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+from AMAS import constants as cn
+
+
+# Default maximum number of cached (name, method, mssc) entries
+SCORE_CACHE_SIZE = 10000
+# Increase when scores of the same reference data change
+DISK_CACHE_FORMAT = 1
+# Max. number of names in one query of DiskScoreCache
+DISK_QUERY_SIZE = 500
+# Seconds to wait for a lock of the database
+DISK_TIMEOUT = 60.0
+# Default table of DiskScoreCache
+DISK_TABLE = 'scores'
+
+
+def filterScores(result, cutoff):
+  """
+  Filter a cached result by cutoff.
+
+  Parameters
+  ----------
+  result: list-tuple
+      [(CHEBI:XXXXX, score), ...]
+  cutoff: float
+
+  Returns
+  -------
+  : list-tuple
+  """
+  return [val for val in result if val[1] >= cutoff]
+
+def getReferenceVersion(ref_dir=None, fnames=None):
+  """
+  Get a hash of the reference data,
+  i.e., names and contents of *.lzma files.
+
+  Parameters
+  ----------
+  ref_dir: str
+      If None, use cn.REF_DIR
+  fnames: list-str
+      Names of files under ref_dir to hash;
+      if None, use all *.lzma files
+
+  Returns
+  -------
+  str
+  """
+  if ref_dir is None:
+    ref_dir = cn.REF_DIR
+  if fnames is None:
+    fpaths = glob.glob(os.path.join(ref_dir, '*.lzma'))
+  else:
+    fpaths = [os.path.join(ref_dir, val) for val in fnames]
+  version = hashlib.sha256(str(DISK_CACHE_FORMAT).encode('ascii'))
+  for fpath in sorted(fpaths):
+    version.update(os.path.basename(fpath).encode('utf-8'))
+    with open(fpath, 'rb') as f:
+      for block in iter(lambda: f.read(1 << 20), b''):
+        version.update(block)
+  return version.hexdigest()
+
+
+class DiskScoreCache(object):
+  """
+  Scoring results in an SQLite file;
+  rows are (version, normalized name, method, mssc,
+  cutoff, result), where version is the hash of
+  the reference data (getReferenceVersion) and
+  cutoff is the one the result was computed with.
+  Rows of other versions are removed when
+  the file is opened.
+  """
+
+  def __init__(self, path, version=None, ref_fnames=None, table=DISK_TABLE):
+    """
+    Parameters
+    ----------
+    path: str
+        Path of the SQLite file; created if missing
+    version: str
+        If None, use getReferenceVersion(fnames=ref_fnames)
+    ref_fnames: list-str
+        Reference files the scores depend on;
+        if None, all of them
+    table: str
+        Table of the rows; caches with
+        different versions need different tables
+    """
+    self.path = path
+    self.ref_fnames = ref_fnames
+    self.table = table
+    self._version = version
+    self._conn = None
+    self._pid = None
+    self._lock = threading.RLock()
+
+  @property
+  def version(self):
+    if self._version is None:
+      self._version = getReferenceVersion(fnames=self.ref_fnames)
+    return self._version
+
+  def getConnection(self):
+    """
+    Get the connection of this process,
+    creating the table if needed.
+
+    Returns
+    -------
+    : sqlite3.Connection
+    """
+    # a connection cannot be used by a forked process
+    if self._conn is None or self._pid != os.getpid():
+      conn = sqlite3.connect(self.path, timeout=DISK_TIMEOUT,
+                             check_same_thread=False)
+      with conn:
+        conn.execute('CREATE TABLE IF NOT EXISTS %s ' % self.table + \
+                     '(version TEXT, name TEXT, method TEXT, mssc TEXT, ' + \
+                     'cutoff REAL, result TEXT, ' + \
+                     'PRIMARY KEY (version, name, method, mssc))')
+        conn.execute('DELETE FROM %s WHERE version != ?' % self.table, (self.version,))
+      self._conn = conn
+      self._pid = os.getpid()
+    return self._conn
+
+  def get(self, names, method, mssc, cutoff):
+    """
+    Get cached results that
+    can serve the cutoff.
+
+    Parameters
+    ----------
+    names: list-str
+        Normalized names
+    method: str/tuple
+    mssc: str
+    cutoff: float
+
+    Returns
+    -------
+    : dict
+        {name: (computed cutoff, [(CHEBI:XXXXX, score), ...])}
+    """
+    found = dict()
+    with self._lock:
+      conn = self.getConnection()
+      for start in range(0, len(names), DISK_QUERY_SIZE):
+        chunk = names[start:start+DISK_QUERY_SIZE]
+        rows = conn.execute('SELECT name, cutoff, result FROM %s ' % self.table + \
+                            'WHERE version = ? AND method = ? AND mssc = ? AND cutoff <= ? ' + \
+                            'AND name IN (%s)' % ','.join('?' * len(chunk)),
+                            [self.version, json.dumps(method), mssc, cutoff] + chunk)
+        for name, computed_cutoff, result in rows:
+          found[name] = (computed_cutoff, [tuple(val) for val in json.loads(result)])
+    return found
+
+  def put(self, results, method, mssc, cutoff):
+    """
+    Save results computed with a cutoff.
+
+    Parameters
+    ----------
+    results: dict
+        {normalized name: [(CHEBI:XXXXX, score), ...]}
+    method: str/tuple
+    mssc: str
+    cutoff: float
+    """
+    rows = [(self.version, name, json.dumps(method), mssc, cutoff, json.dumps(result)) \
+            for name, result in results.items()]
+    with self._lock:
+      conn = self.getConnection()
+      with conn:
+        conn.executemany('INSERT OR REPLACE INTO %s VALUES (?, ?, ?, ?, ?, ?)' % self.table,
+                         rows)
+
+  def clear(self):
+    """
+    Remove all rows.
+    """
+    with self._lock:
+      conn = self.getConnection()
+      with conn:
+        conn.execute('DELETE FROM %s' % self.table)
+
+
+class ScoreCache(object):
+  """
+  Bounded LRU cache of scoring results;
+  {(normalized name, method, mssc): (cutoff, [(CHEBI:XXXXX, score), ...])}.
+  Results are computed with the requested cutoff (so that
+  scoring methods can prune candidates below it), and serve
+  any cutoff at or above the one they were computed with;
+  the cached result is filtered by the requested cutoff.
+  This holds for mssc='top' as well, since the top
+  candidates do not depend on the cutoff.
+  Misses of getScores are looked up in self.disk
+  (DiskScoreCache) before being computed.
+  """
+
+  def __init__(self, capacity=SCORE_CACHE_SIZE, disk_path=None):
+    """
+    Parameters
+    ----------
+    capacity: int
+        Maximum number of entries;
+        if 0, nothing is cached
+    disk_path: str
+        Path of an SQLite file (DiskScoreCache);
+        if None, nothing is cached on disk
+    """
+    self.capacity = capacity
+    self.hits = 0
+    self.misses = 0
+    # number of misses found in self.disk
+    self.disk_hits = 0
+    self.disk = None if disk_path is None else DiskScoreCache(disk_path)
+    self._entries = collections.OrderedDict()
+    self._lock = threading.RLock()
+
+  def __len__(self):
+    return len(self._entries)
+
+  @staticmethod
+  def normalize(name):
+    """
+    Normalize a name; names with the same
+    normalized form have the same scores.
+
+    Parameters
+    ----------
+    name: str
+
+    Returns
+    -------
+    str
+    """
+    return name.lower()
+
+  def get(self, name, method, mssc, cutoff):
+    """
+    Get a cached result,
+    counting a hit or a miss.
+
+    Parameters
+    ----------
+    name: str
+    method: str/tuple
+        e.g., 'cdist', 'edist', ('hybrid', 50)
+    mssc: str
+    cutoff: float
+
+    Returns
+    -------
+    : list-tuple/None
+        None if not cached
+    """
+    key = (self.normalize(name), method, mssc)
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None or entry[0] > cutoff:
+        self.misses += 1
+        return None
+      self._entries.move_to_end(key)
+      self.hits += 1
+    return filterScores(entry[1], cutoff)
+
+  def put(self, name, method, mssc, cutoff, result):
+    """
+    Cache a result, removing the
+    least recently used entries if full.
+
+    Parameters
+    ----------
+    name: str
+    method: str/tuple
+    mssc: str
+    cutoff: float
+        Cutoff the result was computed with
+    result: list-tuple
+    """
+    if self.capacity <= 0:
+      return
+    key = (self.normalize(name), method, mssc)
+    with self._lock:
+      self._entries[key] = (cutoff, result)
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.capacity:
+        self._entries.popitem(last=False)
+
+  def getScores(self,
+                inp_strs,
+                method,
+                mssc,
+                cutoff,
+                score_func):
+    """
+    Get scores of query strings from the cache
+    (or from self.disk); the others are computed
+    (once per normalized name) by score_func and cached.
+
+    Parameters
+    ----------
+    inp_strs: list-str
+    method: str/tuple
+    mssc: str
+    cutoff: float
+    score_func: callable
+        score_func(inp_strs=, mssc=, cutoff=) returns
+        {one_str: [(CHEBI:XXXXX, score), ...]}
+
+    Returns
+    -------
+    :dict
+        {one_str: [(CHEBI:XXXXX, score), ...]}
+    """
+    scores = dict()
+    # {normalized name: query string to compute}
+    missing = dict()
+    for spec in dict.fromkeys(inp_strs):
+      norm = self.normalize(spec)
+      if norm in missing:
+        continue
+      cached = self.get(spec, method, mssc, cutoff)
+      if cached is None:
+        missing[norm] = spec
+      else:
+        scores[norm] = cached
+    if missing and self.disk is not None:
+      found = self.disk.get(list(missing.keys()), method, mssc, cutoff)
+      for norm, (computed_cutoff, result) in found.items():
+        self.put(missing.pop(norm), method, mssc, computed_cutoff, result)
+        scores[norm] = filterScores(result, cutoff)
+      self.disk_hits += len(found)
+    if missing:
+      computed = score_func(inp_strs=list(missing.values()),
+                            mssc=mssc,
+                            cutoff=cutoff)
+      for norm, spec in missing.items():
+        self.put(spec, method, mssc, cutoff, computed[spec])
+        scores[norm] = computed[spec]
+      if self.disk is not None:
+        self.disk.put({norm:computed[spec] for norm, spec in missing.items()},
+                      method, mssc, cutoff)
+    return {spec:scores[self.normalize(spec)] for spec in inp_strs}
+
+  def clear(self):
+    """
+    Remove all entries (in memory) and
+    reset the counters.
+    """
+    with self._lock:
+      self._entries.clear()
+      self.hits = 0
+      self.misses = 0
+      self.disk_hits = 0
@@ -0,0 +1,404 @@
+# shared_reference.py
+"""
+Reference tables in shared memory.
+Arrays of loaded reference tables
+are copied once into multiprocessing.shared_memory
+segments; other processes (e.g., workers
+of a process pool) attach to the segments by name
+and rebuild the tables around them,
+instead of unpickling or loading their own copies.
+Strings are stored as string tables
+(see reference_bundle.StringTable).
+
+A reference store publishes the whole bundle
+under a well-known name, for processes
+that are not started by the publishing process;
+run the store with
+
+  python -m AMAS.shared_reference [--name NAME]
+
+and set the environment variable AMAS_REFERENCE_STORE=NAME
+(or call attachStore) in other processes.
+Their reference tables are then read from the store
+instead of the bundle folder. Arrays (e.g., REF_MAT_SPARSE,
+CHARCOUNT_COMPACT, SYNONYM_INDEX) are not copied;
+tables used as dictionaries are still built
+by each process from shared string tables.
+"""
+
+import argparse
+import json
+import numpy as np
+import pandas as pd
+import signal
+import threading
+from multiprocessing import resource_tracker
+from multiprocessing import shared_memory
+import warnings
+
+from AMAS import constants as cn
+from AMAS import reference_bundle as rb
+from AMAS import synonym_index as si
+
+
+# Arrays of species_annotation.CompactCharCount
+COMPACT_ARRAYS = ['counts', 'sq_norms', 'codes', 'starts']
+# Default name of the segment describing a reference store
+DEFAULT_STORE_NAME = 'amas_references'
+# Bytes of the length prefix of the store description
+STORE_HEADER_SIZE = 8
+# Seconds between checks for a stop of the store;
+# a wait without timeout can't be interrupted on Windows
+STORE_WAIT_SECONDS = 1.0
+
+# Segments attached by this process;
+# they must stay open while the arrays are used
+_ATTACHED = []
+# Name of the attached reference store, if any
+_STORE = {'name': None}
+
+
+def publishArray(arr):
+  """
+  Copy an array into a new
+  shared memory segment.
+
+  Parameters
+  ----------
+  arr: numpy.ndarray
+
+  Returns
+  -------
+  handle: tuple
+      (name of segment, dtype, shape)
+  segment: multiprocessing.shared_memory.SharedMemory
+      Has to be kept open (and unlinked)
+      by the caller
+  """
+  arr = np.ascontiguousarray(arr)
+  # a segment cannot be empty
+  segment = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+  shared_arr = np.ndarray(arr.shape, dtype=arr.dtype, buffer=segment.buf)
+  shared_arr[...] = arr
+  return (segment.name, arr.dtype.str, arr.shape), segment
+
+def openSegment(seg_name, track=True):
+  """
+  Open an existing shared memory segment.
+
+  Parameters
+  ----------
+  seg_name: str
+  track: bool
+      If False, the segment is not removed when
+      this process exits; use it when the segment
+      was created by an unrelated process,
+      which has its own resource tracker
+
+  Returns
+  -------
+  : multiprocessing.shared_memory.SharedMemory
+  """
+  try:
+    return shared_memory.SharedMemory(name=seg_name, track=track)
+  except TypeError:
+    # before Python 3.13, opened segments are always tracked
+    segment = shared_memory.SharedMemory(name=seg_name)
+    if not track:
+      resource_tracker.unregister(segment._name, 'shared_memory')
+    return segment
+
+def attachArray(handle, track=True):
+  """
+  Attach to an array published by publishArray.
+  The array is read-only.
+
+  Parameters
+  ----------
+  handle: tuple
+      (name of segment, dtype, shape)
+  track: bool
+      See openSegment
+
+  Returns
+  -------
+  arr: numpy.ndarray
+  segment: multiprocessing.shared_memory.SharedMemory
+  """
+  seg_name, dtype, shape = handle
+  segment = openSegment(seg_name, track=track)
+  arr = np.ndarray(tuple(shape), dtype=np.dtype(dtype), buffer=segment.buf)
+  arr.flags.writeable = False
+  return arr, segment
+
+def _addStringTable(arrays, part, strs):
+  arrays[part + '_data'], arrays[part + '_offsets'] = rb.encodeStringTable(strs)
+
+def _getStrings(arrays, part):
+  return rb.StringTable(data=arrays[part + '_data'],
+                        offsets=arrays[part + '_offsets']).tolist()
+
+def _packCompact(compact):
+  arrays = {part:getattr(compact, part) for part in COMPACT_ARRAYS}
+  _addStringTable(arrays, 'labels', compact.labels.tolist())
+  _addStringTable(arrays, 'columns', list(compact.columns))
+  return arrays, {}
+
+def _unpackCompact(arrays, info):
+  # imported here; species_annotation imports this module
+  from AMAS import species_annotation as sa
+  return sa.CompactCharCount(labels=np.array(_getStrings(arrays, 'labels'), dtype=object),
+                             columns=pd.Index(_getStrings(arrays, 'columns')),
+                             **{part:arrays[part] for part in COMPACT_ARRAYS})
+
+def _packSynonyms(syn_index):
+  arrays = {part:np.asarray(getattr(syn_index, part)) \
+            for part in rb.SYNONYM_ARRAYS + ['is_valid']}
+  _addStringTable(arrays, 'strs', syn_index.strs)
+  _addStringTable(arrays, 'labels', syn_index.labels.tolist())
+  return arrays, {'q': syn_index.q}
+
+def _unpackSynonyms(arrays, info):
+  syn_index = si.SynonymIndex(strs=_getStrings(arrays, 'strs'),
+                              labels=_getStrings(arrays, 'labels'),
+                              q=info['q'],
+                              **{part:arrays[part] for part in rb.SYNONYM_ARRAYS})
+  syn_index.is_valid = arrays['is_valid']
+  return syn_index
+
+def _packBlocks(index):
+  return {part:getattr(index, part) for part in rb.BLOCK_ARRAYS}, {}
+
+def _unpackBlocks(arrays, info):
+  from AMAS import species_annotation as sa
+  return sa.CosineBlockIndex(**{part:arrays[part] for part in rb.BLOCK_ARRAYS})
+
+def _packProfiles(index):
+  return {part:getattr(index, part) for part in rb.PROFILE_ARRAYS}, {}
+
+def _unpackProfiles(arrays, info):
+  from AMAS import species_annotation as sa
+  return sa.CountProfileIndex(**{part:arrays[part] for part in rb.PROFILE_ARRAYS})
+
+# {kind of reference: (pack, unpack)};
+# pack returns ({part: array}, info),
+# unpack rebuilds the table from them
+_PACKERS = {rb.COMPACT: (_packCompact, _unpackCompact),
+            rb.SYNONYMS: (_packSynonyms, _unpackSynonyms),
+            rb.BLOCKS: (_packBlocks, _unpackBlocks),
+            rb.PROFILES: (_packProfiles, _unpackProfiles)}
+
+
+def publishReferences(names):
+  """
+  Load reference tables (if not loaded yet)
+  and copy their arrays into shared memory.
+
+  Parameters
+  ----------
+  names: list-str
+      Names of references with kinds in _PACKERS,
+      e.g., ['CHARCOUNT_COMPACT', 'SYNONYM_INDEX']
+
+  Returns
+  -------
+  handles: dict
+      Picklable description of the segments;
+      {name: {'kind': str, 'info': dict, 'arrays': {part: handle}}}
+  segments: list-SharedMemory
+      Have to be released (releaseSegments)
+      after other processes are done
+  """
+  handles = dict()
+  segments = []
+  try:
+    for name in names:
+      kind = rb.BUNDLE_SOURCES[name][1]
+      arrays, info = _PACKERS[kind][0](cn.loadReference(name))
+      handles[name] = {'kind': kind, 'info': info, 'arrays': dict()}
+      for part, arr in arrays.items():
+        handles[name]['arrays'][part], segment = publishArray(arr)
+        segments.append(segment)
+  except Exception:
+    releaseSegments(segments)
+    raise
+  return handles, segments
+
+def attachReferences(handles):
+  """
+  Attach to reference tables published by
+  publishReferences, and cache them in this process
+  (i.e., cn.loadReference returns them).
+
+  Parameters
+  ----------
+  handles: dict
+      Output of publishReferences
+  """
+  for name, one_handle in handles.items():
+    arrays = dict()
+    for part, arr_handle in one_handle['arrays'].items():
+      arrays[part], segment = attachArray(arr_handle)
+      _ATTACHED.append(segment)
+    cn.setReference(name,
+                    _PACKERS[one_handle['kind']][1](arrays, one_handle['info']))
+
+def releaseSegments(segments):
+  """
+  Close and remove segments
+  created by publishReferences or publishStore.
+
+  Parameters
+  ----------
+  segments: list-SharedMemory
+  """
+  for segment in segments:
+    segment.close()
+    segment.unlink()
+
+def publishStore(store_name=DEFAULT_STORE_NAME, names=None, bundle_dir=None):
+  """
+  Publish bundled reference tables as a store:
+  all arrays of the bundle are copied into
+  shared memory, and a segment named store_name
+  describes them (manifest and segments of arrays).
+  References missing in the bundle are bundled first.
+
+  Parameters
+  ----------
+  store_name: str
+  names: list-str
+      Names of references; if None,
+      use all of reference_bundle.BUNDLE_SOURCES
+  bundle_dir: str
+      If None, use cn.BUNDLE_DIR
+
+  Returns
+  -------
+  : list-SharedMemory
+      Segments of the store, including the description;
+      have to be released (releaseSegments) to remove the store
+  """
+  if bundle_dir is None:
+    bundle_dir = cn.BUNDLE_DIR
+  if names is None:
+    names = list(rb.BUNDLE_SOURCES.keys())
+  missing = [val for val in names if not rb.hasBundledReference(val, bundle_dir)]
+  if missing:
+    rb.buildBundle(bundle_dir=bundle_dir, names=missing)
+  manifest = rb.getManifest(bundle_dir)
+  names = [val for val in names if val in manifest['references']]
+  store = {'manifest': {'format': manifest['format'],
+                        'references': {val:manifest['references'][val] for val in names}},
+           'arrays': dict()}
+  segments = []
+  try:
+    for name in names:
+      for part in rb.getBundledParts(name, bundle_dir):
+        key = '%s.%s' % (name, part)
+        store['arrays'][key], segment = publishArray(rb._loadArray(bundle_dir, name, part))
+        segments.append(segment)
+    desc = json.dumps(store).encode('utf-8')
+    segment = shared_memory.SharedMemory(name=store_name, create=True,
+                                         size=STORE_HEADER_SIZE+len(desc))
+    segments.append(segment)
+    segment.buf[:STORE_HEADER_SIZE] = len(desc).to_bytes(STORE_HEADER_SIZE, 'little')
+    segment.buf[STORE_HEADER_SIZE:STORE_HEADER_SIZE+len(desc)] = desc
+  except Exception:
+    releaseSegments(segments)
+    raise
+  return segments
+
+def attachStore(store_name=DEFAULT_STORE_NAME, bundle_dir=None):
+  """
+  Attach to a store published by publishStore
+  (in any process), so that bundled references
+  of this process are read from the store.
+  Tables already loaded in this process are not replaced.
+
+  Parameters
+  ----------
+  store_name: str
+  bundle_dir: str
+      Bundle folder replaced by the store;
+      if None, use cn.BUNDLE_DIR
+
+  Returns
+  -------
+  bool
+      False if the store doesn't exist
+  """
+  if _STORE['name'] == store_name:
+    return True
+  try:
+    desc_segment = openSegment(store_name, track=False)
+  except FileNotFoundError:
+    warnings.warn('Reference store %s was not found.' % store_name)
+    return False
+  desc_len = int.from_bytes(bytes(desc_segment.buf[:STORE_HEADER_SIZE]), 'little')
+  store = json.loads(bytes(desc_segment.buf[STORE_HEADER_SIZE:STORE_HEADER_SIZE+desc_len]))
+  desc_segment.close()
+  arrays = dict()
+  for key, handle in store['arrays'].items():
+    arrays[key], segment = attachArray(handle, track=False)
+    _ATTACHED.append(segment)
+  rb.attachSharedBundle(store['manifest'], arrays, bundle_dir)
+  _STORE['name'] = store_name
+  return True
+
+def getAttachedStore():
+  """
+  Get the name of the store
+  attached by this process.
+
+  Returns
+  -------
+  : str/None
+  """
+  return _STORE['name']
+
+
+def waitForStop(stop_event):
+  """
+  Wait until stop_event is set
+  by SIGINT or SIGTERM (or KeyboardInterrupt);
+  previous signal handlers are restored.
+  Works also where signal.pause()
+  is not available (Windows).
+
+  Parameters
+  ----------
+  stop_event: threading.Event
+  """
+  def _stopStore(signum, frame):
+    stop_event.set()
+  handlers = {signum:signal.signal(signum, _stopStore) \
+              for signum in [signal.SIGINT, signal.SIGTERM]}
+  try:
+    while not stop_event.wait(STORE_WAIT_SECONDS):
+      pass
+  except KeyboardInterrupt:
+    pass
+  finally:
+    for signum, handler in handlers.items():
+      signal.signal(signum, handler)
+
+def main():
+  parser = argparse.ArgumentParser(description='Publish the reference bundle in shared memory ' + \
+                                               'until interrupted')
+  parser.add_argument('--name', '-n', type=str, default=DEFAULT_STORE_NAME,
+                      help='name of the store; default is %s' % DEFAULT_STORE_NAME)
+  parser.add_argument('--bundle', '-b', type=str, default=cn.BUNDLE_DIR,
+                      help='folder of the bundle; default is %s' % cn.BUNDLE_DIR)
+  args = parser.parse_args()
+  segments = publishStore(store_name=args.name, bundle_dir=args.bundle)
+  print("Published %d arrays as %s; set %s=%s in other processes" % \
+        (len(segments)-1, args.name, cn.REFERENCE_STORE_ENV, args.name))
+  try:
+    waitForStop(threading.Event())
+  finally:
+    releaseSegments(segments)
+
+
+if __name__ == '__main__':
+  main()
@@ -9,28 +9,651 @@ mainly using editdistance method.
 
 
 from AMAS import constants as cn
+from AMAS import reference_bundle as rb
+from AMAS import score_cache as sc
+from AMAS import shared_reference as sr
+from AMAS import synonym_index as si
 from AMAS import tools
 
 import collections
-import compress_pickle
+import concurrent.futures
 import editdistance
+import functools
 import itertools
 import libsbml
+import multiprocessing
 import numpy as np
-import operator
 import os
 import pandas as pd
-import pickle
 import re
-import warnings
 
 
-with open(os.path.join(cn.REF_DIR, 'chebi_low_synonyms_comp.lzma'), 'rb') as f:
-  CHEBI_LOW_SYNONYMS = compress_pickle.load(f)
-CHARCOUNT_COMB_DF = compress_pickle.load(os.path.join(cn.REF_DIR, 'charcount_df_scaled.lzma'),
-                                         compression="lzma")
-CHARCOUNT_DF = CHARCOUNT_COMB_DF.iloc[:, :-2]
-CHEBI_DF = CHARCOUNT_COMB_DF.iloc[:, -2:]
+# Characters counted for cosine similarity
+COUNT_CHARS = 'abcdefghijklmnopqrstuvwxyz0123456789'
+# Position in COUNT_CHARS of each byte (ascii); -1 if not counted
+CHAR_SLOTS = np.full(256, -1, dtype=np.int64)
+CHAR_SLOTS[np.frombuffer(COUNT_CHARS.encode('ascii'), dtype=np.uint8)] = np.arange(len(COUNT_CHARS))
+
+# Default number of query strings scored at once in getCScores;
+# peak memory is about (number of reference rows x chunk size) floats
+CSCORE_CHUNK_SIZE = 100
+
+# Reference tables, loaded on first access (e.g., sa.CHARCOUNT_DF)
+SPECIES_REFERENCES = ['CHEBI_LOW_SYNONYMS', 'CHARCOUNT_COMB_DF',
+                      'CHARCOUNT_DF', 'CHEBI_DF', 'CHEBI_SEGMENTS',
+                      'CHARCOUNT_COMPACT', 'SYNONYM_INDEX',
+                      'SYNONYM_CHEBIS', 'CHARCOUNT_PROFILES',
+                      'CHARCOUNT_BLOCKS']
+# Compact version of CHARCOUNT_DF & CHEBI_DF; 
+# rows are sorted by ChEBI terms and cosine of row i with
+# query counts q is (counts[i] . q) / sqrt(sq_norms[i] * (q . q)).
+# counts: (uint8) raw character counts (rows x columns)
+# sq_norms: (int32) squared vector length of each row
+# codes: (int32) index of ChEBI term (labels) of each row
+# labels: sorted ChEBI terms
+# starts: first row of each ChEBI term
+# columns: characters of counts
+CompactCharCount = collections.namedtuple('CompactCharCount',
+                                          ['counts', 'sq_norms', 'codes',
+                                           'labels', 'starts', 'columns'])
+# Max. multiplier tried to recover integer counts from scaled rows
+MAX_COUNT_MULTIPLIER = 64
+# Number of reference rows scored at once with the compact reference
+COMPACT_ROW_BLOCK = 65536
+# Rows of the compact reference grouped by character count profiles
+# (counts divided by their gcd); rows[i] has profile key keys[i] (sorted).
+# Only rows sharing the profile of a query have a cScore of 1.0
+CountProfileIndex = collections.namedtuple('CountProfileIndex',
+                                           ['keys', 'rows'])
+# Multiplier of polynomial hashes (mod 2**64) of count profiles
+PROFILE_HASH_BASE = 0x100000001b3
+# Default number of ChEBI terms (by cScore) re-ranked
+# by eScores in getHybridScores
+HYBRID_CANDIDATES = 50
+# Rows of the compact reference in blocks of similar rows
+# (leaves of a k-d tree of unit count vectors); block i is
+# rows starts[i]:starts[i+1] of counts, sq_norms and codes,
+# which are rows (original positions) of CHARCOUNT_COMPACT;
+# they are copied in block order, so that rows of a block are
+# read at once, and shared by processes if bundled.
+# lower/upper are (blocks x characters) bounds of the unit
+# vectors of each block, so that the cosine of a block
+# with a query can be bounded (getCosineBounds)
+CosineBlockIndex = collections.namedtuple('CosineBlockIndex',
+                                          ['rows', 'starts', 'lower', 'upper',
+                                           'counts', 'sq_norms', 'codes'])
+# Max. number of rows in a block of CosineBlockIndex
+COSINE_BLOCK_SIZE = 64
+# Number of blocks with the highest bounds scored first
+# to get a threshold in getTopCScores; more blocks
+# (doubling) are scored while they have fewer ChEBI terms
+# than the number of candidates
+COSINE_SEED_BLOCKS = 64
+# Lagrange multipliers tried in getDualCosineBounds
+COSINE_DUAL_MULTIPLIERS = (0.4, 0.6, 1.0)
+# Margin of bounds against rounding errors of scores
+COSINE_BOUND_MARGIN = 1e-9
+# Methods of SpeciesAnnotation for each scoring method
+SCORING_METHODS = {'cdist': 'getCScores',
+                   'edist': 'getEScores',
+                   'hybrid': 'getHybridScores'}
+# Reference tables used by each scoring method;
+# workers of getParallelScores attach to them in shared memory
+SCORING_REFERENCES = {'cdist': ['CHARCOUNT_COMPACT'],
+                      'edist': ['SYNONYM_INDEX'],
+                      'hybrid': ['CHARCOUNT_COMPACT', 'SYNONYM_INDEX']}
+# Start method of worker processes in getParallelScores;
+# with 'spawn', workers don't inherit (and copy) loaded tables
+PARALLEL_START_METHOD = 'spawn'
+# Number of chunks of query strings per worker in getParallelScores
+PARALLEL_CHUNKS_PER_WORKER = 4
+# Scores of species names shared by SpeciesAnnotation objects
+# of this process (self.score_cache); also saved in an SQLite file
+# if its path is given by the environment variable AMAS_SCORE_CACHE
+SCORE_CACHE = sc.ScoreCache(disk_path=os.environ.get(cn.SCORE_CACHE_ENV))
+
+
+def getQueryRepresentatives(inp_strs):
+  """
+  Map each query string to the first string
+  with the same normalized (lowered) form;
+  scores of a string depend only on that form, so
+  only the representatives need to be scored.
+
+  Parameters
+  ----------
+  inp_strs: list-str
+
+  Returns
+  -------
+  : dict
+      {one_str: representative string}
+  """
+  firsts = dict()
+  reps = dict()
+  for spec in inp_strs:
+    if spec not in reps:
+      reps[spec] = firsts.setdefault(sc.ScoreCache.normalize(spec), spec)
+  return reps
+
+def loadCharCountReference(part):
+  """
+  Load either part of CHARCOUNT_COMB_DF;
+  character counts ('numeric', CHARCOUNT_DF)
+  or ChEBI information ('object', CHEBI_DF).
+  A bundled version is memory-mapped directly,
+  without building the combined DataFrame.
+
+  Parameters
+  ----------
+  part: str
+      'numeric' or 'object'
+
+  Returns
+  -------
+  : pandas.DataFrame
+  """
+  if rb.hasBundledReference('CHARCOUNT_COMB_DF'):
+    return rb.loadBundledFrame('CHARCOUNT_COMB_DF', part=part)
+  comb_df = cn.loadReference('CHARCOUNT_COMB_DF')
+  if part == 'numeric':
+    return comb_df.iloc[:, :-2]
+  return comb_df.iloc[:, -2:]
+
+
+def getChEBISegments(chebi_df):
+  """
+  Get segments of reference rows
+  sharing the same ChEBI term;
+  once rows are ordered by 'order', 
+  rows of i-th ChEBI term (labels[i]) 
+  are from starts[i] to starts[i+1].
+  ChEBI terms are sorted. 
+
+  Parameters
+  ----------
+  chebi_df: DataFrame
+      ChEBI information of reference rows
+
+  Returns
+  -------
+  order: numpy.ndarray
+      Row positions sorted by ChEBI terms
+  starts: numpy.ndarray
+      Start positions of segments
+  labels: numpy.ndarray
+      ChEBI term of each segment
+  """
+  chebis = chebi_df[cn.CHEBI].to_numpy(dtype=object)
+  order = np.argsort(chebis, kind='stable')
+  sorted_chebis = chebis[order]
+  if len(sorted_chebis) == 0:
+    return order, np.array([], dtype=np.int64), sorted_chebis
+  is_start = np.ones(len(sorted_chebis), dtype=bool)
+  is_start[1:] = sorted_chebis[1:] != sorted_chebis[:-1]
+  starts = np.flatnonzero(is_start)
+  return order, starts, sorted_chebis[starts]
+
+
+def recoverCharCounts(scaled_arr):
+  """
+  Recover integer character counts
+  from rows scaled by their vector length.
+  Counts are recovered up to a common factor of
+  each row, which does not change cosine similarity.
+
+  Parameters
+  ----------
+  scaled_arr: numpy.ndarray
+      (rows x characters)
+
+  Returns
+  -------
+  : numpy.ndarray/None
+      Integer counts; None if any row
+      couldn't be recovered
+  """
+  scaled_arr = np.asarray(scaled_arr, dtype=np.float64)
+  row_min = np.where(scaled_arr>0, scaled_arr, np.inf).min(axis=1)
+  row_min[np.isinf(row_min)] = 1.0
+  ratio = scaled_arr / row_min[:, np.newaxis]
+  counts = np.zeros(scaled_arr.shape, dtype=np.int64)
+  remaining = np.arange(len(ratio))
+  for mult in range(1, MAX_COUNT_MULTIPLIER+1):
+    cand = ratio[remaining] * mult
+    rounded = np.rint(cand)
+    is_int = np.all(np.abs(cand-rounded) < 1e-6, axis=1)
+    counts[remaining[is_int]] = rounded[is_int]
+    remaining = remaining[~is_int]
+    if len(remaining) == 0:
+      return counts
+  return None
+
+def buildCompactCharCount(ref_df, chebi_df):
+  """
+  Build CompactCharCount from
+  (scaled) character counts and ChEBI information.
+  If counts cannot be recovered as small integers,
+  scaled values are kept as float32.
+
+  Parameters
+  ----------
+  ref_df: DataFrame
+      Scaled character counts (e.g., CHARCOUNT_DF)
+  chebi_df: DataFrame
+      ChEBI information sharing the index with ref_df
+
+  Returns
+  -------
+  : CompactCharCount
+  """
+  labels, codes = np.unique(chebi_df[cn.CHEBI].to_numpy(dtype=object),
+                            return_inverse=True)
+  order = np.argsort(codes, kind='stable')
+  codes = codes[order].astype(np.int32)
+  scaled_arr = ref_df.to_numpy()[order]
+  counts = recoverCharCounts(scaled_arr)
+  if counts is None:
+    counts = scaled_arr.astype(np.float32)
+    sq_norms = np.ones(len(counts), dtype=np.int32)
+  else:
+    sq_norms = np.sum(counts**2, axis=1).astype(np.int32)
+    # counts are non-negative; a few long names have more than 127 of a character
+    counts = counts.astype(np.uint8 if counts.max(initial=0)<=np.iinfo(np.uint8).max else np.uint16)
+  is_start = np.ones(len(codes), dtype=bool)
+  is_start[1:] = codes[1:] != codes[:-1]
+  return CompactCharCount(counts=counts,
+                          sq_norms=sq_norms,
+                          codes=codes,
+                          labels=labels,
+                          starts=np.flatnonzero(is_start),
+                          columns=pd.Index([str(val) for val in ref_df.columns]))
+
+def loadCompactCharCount():
+  """
+  Load CompactCharCount, memory-mapped
+  if bundled; otherwise build it from
+  CHARCOUNT_COMB_DF without caching the DataFrame.
+
+  Returns
+  -------
+  : CompactCharCount
+  """
+  if rb.hasBundledReference('CHARCOUNT_COMPACT'):
+    compact = rb.loadBundledReference('CHARCOUNT_COMPACT')
+    compact['columns'] = pd.Index(compact['columns'])
+    return CompactCharCount(**compact)
+  if rb.hasBundledReference('CHARCOUNT_COMB_DF'):
+    return buildCompactCharCount(rb.loadBundledFrame('CHARCOUNT_COMB_DF', part='numeric'),
+                                 rb.loadBundledFrame('CHARCOUNT_COMB_DF', part='object'))
+  comb_df = cn.loadReference('CHARCOUNT_COMB_DF', cache=False)
+  return buildCompactCharCount(comb_df.iloc[:, :-2], comb_df.iloc[:, -2:])
+
+def loadSynonymIndex():
+  """
+  Load SynonymIndex of CHEBI_LOW_SYNONYMS for getEScores,
+  memory-mapped if bundled; otherwise build it.
+  Only synonyms of ChEBI terms with formulas
+  are returned by the index.
+
+  Returns
+  -------
+  : synonym_index.SynonymIndex
+  """
+  if rb.hasBundledReference('SYNONYM_INDEX'):
+    syn_index = si.SynonymIndex(**rb.loadBundledReference('SYNONYM_INDEX'))
+  else:
+    syn_index = si.SynonymIndex.build(cn.loadReference('CHEBI_LOW_SYNONYMS'))
+  syn_index.setValidChEBIs(cn.REF_CHEBI2FORMULA)
+  return syn_index
+
+def getSynonymChEBIs(syn_index):
+  """
+  Map each lowered synonym to its ChEBI terms
+  that are valid in a synonym index,
+  in the order of the ChEBI terms (labels).
+
+  Parameters
+  ----------
+  syn_index: synonym_index.SynonymIndex
+
+  Returns
+  -------
+  : dict
+      {synonym: [CHEBI:XXXXX, ...]}
+  """
+  labels = syn_index.labels.tolist()
+  owners = np.asarray(syn_index.owners).tolist()
+  syn_chebis = dict()
+  # strings are sorted (stably) by length,
+  # so owners of the same string are in the order of labels
+  for idx in np.flatnonzero(syn_index.is_valid).tolist():
+    one_k = labels[owners[idx]]
+    chebis = syn_chebis.setdefault(syn_index.strs[idx], [])
+    if not chebis or chebis[-1] != one_k:
+      chebis.append(one_k)
+  return syn_chebis
+
+def loadSynonymChEBIs():
+  """
+  Map each lowered synonym to its ChEBI terms
+  that have formulas, from SYNONYM_INDEX.
+
+  Returns
+  -------
+  : dict
+      {synonym: [CHEBI:XXXXX, ...]}
+  """
+  return getSynonymChEBIs(cn.loadReference('SYNONYM_INDEX'))
+
+def getCountProfiles(counts):
+  """
+  Get count profiles (rows divided by their gcd)
+  and their hash keys; two rows have the same profile
+  if and only if one is a multiple of the other.
+
+  Parameters
+  ----------
+  counts: numpy.ndarray
+      (rows x characters) non-negative integer counts
+
+  Returns
+  -------
+  : numpy.ndarray
+      Profiles (rows of zeros are kept)
+  : numpy.ndarray (uint64)
+      Keys of profiles
+  """
+  counts = np.asarray(counts, dtype=np.int64)
+  gcds = np.maximum(np.gcd.reduce(counts, axis=1), 1)
+  profiles = counts // gcds[:, np.newaxis]
+  weights = np.full(counts.shape[1], PROFILE_HASH_BASE, dtype=np.uint64)
+  weights = np.cumprod(weights, dtype=np.uint64)
+  keys = (profiles.astype(np.uint64) * weights).sum(axis=1, dtype=np.uint64)
+  return profiles, keys
+
+def buildCountProfileIndex(compact):
+  """
+  Build CountProfileIndex of a compact reference.
+
+  Parameters
+  ----------
+  compact: CompactCharCount
+
+  Returns
+  -------
+  : CountProfileIndex
+  """
+  keys = np.empty(len(compact.counts), dtype=np.uint64)
+  for row_start in range(0, len(compact.counts), COMPACT_ROW_BLOCK):
+    _, keys[row_start:row_start+COMPACT_ROW_BLOCK] = \
+        getCountProfiles(compact.counts[row_start:row_start+COMPACT_ROW_BLOCK])
+  order = np.argsort(keys, kind='stable')
+  return CountProfileIndex(keys=keys[order], rows=order)
+
+def loadCountProfileIndex():
+  """
+  Load CountProfileIndex of CHARCOUNT_COMPACT,
+  memory-mapped if bundled; otherwise build it.
+
+  Returns
+  -------
+  : CountProfileIndex
+  """
+  if rb.hasBundledReference('CHARCOUNT_PROFILES'):
+    return CountProfileIndex(**rb.loadBundledReference('CHARCOUNT_PROFILES'))
+  return buildCountProfileIndex(cn.loadReference('CHARCOUNT_COMPACT'))
+
+
+def buildCosineBlockIndex(compact, block_size=COSINE_BLOCK_SIZE):
+  """
+  Build CosineBlockIndex of a compact reference
+  with integer counts; blocks are made by
+  splitting rows at the median of the character
+  with the largest variance of unit vectors.
+
+  Parameters
+  ----------
+  compact: CompactCharCount
+  block_size: int
+
+  Returns
+  -------
+  : CosineBlockIndex
+  """
+  norms = np.sqrt(compact.sq_norms.astype(np.float64))[:, np.newaxis]
+  with np.errstate(divide='ignore', invalid='ignore'):
+    units = np.where(norms > 0, compact.counts / norms, 0.0).astype(np.float32)
+  leaves = []
+  stack = [np.arange(len(units))]
+  while stack:
+    idxs = stack.pop()
+    if len(idxs) <= block_size:
+      leaves.append(idxs)
+      continue
+    sub_units = units[idxs]
+    col = np.argmax(sub_units.var(axis=0))
+    half = len(idxs) // 2
+    part = np.argpartition(sub_units[:, col], half)
+    stack.append(idxs[part[half:]])
+    stack.append(idxs[part[:half]])
+  rows = np.concatenate(leaves) if leaves else np.zeros(0, dtype=np.int64)
+  starts = np.zeros(len(leaves)+1, dtype=np.int64)
+  np.cumsum([len(val) for val in leaves], out=starts[1:])
+  if len(leaves) > 0:
+    lower = np.minimum.reduceat(units[rows], starts[:-1], axis=0).astype(np.float64)
+    upper = np.maximum.reduceat(units[rows], starts[:-1], axis=0).astype(np.float64)
+  else:
+    lower = upper = np.zeros((0, units.shape[1]))
+  # widen bounds by the rounding error of float32 units
+  return CosineBlockIndex(rows=rows,
+                          starts=starts,
+                          lower=lower * (1 - 2.0**-22),
+                          upper=np.minimum(upper * (1 + 2.0**-22), 1.0),
+                          counts=compact.counts[rows],
+                          sq_norms=compact.sq_norms[rows],
+                          codes=compact.codes[rows])
+
+def loadCosineBlockIndex():
+  """
+  Load CosineBlockIndex of CHARCOUNT_COMPACT,
+  memory-mapped if bundled; otherwise build it.
+
+  Returns
+  -------
+  : CosineBlockIndex
+  """
+  if rb.hasBundledReference('CHARCOUNT_BLOCKS'):
+    return CosineBlockIndex(**rb.loadBundledReference('CHARCOUNT_BLOCKS'))
+  return buildCosineBlockIndex(cn.loadReference('CHARCOUNT_COMPACT'))
+
+def scoreCosineBlocks(index, blocks, query_counts, query_sq, is_label=None):
+  """
+  Compute cScores of the rows of blocks
+  with a query, in the same way as
+  SpeciesAnnotation.getCompactCScoreArray.
+
+  Parameters
+  ----------
+  index: CosineBlockIndex
+  blocks: numpy.ndarray
+      Indices of blocks
+  query_counts: numpy.ndarray
+      Counts of a query
+  query_sq: float
+      Squared length of query_counts
+  is_label: numpy.ndarray (bool)
+      If given, rows of codes where it is False
+      get NaN
+
+  Returns
+  -------
+  : numpy.ndarray
+      Codes (ChEBI terms) of rows
+  : numpy.ndarray
+      cScores of rows
+  """
+  lens = np.diff(index.starts)[blocks]
+  rows = np.repeat(index.starts[blocks] - np.cumsum(lens) + lens, lens) + \
+         np.arange(np.sum(lens))
+  dots = index.counts[rows].astype(np.float32) @ query_counts
+  with np.errstate(divide='ignore', invalid='ignore'):
+    scores = dots / np.sqrt(index.sq_norms[rows].astype(np.float64) * query_sq)
+  codes = index.codes[rows]
+  if is_label is not None:
+    scores[~is_label[codes]] = np.nan
+  return codes, scores
+
+def getSegmentMax(codes, scores):
+  """
+  Get the maximum score of each code,
+  ignoring NaN.
+
+  Parameters
+  ----------
+  codes: numpy.ndarray
+  scores: numpy.ndarray
+
+  Returns
+  -------
+  : numpy.ndarray
+      Sorted unique codes
+  : numpy.ndarray
+      Maximum score of each code (NaN if all are NaN)
+  """
+  order = np.argsort(codes, kind='stable')
+  codes = codes[order]
+  if len(codes) == 0:
+    return codes, scores[:0]
+  seg_starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+  return codes[seg_starts], np.fmax.reduceat(scores[order], seg_starts)
+
+def getKthLargest(scores, k):
+  """
+  Get the k-th largest of scores,
+  or the smallest if there are less than k,
+  ignoring NaN.
+
+  Parameters
+  ----------
+  scores: numpy.ndarray
+  k: int
+
+  Returns
+  -------
+  : float/None
+      None if there is no score
+  """
+  scores = scores[~np.isnan(scores)]
+  if len(scores) == 0:
+    return None
+  k = min(k, len(scores))
+  return -np.partition(-scores, k-1)[k-1]
+
+def getCosineBounds(index, query_units):
+  """
+  Upper bounds of cosines of
+  rows of each block with queries;
+  a row x (unit vector) within [lower, upper]
+  has q.x <= q.upper, and its norm leaves at most
+  sqrt(1 - sum(lower**2)) for characters of the query.
+
+  Parameters
+  ----------
+  index: CosineBlockIndex
+  query_units: numpy.ndarray
+      (characters x queries) unit vectors
+
+  Returns
+  -------
+  : numpy.ndarray
+      (blocks x queries)
+  """
+  rest_sq = (index.lower**2) @ (query_units == 0)
+  return np.minimum(index.upper @ query_units,
+                    np.sqrt(np.maximum(1.0 - rest_sq, 0.0)))
+
+def getDualCosineBounds(index, query_unit, blocks):
+  """
+  Tighter upper bounds of cosines of
+  rows of blocks with a query, by the Lagrangian dual of
+  max q.x subject to lower <= x <= upper and |x| <= 1.
+  Any multiplier gives a bound; the minimum over
+  COSINE_DUAL_MULTIPLIERS is used.
+
+  Parameters
+  ----------
+  index: CosineBlockIndex
+  query_unit: numpy.ndarray
+      Unit vector of a query
+  blocks: numpy.ndarray
+      Indices of blocks
+
+  Returns
+  -------
+  : numpy.ndarray
+  """
+  chars = np.flatnonzero(query_unit)
+  q_vals = query_unit[chars]
+  lower = index.lower[blocks]
+  upper = index.upper[blocks][:, chars]
+  # norm left for characters of the query
+  rest = np.maximum(1.0 - np.sum(lower**2, axis=1) + np.sum(lower[:, chars]**2, axis=1), 0.0)
+  lower = lower[:, chars]
+  bounds = np.full(len(blocks), np.inf)
+  for mult in COSINE_DUAL_MULTIPLIERS:
+    vals = np.clip(q_vals / (2*mult), lower, upper)
+    bounds = np.minimum(bounds,
+                        mult*rest + np.sum(q_vals*vals - mult*vals**2, axis=1))
+  return bounds
+
+
+cn.registerReference('CHEBI_LOW_SYNONYMS',
+                     functools.partial(cn.loadFileReference, 'CHEBI_LOW_SYNONYMS',
+                                       'chebi_low_synonyms_comp.lzma'))
+cn.registerReference('CHARCOUNT_COMB_DF',
+                     functools.partial(cn.loadFileReference, 'CHARCOUNT_COMB_DF',
+                                       'charcount_df_scaled.lzma'))
+cn.registerReference('CHARCOUNT_DF',
+                     functools.partial(loadCharCountReference, 'numeric'))
+cn.registerReference('CHEBI_DF',
+                     functools.partial(loadCharCountReference, 'object'))
+cn.registerReference('CHEBI_SEGMENTS',
+                     lambda: getChEBISegments(cn.loadReference('CHEBI_DF')))
+cn.registerReference('CHARCOUNT_COMPACT', loadCompactCharCount)
+cn.registerReference('SYNONYM_INDEX', loadSynonymIndex)
+cn.registerReference('SYNONYM_CHEBIS', loadSynonymChEBIs)
+cn.registerReference('CHARCOUNT_PROFILES', loadCountProfileIndex)
+cn.registerReference('CHARCOUNT_BLOCKS', loadCosineBlockIndex)
+
+
+def _initScoringWorker(handles, store_name):
+  # initializer of worker processes of getParallelScores
+  if store_name is not None:
+    sr.attachStore(store_name)
+  else:
+    sr.attachReferences(handles)
+
+def _scoreInWorker(method, inp_strs, mssc, cutoff,
+                   cscore_chunk_size, hybrid_candidates):
+  # task of worker processes of getParallelScores
+  species = SpeciesAnnotation()
+  # results are cached by the calling process
+  species.score_cache = None
+  species.cscore_chunk_size = cscore_chunk_size
+  species.hybrid_candidates = hybrid_candidates
+  return getattr(species, SCORING_METHODS[method])(inp_strs=inp_strs,
+                                                   mssc=mssc,
+                                                   cutoff=cutoff)
+
+
+def __getattr__(name):
+  if name in SPECIES_REFERENCES:
+    value = cn.loadReference(name)
+    globals()[name] = value
+    return value
+  raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
 
 class SpeciesAnnotation(object):
 
@@ -84,13 +707,243 @@ class SpeciesAnnotation(object):
     # Once created, each will be {species_ID: float/str-list}
     self.candidates = dict()
     self.formula = dict()
+    # Number of query strings scored at once in getCScores;
+    # if None, all strings are scored in one block
+    self.cscore_chunk_size = CSCORE_CHUNK_SIZE
+    # Number of unique strings resolved by each tier
+    # in the last call of getTieredScores
+    self.tier_counts = dict()
+    # Number of ChEBI terms re-ranked in getHybridScores
+    self.hybrid_candidates = HYBRID_CANDIDATES
+    # If True, getCScores (mssc='top') and getHybridScores
+    # skip reference rows that cannot reach the top cScores
+    # (getTopCScores); results are the same
+    self.prune_cscores = True
+    # LRU cache of scores (score_cache.ScoreCache)
+    # used by getCScores, getEScores and getHybridScores;
+    # if None, scores are always computed
+    self.score_cache = SCORE_CACHE
+
+  def getTieredScores(self,
+                      inp_strs,
+                      method,
+                      mssc,
+                      cutoff,
+                      workers=1):
+    """
+    Compute cScores (method='cdist'),
+    eScores (method='edist') or
+    hybrid scores (method='hybrid') of query strings.
+    With mssc='top', exact matches are resolved first
+    (getExactScores) and only the other strings
+    are sent to getCScores/getEScores/getHybridScores;
+    results of 'cdist' and 'edist' are the same.
+    Exact matches of 'hybrid' get the result of 'edist'.
+    The number of unique strings
+    resolved by each tier is stored in self.tier_counts,
+    e.g., {'exact': 3, 'cdist': 2}.
+
+    Parameters
+    ----------
+    inp_strs: str
+        List of strings
+    method: str
+        'cdist', 'edist' or 'hybrid'
+    mssc: str
+    cutoff: float
+    workers: int
+        If more than 1, strings that are not
+        resolved by exact matches are scored
+        by a pool of processes (getParallelScores)
+
+    Returns
+    -------
+    :dict
+        {one_str: [(CHEBI:XXXXX, score), ...]}
+    """
+    reps = getQueryRepresentatives(inp_strs)
+    unq_strs = list(dict.fromkeys(reps.values()))
+    if mssc == 'top':
+      scores = self.getExactScores(inp_strs=unq_strs,
+                                   method=method,
+                                   cutoff=cutoff)
+    else:
+      scores = dict()
+    rest_strs = [val for val in unq_strs if val not in scores]
+    self.tier_counts = {'exact': len(scores),
+                        method: len(rest_strs)}
+    if len(rest_strs) > 1 and workers > 1:
+      scores.update(self.getParallelScores(inp_strs=rest_strs,
+                                           method=method,
+                                           mssc=mssc,
+                                           cutoff=cutoff,
+                                           workers=workers))
+    elif rest_strs:
+      scores.update(getattr(self, SCORING_METHODS[method])(inp_strs=rest_strs,
+                                                           mssc=mssc,
+                                                           cutoff=cutoff))
+    return {spec:scores[reps[spec]] for spec in inp_strs}
+
+  def getParallelScores(self,
+                        inp_strs,
+                        method,
+                        mssc,
+                        cutoff,
+                        workers,
+                        use_cache=True):
+    """
+    Compute scores of query strings
+    (getCScores/getEScores/getHybridScores)
+    with a pool of worker processes.
+    Unique strings are split into chunks;
+    reference tables of the method are published
+    in shared memory once and workers attach to them
+    by name, so they are neither pickled nor
+    loaded again by each worker.
+    If this process is attached to a reference store
+    (shared_reference.attachStore), workers attach
+    to the store instead.
+    Results are the same as those of the
+    method in this process.
+    Because workers are spawned, a script calling this
+    should be guarded by if __name__ == '__main__'.
+
+    Parameters
+    ----------
+    inp_strs: str
+        List of strings
+    method: str
+        'cdist', 'edist' or 'hybrid'
+    mssc: str
+    cutoff: float
+    workers: int
+        Number of worker processes
+    use_cache: bool
+        If True, only strings that are not
+        in self.score_cache are sent to workers
+
+    Returns
+    -------
+    :dict
+        {one_str: [(CHEBI:XXXXX, score), ...]}
+    """
+    if use_cache and self.score_cache is not None:
+      cache_method = (method, self.hybrid_candidates) if method == 'hybrid' else method
+      return self.score_cache.getScores(inp_strs=inp_strs,
+                                        method=cache_method,
+                                        mssc=mssc,
+                                        cutoff=cutoff,
+                                        score_func=functools.partial(self.getParallelScores,
+                                                                     method=method,
+                                                                     workers=workers,
+                                                                     use_cache=False))
+    reps = getQueryRepresentatives(inp_strs)
+    unq_strs = list(dict.fromkeys(reps.values()))
+    num_chunks = min(len(unq_strs), workers*PARALLEL_CHUNKS_PER_WORKER)
+    chunk_size = -(-len(unq_strs) // max(num_chunks, 1))
+    chunks = [unq_strs[idx:idx+chunk_size] for idx in range(0, len(unq_strs), chunk_size)]
+    store_name = sr.getAttachedStore()
+    if store_name is None:
+      names = SCORING_REFERENCES[method]
+      if method == 'hybrid' or (method == 'cdist' and mssc == 'top'):
+        # used by workers to prune cScores (getTopCScores)
+        names = names + ['CHARCOUNT_BLOCKS']
+      handles, segments = sr.publishReferences(names)
+    else:
+      handles, segments = None, []
+    scores = dict()
+    try:
+      with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                  mp_context=multiprocessing.get_context(PARALLEL_START_METHOD),
+                                                  initializer=_initScoringWorker,
+                                                  initargs=(handles, store_name)) as executor:
+        futures = [executor.submit(_scoreInWorker, method, one_chunk, mssc, cutoff,
+                                   self.cscore_chunk_size, self.hybrid_candidates) \
+                   for one_chunk in chunks]
+        for one_future in futures:
+          scores.update(one_future.result())
+    finally:
+      sr.releaseSegments(segments)
+    return {spec:scores[reps[spec]] for spec in inp_strs}
+
+  def getExactScores(self,
+                     inp_strs,
+                     method,
+                     cutoff):
+    """
+    Resolve strings that exactly match the reference,
+    giving the same result as
+    getCScores/getEScores with mssc='top'.
+    For 'edist' (and 'hybrid'), a string matches
+    if its lowered form is a synonym (SYNONYM_CHEBIS);
+    the score is 1.0.
+    For 'cdist', a string matches if its character counts
+    are proportional to a row of CHARCOUNT_COMPACT,
+    and only such rows are scored.
+    Other strings are not included.
+
+    Parameters
+    ----------
+    inp_strs: str
+        List of strings
+    method: str
+        'cdist', 'edist' or 'hybrid'
+    cutoff: float
+
+    Returns
+    -------
+    :dict
+        {one_str: [(CHEBI:XXXXX, score), ...]}
+    """
+    if method not in SCORING_METHODS:
+      raise KeyError('Unknown method: %s' % method)
+    res = dict()
+    if method in ['edist', 'hybrid']:
+      syn_chebis = cn.loadReference('SYNONYM_CHEBIS')
+      if cutoff > 1.0:
+        return res
+      for spec in inp_strs:
+        chebis = syn_chebis.get(spec.lower())
+        if chebis:
+          res[spec] = [(val, 1.0) for val in chebis]
+      return res
+    compact = cn.loadReference('CHARCOUNT_COMPACT')
+    profile_index = cn.loadReference('CHARCOUNT_PROFILES')
+    query_counts = self.getCounterQueryArray(inp_strs=inp_strs,
+                                             ref_cols=compact.columns,
+                                             normalize=False)
+    query_profiles, query_keys = getCountProfiles(query_counts.T)
+    query_sq = np.sum(query_counts.astype(np.float64)**2, axis=0)
+    lower = np.searchsorted(profile_index.keys, query_keys, side='left')
+    upper = np.searchsorted(profile_index.keys, query_keys, side='right')
+    for idx, spec in enumerate(inp_strs):
+      if query_sq[idx] == 0 or lower[idx] == upper[idx]:
+        continue
+      rows = np.sort(profile_index.rows[lower[idx]:upper[idx]])
+      row_profiles, _ = getCountProfiles(compact.counts[rows])
+      rows = rows[np.all(row_profiles == query_profiles[idx], axis=1)]
+      if len(rows) == 0:
+        continue
+      # same computation as getCompactCScoreArray
+      dots = compact.counts[rows].astype(np.float32) @ query_counts[:, idx]
+      row_scores = dots / np.sqrt(compact.sq_norms[rows].astype(np.float64) * query_sq[idx])
+      codes = np.asarray(compact.codes[rows])
+      seg_starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+      res[spec] = tools.applyMSSCToArray(labels=compact.labels[codes[seg_starts]],
+                                         scores=np.maximum.reduceat(row_scores, seg_starts),
+                                         mssc='top',
+                                         cutoff=cutoff,
+                                         sort=False)
+    return res
 
   def getCScores(self,
                  inp_strs,
                  mssc,
                  cutoff,
-                 ref_df=CHARCOUNT_DF,
-                 chebi_df=CHEBI_DF):
+                 ref_df=None,
+                 chebi_df=None,
+                 chunk_size=None,
+                 use_cache=True):
     """
     Compute the eScores
     of query strings with
@@ -98,7 +951,8 @@ class SpeciesAnnotation(object):
     A sorted list of tuples 
     (CHEBI:XXXXX, eScore)
     will be returned.
-    Only unique strings 
+    Only unique strings (ignoring case,
+    see getQueryRepresentatives)
     will be calculated to avoid
     cases such as {'a': 'a',
                    'a': 'b'}.
@@ -116,38 +970,343 @@ class SpeciesAnnotation(object):
         Cutoff value; only candidates with match score
         at or above the cutoff will be recommended.
     ref_df: DataFrame
-        Reference database
+        Reference database;
+        if None, use CHARCOUNT_DF
     chebi_df: DataFrame
-        ChEBI information sharing the index with ref_df 
+        ChEBI information sharing the index with ref_df;
+        if None, use CHEBI_DF.
+        If both ref_df and chebi_df are None,
+        the compact reference (CHARCOUNT_COMPACT) is used
+    chunk_size: int
+        Number of strings scored at once; only the
+        per-ChEBI result of one block is kept in memory.
+        If None, use self.cscore_chunk_size
+    use_cache: bool
+        If True, results of the compact reference
+        are served from (and saved in) self.score_cache
   
     Returns
     -------
     :dict
         {one_str: [(CHEBI:XXXXX, 1.0), ...]}
     """
-    unq_strs = list(set(inp_strs))
-    one_query, name_used = self.prepareCounterQuery(specs=unq_strs,
-                                                    ref_cols=ref_df.columns,
-                                                    use_id=False) 
-    multi_mat = ref_df.dot(one_query)
-    # updated code to avoid repeated prediction
+    if use_cache and self.score_cache is not None and \
+       ref_df is None and chebi_df is None:
+      return self.score_cache.getScores(inp_strs=inp_strs,
+                                        method='cdist',
+                                        mssc=mssc,
+                                        cutoff=cutoff,
+                                        score_func=functools.partial(self.getCScores,
+                                                                     chunk_size=chunk_size,
+                                                                     use_cache=False))
+    if mssc == 'top' and ref_df is None and chebi_df is None and \
+       self.canPruneCScores():
+      reps = getQueryRepresentatives(inp_strs)
+      top_cscores = self.getTopCScores(inp_strs=list(dict.fromkeys(reps.values())))
+      cscores = {spec:tools.applyMSSCToArray(labels=top_cscores[spec][0],
+                                             scores=top_cscores[spec][1],
+                                             mssc=mssc,
+                                             cutoff=cutoff,
+                                             sort=False) \
+                 for spec in top_cscores.keys()}
+      return {spec:cscores[reps[spec]] for spec in inp_strs}
+    if chunk_size is None:
+      chunk_size = self.cscore_chunk_size
+    reps = getQueryRepresentatives(inp_strs)
+    unq_strs = list(dict.fromkeys(reps.values()))
+    if not chunk_size:
+      chunk_size = max(len(unq_strs), 1)
+    if ref_df is None and chebi_df is None:
+      compact = cn.loadReference('CHARCOUNT_COMPACT')
+      chebis = compact.labels
+    else:
+      compact = None
+      if ref_df is None:
+        ref_df = cn.loadReference('CHARCOUNT_DF')
+      if chebi_df is None:
+        chebi_df = cn.loadReference('CHEBI_DF')
+      order, starts, chebis = getChEBISegments(chebi_df)
+      ref_arr = ref_df.to_numpy()
     cscores = dict()
-    multi_mat[cn.CHEBI] = chebi_df[cn.CHEBI]
-    for spec in inp_strs:
-      # Get max-value of each chebi term
-      g_res = multi_mat.loc[:,[cn.CHEBI, spec]].groupby([cn.CHEBI]).max()[spec]
-      spec_cscore = tools.applyMSSC(pred=zip(g_res.index, g_res),
-                                    mssc=mssc,
-                                    cutoff=cutoff)
-      cscores[spec] = spec_cscore
-    # cscores = dict()
-    # for spec in unq_strs:
-    #   spec_cscore = tools.applyMSSC(pred=zip(chebi_df[cn.CHEBI], multi_mat[spec]),
-    #                                 mssc=mssc,
-    #                                 cutoff=cutoff)
-    #   spec_cscore.sort(key=operator.itemgetter(1), reverse=True)
-    #   cscores[spec] = spec_cscore
-    return cscores
+    for chunk_start in range(0, len(unq_strs), chunk_size):
+      chunk_strs = unq_strs[chunk_start:chunk_start+chunk_size]
+      if compact is not None:
+        chebi_max = self.getCompactCScoreArray(inp_strs=chunk_strs,
+                                               compact=compact)
+      else:
+        one_query = self.getCounterQueryArray(inp_strs=chunk_strs,
+                                              ref_cols=ref_df.columns,
+                                              dtype=ref_arr.dtype)
+        multi_mat = ref_arr @ one_query
+        # Get max-value of each chebi term for all strings at once;
+        # rows are ordered by ChEBI terms and reduced per segment
+        if len(starts) > 0:
+          chebi_max = np.fmax.reduceat(multi_mat[order], starts, axis=0)
+        else:
+          chebi_max = np.zeros((0, len(chunk_strs)))
+        del multi_mat
+      for idx, spec in enumerate(chunk_strs):
+        cscores[spec] = tools.applyMSSCToArray(labels=chebis,
+                                               scores=chebi_max[:, idx],
+                                               mssc=mssc,
+                                               cutoff=cutoff,
+                                               sort=False)
+    return {spec:cscores[reps[spec]] for spec in inp_strs}
+
+  def getHybridScores(self,
+                      inp_strs,
+                      mssc,
+                      cutoff,
+                      num_candidates=None,
+                      use_cache=True):
+    """
+    Compute eScores of query strings
+    only with the ChEBI terms of the highest cScores;
+    cScores (CHARCOUNT_COMPACT) pick candidates
+    and eScores (SYNONYM_INDEX) re-rank them.
+    A sorted list of tuples 
+    (CHEBI:XXXXX, eScore)
+    will be returned.
+  
+    Parameters
+    ----------
+    inp_strs: str
+        List of strings
+    mssc: match score selection criteria
+        'top' will recommend candidates with
+        the highest match score above cutoff
+        'above' will recommend all candidates with
+        match scores above cutoff
+    cutoff: float
+        Cutoff value; only candidates with match score
+        at or above the cutoff will be recommended.
+    num_candidates: int
+        Number of ChEBI terms to re-rank, with ties
+        of the last one; if None, use self.hybrid_candidates.
+        Only ChEBI terms with valid synonyms are candidates,
+        so those without are replaced by the next cScores
+    use_cache: bool
+        If True, results are served from
+        (and saved in) self.score_cache
+  
+    Returns
+    -------
+    :dict
+        {one_str: [(CHEBI:XXXXX, eScore), ...]}
+    """
+    if num_candidates is None:
+      num_candidates = self.hybrid_candidates
+    if use_cache and self.score_cache is not None:
+      return self.score_cache.getScores(inp_strs=inp_strs,
+                                        method=('hybrid', num_candidates),
+                                        mssc=mssc,
+                                        cutoff=cutoff,
+                                        score_func=functools.partial(self.getHybridScores,
+                                                                     num_candidates=num_candidates,
+                                                                     use_cache=False))
+    compact = cn.loadReference('CHARCOUNT_COMPACT')
+    syn_index = cn.loadReference('SYNONYM_INDEX')
+    reps = getQueryRepresentatives(inp_strs)
+    unq_strs = list(dict.fromkeys(reps.values()))
+    chunk_size = self.cscore_chunk_size or max(len(unq_strs), 1)
+    # only ChEBI terms with valid synonyms can be re-ranked,
+    # so the others are skipped for the next cScores
+    is_label = syn_index.hasValidSynonyms(compact.labels)
+    # {one_str: ChEBI terms of the highest cScores}
+    candidates = dict()
+    if self.canPruneCScores():
+      top_cscores = self.getTopCScores(inp_strs=unq_strs,
+                                       num_candidates=num_candidates,
+                                       is_label=is_label)
+      candidates = {spec:top_cscores[spec][0] for spec in unq_strs}
+    else:
+      for chunk_start in range(0, len(unq_strs), chunk_size):
+        chunk_strs = unq_strs[chunk_start:chunk_start+chunk_size]
+        chebi_max = self.getCompactCScoreArray(inp_strs=chunk_strs,
+                                               compact=compact)
+        chebi_max[~is_label, :] = np.nan
+        for idx, spec in enumerate(chunk_strs):
+          min_cscore = getKthLargest(chebi_max[:, idx], num_candidates)
+          if min_cscore is None:
+            candidates[spec] = compact.labels[:0]
+          else:
+            candidates[spec] = compact.labels[np.flatnonzero(chebi_max[:, idx] >= min_cscore)]
+    hscores = dict()
+    for spec in unq_strs:
+      chebis = candidates[spec]
+      if len(chebis) == 0:
+        hscores[spec] = []
+        continue
+      hscores[spec] = tools.applyMSSCToArray(labels=chebis,
+                                             scores=syn_index.getChEBIEScores(spec.lower(), chebis),
+                                             mssc=mssc,
+                                             cutoff=cutoff)
+    return {spec:hscores[reps[spec]] for spec in inp_strs}
+
+  def canPruneCScores(self):
+    """
+    Check whether getTopCScores is used;
+    exact dot products need integer counts.
+
+    Returns
+    -------
+    bool
+    """
+    if not self.prune_cscores:
+      return False
+    compact = cn.loadReference('CHARCOUNT_COMPACT')
+    return np.issubdtype(compact.counts.dtype, np.integer)
+
+  def getTopCScores(self,
+                    inp_strs,
+                    num_candidates=1,
+                    is_label=None):
+    """
+    Get the ChEBI terms with the highest cScores
+    (CHARCOUNT_COMPACT) of query strings, without
+    scoring reference rows whose bound (CHARCOUNT_BLOCKS)
+    is below the current num_candidates-th cScore.
+    First, the blocks with the highest bounds are scored,
+    until they have num_candidates ChEBI terms,
+    to get a threshold; then only the other blocks with
+    bounds (getCosineBounds, getDualCosineBounds) at or above
+    it are scored. Scores are computed as in
+    getCompactCScoreArray, so the result is the same as
+    taking the ChEBI terms with the num_candidates
+    highest values of its columns.
+  
+    Parameters
+    ----------
+    inp_strs: list-str
+        List of strings
+    num_candidates: int
+        Number of ChEBI terms, with ties of the last one
+    is_label: numpy.ndarray (bool)
+        If given, only the ChEBI terms (compact.labels)
+        where it is True are candidates
+  
+    Returns
+    -------
+    :dict
+        {one_str: (numpy.ndarray of ChEBI terms,
+                   numpy.ndarray of cScores)},
+        in the order of compact.labels
+    """
+    compact = cn.loadReference('CHARCOUNT_COMPACT')
+    index = cn.loadReference('CHARCOUNT_BLOCKS')
+    num_blocks = len(index.starts) - 1
+    reps = getQueryRepresentatives(inp_strs)
+    unq_strs = list(dict.fromkeys(reps.values()))
+    chunk_size = self.cscore_chunk_size or max(len(unq_strs), 1)
+    top_cscores = dict()
+    for chunk_start in range(0, len(unq_strs), chunk_size):
+      chunk_strs = unq_strs[chunk_start:chunk_start+chunk_size]
+      query_counts = self.getCounterQueryArray(inp_strs=chunk_strs,
+                                               ref_cols=compact.columns,
+                                               normalize=False)
+      query_sq = np.sum(query_counts.astype(np.float64)**2, axis=0)
+      with np.errstate(divide='ignore', invalid='ignore'):
+        query_units = np.nan_to_num(query_counts / np.sqrt(query_sq))
+      chunk_bounds = getCosineBounds(index, query_units)
+      for idx, spec in enumerate(chunk_strs):
+        if query_sq[idx] == 0 or num_blocks == 0:
+          top_cscores[spec] = (compact.labels[:0], np.zeros(0))
+          continue
+        bounds = chunk_bounds[:, idx]
+        # blocks are scored in the order of bounds until
+        # num_candidates ChEBI terms have cScores; the threshold
+        # is a lower bound of the final one only then
+        num_seeds = min(COSINE_SEED_BLOCKS, num_blocks)
+        seeds = np.argpartition(-bounds, num_seeds-1)[:num_seeds]
+        is_seed = np.zeros(num_blocks, dtype=bool)
+        codes = np.zeros(0, dtype=index.codes.dtype)
+        scores = np.zeros(0)
+        order = None
+        while True:
+          is_seed[seeds] = True
+          seed_codes, seed_scores = scoreCosineBlocks(index, seeds,
+                                                      query_counts[:, idx], query_sq[idx],
+                                                      is_label)
+          codes = np.concatenate([codes, seed_codes])
+          scores = np.concatenate([scores, seed_scores])
+          chebi_max = getSegmentMax(codes, scores)[1]
+          if np.count_nonzero(~np.isnan(chebi_max)) >= num_candidates:
+            threshold = getKthLargest(chebi_max, num_candidates)
+            break
+          if np.all(is_seed):
+            threshold = -np.inf
+            break
+          if order is None:
+            order = np.argsort(-bounds, kind='stable')
+          # twice as many blocks as scored so far
+          seeds = order[~is_seed[order]][:np.count_nonzero(is_seed)]
+        rest = np.flatnonzero(~is_seed & (bounds >= threshold - COSINE_BOUND_MARGIN))
+        if len(rest) > 0:
+          rest = rest[getDualCosineBounds(index, query_units[:, idx], rest) >= \
+                      threshold - COSINE_BOUND_MARGIN]
+          rest_codes, rest_scores = scoreCosineBlocks(index, rest,
+                                                      query_counts[:, idx], query_sq[idx],
+                                                      is_label)
+          codes = np.concatenate([codes, rest_codes])
+          scores = np.concatenate([scores, rest_scores])
+        # rows below the threshold cannot reach the final one
+        is_kept = scores >= threshold
+        chebi_codes, chebi_max = getSegmentMax(codes[is_kept], scores[is_kept])
+        threshold = getKthLargest(chebi_max, num_candidates)
+        if threshold is None:
+          top_cscores[spec] = (compact.labels[:0], np.zeros(0))
+          continue
+        is_top = chebi_max >= threshold
+        top_cscores[spec] = (compact.labels[chebi_codes[is_top]], chebi_max[is_top])
+    return {spec:top_cscores[reps[spec]] for spec in inp_strs}
+
+  def getCompactCScoreArray(self,
+                            inp_strs,
+                            compact=None):
+    """
+    Compute the maximum cScore of 
+    each ChEBI term for query strings,
+    using the compact reference.
+    Dot products of integer counts are exact,
+    and rows are scored in blocks of 
+    about COMPACT_ROW_BLOCK rows.
+  
+    Parameters
+    ----------
+    inp_strs: list-str
+        List of strings
+    compact: CompactCharCount
+        If None, use CHARCOUNT_COMPACT
+  
+    Returns
+    -------
+    : numpy.ndarray
+        (ChEBI terms, i.e., compact.labels x inp_strs)
+    """
+    if compact is None:
+      compact = cn.loadReference('CHARCOUNT_COMPACT')
+    query_counts = self.getCounterQueryArray(inp_strs=inp_strs,
+                                             ref_cols=compact.columns,
+                                             normalize=False)
+    query_sq = np.sum(query_counts.astype(np.float64)**2, axis=0)
+    num_rows = len(compact.counts)
+    starts = compact.starts
+    chebi_max = np.empty((len(starts), len(inp_strs)))
+    # blocks of rows, cut at the first row of a ChEBI term
+    seg_cuts = np.unique(np.concatenate([[0],
+                                         np.searchsorted(starts, np.arange(0, num_rows, COMPACT_ROW_BLOCK)),
+                                         [len(starts)]]))
+    for seg_start, seg_end in zip(seg_cuts[:-1], seg_cuts[1:]):
+      row_start = starts[seg_start]
+      row_end = starts[seg_end] if seg_end < len(starts) else num_rows
+      dots = compact.counts[row_start:row_end].astype(np.float32) @ query_counts
+      with np.errstate(divide='ignore', invalid='ignore'):
+        block_scores = dots / np.sqrt(compact.sq_norms[row_start:row_end, np.newaxis].astype(np.float64) * \
+                                      query_sq)
+      chebi_max[seg_start:seg_end] = np.fmax.reduceat(block_scores,
+                                                      starts[seg_start:seg_end]-row_start,
+                                                      axis=0)
+    return chebi_max
 
   def getOneEScore(self, one_s, two_s):
     """
@@ -174,7 +1333,8 @@ class SpeciesAnnotation(object):
   def getEScores(self,
                  inp_strs,
                  mssc,
-                 cutoff):
+                 cutoff,
+                 use_cache=True):
     """
     Compute the eScores
     of a list of query strings with
@@ -182,8 +1342,13 @@ class SpeciesAnnotation(object):
     A sorted list of tuples 
     (CHEBI:XXXXX, eScore)
     will be returned.
-    Only unique strings
+    Only unique strings (ignoring case,
+    see getQueryRepresentatives)
     will be calculated. 
+    Synonyms that cannot reach the cutoff
+    (or the best eScore with mssc='top')
+    are pruned by SYNONYM_INDEX
+    without changing the result.
   
     Parameters
     ----------
@@ -197,25 +1362,30 @@ class SpeciesAnnotation(object):
     cutoff: float
         Cutoff value; only candidates with match score
         at or above the cutoff will be recommended.
+    use_cache: bool
+        If True, results are served from
+        (and saved in) self.score_cache
   
     Returns
     -------
     :dict
         {one_str: [(CHEBI:XXXXX, 1.0), ...]}
     """
-    unq_strs = list(set(inp_strs))
+    if use_cache and self.score_cache is not None:
+      return self.score_cache.getScores(inp_strs=inp_strs,
+                                        method='edist',
+                                        mssc=mssc,
+                                        cutoff=cutoff,
+                                        score_func=functools.partial(self.getEScores,
+                                                                     use_cache=False))
+    syn_index = cn.loadReference('SYNONYM_INDEX')
+    reps = getQueryRepresentatives(inp_strs)
     escores = dict()
-    for spec in unq_strs:
-      spec_escore = [(one_k, np.max([self.getOneEScore(spec.lower(), val) \
-                               for val in CHEBI_LOW_SYNONYMS[one_k]])) \
-                     for one_k in CHEBI_LOW_SYNONYMS.keys() \
-                     if one_k in cn.REF_CHEBI2FORMULA.keys()]
-      mssc_escore = tools.applyMSSC(pred=spec_escore,
-                                    mssc=mssc,
-                                    cutoff=cutoff)
-      mssc_escore.sort(key=operator.itemgetter(1), reverse=True)
-      escores[spec] = mssc_escore
-    return escores
+    for spec in dict.fromkeys(reps.values()):
+      escores[spec] = syn_index.getEScores(spec.lower(),
+                                           mssc=mssc,
+                                           cutoff=cutoff)
+    return {spec:escores[reps[spec]] for spec in inp_strs}
 
   # Methods to use Cosine Similarity
   def getCountOfIndividualCharacters(self, inp_str):
@@ -233,6 +1403,56 @@ class SpeciesAnnotation(object):
     """
     return collections.Counter(itertools.chain(*re.findall('[a-z0-9]+', inp_str.lower())))
 
+  def getCounterQueryArray(self,
+                           inp_strs,
+                           ref_cols,
+                           dtype=np.float32,
+                           normalize=True):
+    """
+    Vectorize strings in bulk;
+    counts of characters (a-z, 0-9, lowered)
+    scaled by the length of each vector,
+    as an array (len(ref_cols) x len(inp_strs)).
+    Strings without any of the characters
+    become NaN vectors.
+  
+    Parameters
+    ----------
+    inp_strs: list-str
+        Strings to vectorize
+    ref_cols: list-str
+        Characters (column names of the reference) to use
+    dtype: numpy.dtype
+        float32 by default;
+        float64 keeps scores identical to
+        those with the (float64) reference 
+    normalize: bool
+        If False, return raw counts
+      
+    Returns
+    -------
+    : numpy.ndarray
+    """
+    num_strs = len(inp_strs)
+    encoded = [val.lower().encode('utf-8') for val in inp_strs]
+    lens = np.fromiter((len(val) for val in encoded), dtype=np.int64, count=num_strs)
+    # slot (position in COUNT_CHARS) of each byte; -1 if not counted
+    slots = CHAR_SLOTS[np.frombuffer(b''.join(encoded), dtype=np.uint8)]
+    owners = np.repeat(np.arange(num_strs), lens)
+    is_char = slots >= 0
+    counts = np.bincount(slots[is_char]*num_strs + owners[is_char],
+                         minlength=len(COUNT_CHARS)*num_strs)
+    counts = counts.reshape(len(COUNT_CHARS), num_strs).astype(dtype)
+    # Now, scale it using the vector distance
+    if normalize:
+      with np.errstate(divide='ignore', invalid='ignore'):
+        counts /= np.sqrt(np.sum(counts**2, axis=0))
+    ref_slots = np.array([COUNT_CHARS.find(val) if len(str(val))==1 else -1 \
+                          for val in ref_cols], dtype=np.int64)
+    query_arr = np.zeros((len(ref_slots), num_strs), dtype=dtype)
+    query_arr[ref_slots>=0] = counts[ref_slots[ref_slots>=0]]
+    return query_arr
+
   def prepareCounterQuery(self,
                           specs,
                           ref_cols,
@@ -264,24 +1484,13 @@ class SpeciesAnnotation(object):
     : pandas.DataFrame
     : dict
     """
-    name_used = dict()
-    query_mat = pd.DataFrame(0, index=ref_cols, columns=specs)
-    for one_spec in specs:
-      if use_id:
-        name2use = self.getNameToUse(one_spec)
-        # characters are lowered in getCountOfIndividualCharacters()
-        char_counts = self.getCountOfIndividualCharacters(name2use)
-        name_used[one_spec] = name2use
-      else:
-        name2use = one_spec
-        # characters are lowered in getCountOfIndividualCharacters()
-        char_counts = self.getCountOfIndividualCharacters(name2use)
-        name_used[one_spec] = name2use
-      for one_char in char_counts:
-        query_mat.loc[one_char, one_spec] = char_counts[one_char] 
-    # Now, scale it using the vector distance
-    div_row = query_mat.apply(lambda col : np.sqrt(np.sum([val**2 for val in col])), axis = 0)
-    norm_query = query_mat.divide(div_row, axis=1)
+    if use_id:
+      name_used = {one_spec:self.getNameToUse(one_spec) for one_spec in specs}
+    else:
+      name_used = {one_spec:one_spec for one_spec in specs}
+    query_arr = self.getCounterQueryArray(inp_strs=[name_used[val] for val in specs],
+                                          ref_cols=ref_cols)
+    norm_query = pd.DataFrame(query_arr, index=ref_cols, columns=specs)
     return norm_query, name_used
 
   def getNameToUse(self, inp_id):
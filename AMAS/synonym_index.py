@@ -0,0 +1,781 @@
+# synonym_index.py
+"""
+Index of (lowered) ChEBI synonyms
+for edit-distance (eScore) search.
+Synonyms are flattened into arrays sorted by length,
+so that only candidates that can still reach
+a given eScore are evaluated exactly;
+eScore = 1.0 - d/max(len(query), len(synonym)),
+so a minimum eScore bounds the edit distance d,
+which is bounded from below by
+the difference of lengths (length filter) and
+the number of shared q-grams (count filter).
+The index answers within-radius (search) and
+best-match (getBestMatches) queries exactly,
+and is saved in the reference bundle
+(python -m AMAS.reference_bundle)
+so that it is built only once.
+Candidates are scored in batches by
+getBitParallelDistances, which computes edit distances
+of a query with many synonyms at once.
+Near-exact queries are answered first by
+a deletion index (as in SymSpell): synonyms within
+edit distance 1 of a query share
+the query or one of its deletion variants.
+"""
+
+import editdistance
+import numpy as np
+
+from AMAS import tools
+
+
+# Length of q-grams for the count filter
+QGRAM = 2
+# Max. query length of getBitParallelDistances (bits of uint64);
+# longer queries are scored one by one with editdistance
+MAX_BIT_PARALLEL_LEN = 64
+# Max. number of (synonym x character) cells processed at once
+MAX_DISTANCE_CELLS = 1 << 21
+# Number of candidates scored at once in getBestMatches
+BEST_MATCH_BLOCK = 2048
+# Edit distance covered by the deletion index, which holds
+# (length + 1) keys per synonym; not configurable, since
+# getDeletionKeys makes only single-character deletions
+_DELETE_DISTANCE = 1
+# Max. length of synonyms in the deletion index;
+# longer synonyms are farther than _DELETE_DISTANCE
+# from queries up to (MAX_NEAR_LEN - _DELETE_DISTANCE) characters
+MAX_NEAR_LEN = 64
+# Base of polynomial hashes (mod 2**64) of deletion variants
+HASH_BASE = 0x100000001b3
+
+
+def getEScoreFromDistance(edist, max_len):
+  """
+  Compute eScore from an edit distance
+  and the length of the longer string.
+
+  Parameters
+  ----------
+  edist: int/numpy.ndarray
+  max_len: int/numpy.ndarray
+
+  Returns
+  -------
+  : float/numpy.ndarray
+  """
+  return 1.0 - edist / np.maximum(max_len, 1)
+
+def getCodePoints(inp_str):
+  """
+  Get unicode code points of a string.
+
+  Parameters
+  ----------
+  inp_str: str
+
+  Returns
+  -------
+  : numpy.ndarray (int64)
+  """
+  return np.frombuffer(inp_str.encode('utf-32-le'), dtype=np.uint32).astype(np.int64)
+
+def getQgramKeys(code_points, q=QGRAM):
+  """
+  Get integer keys of q-grams of a string.
+
+  Parameters
+  ----------
+  code_points: numpy.ndarray
+      Code points of a string
+  q: int
+
+  Returns
+  -------
+  : numpy.ndarray (int64)
+  """
+  num_grams = len(code_points) - q + 1
+  if num_grams <= 0:
+    return np.array([], dtype=np.int64)
+  # unicode code points use 21 bits
+  keys = np.zeros(num_grams, dtype=np.int64)
+  for idx in range(q):
+    keys = (keys << 21) | code_points[idx:idx+num_grams]
+  return keys
+
+
+def getDeletionKeys(code_points):
+  """
+  Get hash keys of strings of the same length
+  and of their variants with one character deleted.
+  Key of a string t is sum(t[j] * HASH_BASE**(len(t)-1-j)),
+  so a variant and an equal string get the same key.
+
+  Parameters
+  ----------
+  code_points: numpy.ndarray
+      (number of strings x length) code points
+
+  Returns
+  -------
+  : numpy.ndarray (uint64)
+      (number of strings x (length+1));
+      column 0 is the string itself and
+      column i+1 is the string without i-th character
+  """
+  num_strs, str_len = code_points.shape
+  keys = np.zeros((num_strs, str_len+1), dtype=np.uint64)
+  if str_len == 0:
+    return keys
+  codes = code_points.astype(np.uint64)
+  powers = np.full(str_len+1, HASH_BASE, dtype=np.uint64)
+  powers[0] = 1
+  powers = np.cumprod(powers, dtype=np.uint64)
+  # sums wrap around (mod 2**64)
+  weighted = codes * powers[str_len-1::-1]
+  keys[:, 0] = weighted.sum(axis=1, dtype=np.uint64)
+  # characters after i keep their powers;
+  # characters before i get one power lower
+  suffix = keys[:, :1] - np.cumsum(weighted, axis=1, dtype=np.uint64)
+  prefix = np.zeros((num_strs, str_len), dtype=np.uint64)
+  if str_len > 1:
+    prefix[:, 1:] = np.cumsum(codes[:, :-1] * powers[str_len-2::-1], axis=1, dtype=np.uint64)
+  keys[:, 1:] = prefix + suffix
+  return keys
+
+def getBitParallelDistances(query_ids, char_ids, starts, lens, num_ids=None):
+  """
+  Compute Levenshtein distances of a query
+  with many strings using the bit-parallel algorithm
+  of Myers (1999), as formulated by Hyyro (2001),
+  vectorized over strings; one uint64 word
+  holds a column of the dynamic programming matrix.
+  Strings are given as character ids
+  char_ids[starts[i]:starts[i]+lens[i]].
+
+  Parameters
+  ----------
+  query_ids: numpy.ndarray
+      Character ids of the query (1-64 characters);
+      0 if the character doesn't appear in char_ids
+  char_ids: numpy.ndarray
+      Character ids (>0) of concatenated strings
+  starts: numpy.ndarray
+  lens: numpy.ndarray
+  num_ids: int
+      Max. character id; if None, computed from char_ids
+
+  Returns
+  -------
+  : numpy.ndarray (int64)
+  """
+  query_len = len(query_ids)
+  lens = np.asarray(lens, dtype=np.int64)
+  if num_ids is None:
+    num_ids = int(char_ids.max(initial=0))
+  # peq[c]: bits of query positions with character id c
+  peq = np.zeros(max(num_ids, int(query_ids.max(initial=0))) + 1, dtype=np.uint64)
+  for pos, one_id in enumerate(query_ids.tolist()):
+    if one_id > 0:
+      peq[one_id] |= np.uint64(1) << np.uint64(pos)
+  last_bit = np.uint64(1) << np.uint64(query_len - 1)
+  one = np.uint64(1)
+  # rows sorted by length; rows that have ended
+  # are dropped from the front of each block
+  order = np.argsort(lens, kind='stable')
+  sorted_lens = lens[order]
+  sorted_starts = np.asarray(starts, dtype=np.int64)[order]
+  sorted_dists = np.full(len(lens), query_len, dtype=np.int64)
+  block_start = 0
+  while block_start < len(lens):
+    block_end = min(len(lens), block_start + max(1, MAX_DISTANCE_CELLS // max(int(sorted_lens[block_start]), 1)))
+    while block_end - block_start > 1 and \
+          (block_end - block_start) * sorted_lens[block_end-1] > MAX_DISTANCE_CELLS:
+      block_end = block_start + max(1, (block_end - block_start) // 2)
+    block_lens = sorted_lens[block_start:block_end]
+    max_len = int(block_lens[-1])
+    # (position x string) character ids; positions past the end
+    # of a string are never used
+    pos_idx = sorted_starts[block_start:block_end] + np.arange(max_len)[:, None]
+    texts = char_ids[np.minimum(pos_idx, len(char_ids)-1)]
+    # ends[j]: number of strings shorter than j+1
+    ends = np.searchsorted(block_lens, np.arange(1, max_len+1), side='right')
+    # empty strings are done
+    first = int(np.searchsorted(block_lens, 1))
+    num_rows = block_end - block_start - first
+    pv = np.full(num_rows, ~np.uint64(0), dtype=np.uint64)
+    mv = np.zeros(num_rows, dtype=np.uint64)
+    score = np.full(num_rows, query_len, dtype=np.int64)
+    for pos in range(max_len):
+      eq = peq[texts[pos, first:]]
+      xv = eq | mv
+      xh = (((eq & pv) + pv) ^ pv) | eq
+      ph = mv | ~(xh | pv)
+      mh = pv & xh
+      score += (ph & last_bit).astype(bool)
+      score -= (mh & last_bit).astype(bool)
+      ph = (ph << one) | one
+      mh = mh << one
+      pv = mh | ~(xv | ph)
+      mv = ph & xv
+      # strings of length pos+1 are done
+      new_first = int(ends[pos])
+      if new_first > first:
+        sorted_dists[block_start+first:block_start+new_first] = score[:new_first-first]
+        drop = new_first - first
+        pv, mv, score = pv[drop:], mv[drop:], score[drop:]
+        first = new_first
+    block_start = block_end
+  dists = np.empty(len(lens), dtype=np.int64)
+  dists[order] = sorted_dists
+  return dists
+
+
+class SynonymIndex(object):
+  """
+  Synonyms of ChEBI terms flattened
+  into arrays sorted by length.
+  i-th synonym is strs[i], of ChEBI term labels[owners[i]];
+  synonyms of length L are strs[len_starts[L]:len_starts[L+1]].
+  Postings of j-th q-gram (gram_keys[j]) are
+  synonyms post_strs[gram_starts[j]:gram_starts[j+1]]
+  with counts post_counts[...].
+  Characters of i-th synonym are
+  char_ids[str_starts[i]:str_starts[i]+lens[i]],
+  where id k (>0) is code point chars[k-1].
+  Deletion index: del_keys (sorted) are keys (getDeletionKeys)
+  of synonyms del_strs (up to MAX_NEAR_LEN characters)
+  and their deletion variants.
+  """
+
+  def __init__(self, labels, strs, owners, lens, len_starts,
+               gram_keys, gram_starts, post_strs, post_counts,
+               chars, char_ids, str_starts, del_keys, del_strs, q=QGRAM):
+    """
+    Use SynonymIndex.build() to create
+    an index from CHEBI_LOW_SYNONYMS;
+    arrays can be memory-mapped.
+    """
+    self.labels = np.asarray(labels, dtype=object)
+    self.strs = list(strs)
+    self.owners = owners
+    self.lens = lens
+    self.len_starts = np.asarray(len_starts).tolist()
+    self.gram_keys = gram_keys
+    self.gram_starts = gram_starts
+    self.post_strs = post_strs
+    self.post_counts = post_counts
+    self.chars = chars
+    self.char_ids = char_ids
+    self.str_starts = str_starts
+    self.del_keys = del_keys
+    self.del_strs = del_strs
+    self.q = q
+    # True if a synonym can be returned
+    self.is_valid = np.ones(len(self.strs), dtype=bool)
+    # synonyms of i-th ChEBI term are
+    # label_strs[label_starts[i]:label_starts[i+1]]
+    self.label_strs = np.argsort(np.asarray(owners), kind='stable')
+    self.label_starts = np.searchsorted(np.asarray(owners)[self.label_strs],
+                                        np.arange(len(self.labels)+1))
+    self.label_index = {val:idx for idx, val in enumerate(self.labels.tolist())}
+
+  @classmethod
+  def build(cls, synonyms, q=QGRAM):
+    """
+    Parameters
+    ----------
+    synonyms: dict
+        {ChEBI term: [lowered synonyms]},
+        e.g., CHEBI_LOW_SYNONYMS
+    q: int
+        Length of q-grams
+
+    Returns
+    -------
+    : SynonymIndex
+    """
+    # ChEBI terms keep the order of synonyms
+    labels = list(synonyms.keys())
+    strs = [val for one_k in labels for val in synonyms[one_k]]
+    owners = np.repeat(np.arange(len(labels), dtype=np.int32),
+                       [len(synonyms[one_k]) for one_k in labels])
+    lens = np.fromiter((len(val) for val in strs), dtype=np.int64, count=len(strs))
+    order = np.argsort(lens, kind='stable')
+    strs = [strs[idx] for idx in order]
+    lens = lens[order]
+    max_len = int(lens.max(initial=0))
+    code_points = getCodePoints(''.join(strs))
+    chars, char_ids = np.unique(code_points, return_inverse=True)
+    str_starts = np.zeros(len(strs), dtype=np.int64)
+    np.cumsum(lens[:-1], out=str_starts[1:])
+    return cls(labels=labels,
+               strs=strs,
+               owners=owners[order],
+               lens=lens.astype(np.int32),
+               len_starts=np.searchsorted(lens, np.arange(max_len+2)).astype(np.int64),
+               chars=chars,
+               char_ids=(char_ids + 1).astype(np.min_scalar_type(len(chars))),
+               str_starts=str_starts,
+               q=q,
+               **cls.buildQgramPostings(code_points, lens, q),
+               **cls.buildDeletionIndex(code_points, lens))
+
+  @staticmethod
+  def buildDeletionIndex(code_points, lens):
+    """
+    Build the deletion index of strings
+    sorted by length, up to MAX_NEAR_LEN characters.
+
+    Parameters
+    ----------
+    code_points: numpy.ndarray
+        Code points of concatenated strings
+    lens: numpy.ndarray
+        Lengths of strings (sorted)
+
+    Returns
+    -------
+    : dict
+        del_keys, del_strs
+    """
+    keys = []
+    strs = []
+    str_start = 0
+    char_start = 0
+    # strings of the same length at once
+    for one_len, one_count in zip(*np.unique(lens, return_counts=True)):
+      one_len, one_count = int(one_len), int(one_count)
+      if one_len > MAX_NEAR_LEN:
+        break
+      char_end = char_start + one_len*one_count
+      one_keys = getDeletionKeys(code_points[char_start:char_end].reshape(one_count, one_len))
+      keys.append(one_keys.ravel())
+      strs.append(np.repeat(np.arange(str_start, str_start+one_count, dtype=np.int32),
+                            one_len+1))
+      str_start += one_count
+      char_start = char_end
+    if not keys:
+      return {'del_keys': np.array([], dtype=np.uint64),
+              'del_strs': np.array([], dtype=np.int32)}
+    keys = np.concatenate(keys)
+    order = np.argsort(keys, kind='stable')
+    return {'del_keys': keys[order],
+            'del_strs': np.concatenate(strs)[order]}
+
+  @staticmethod
+  def buildQgramPostings(code_points, lens, q=QGRAM):
+    """
+    Build posting lists of q-grams.
+
+    Parameters
+    ----------
+    code_points: numpy.ndarray
+        Code points of concatenated strings
+    lens: numpy.ndarray
+        Lengths of strings
+    q: int
+
+    Returns
+    -------
+    : dict
+        gram_keys, gram_starts, post_strs, post_counts
+    """
+    num_strs = len(lens)
+    str_ends = np.cumsum(lens)
+    keys = getQgramKeys(code_points, q)
+    # a q-gram must not cross a boundary of two synonyms
+    owners = np.repeat(np.arange(num_strs), lens)[:len(keys)]
+    is_inside = np.arange(len(keys)) + q <= str_ends[owners]
+    gram_keys, gram_ids = np.unique(keys[is_inside], return_inverse=True)
+    pairs, counts = np.unique(gram_ids.astype(np.int64)*num_strs + owners[is_inside],
+                              return_counts=True)
+    # pairs are sorted by q-gram, then by synonym
+    post_grams = pairs // max(num_strs, 1)
+    return {'gram_keys': gram_keys,
+            'gram_starts': np.searchsorted(post_grams,
+                                           np.arange(len(gram_keys)+1)).astype(np.int64),
+            'post_strs': (pairs % max(num_strs, 1)).astype(np.int32),
+            'post_counts': counts.astype(np.min_scalar_type(counts.max(initial=0)))}
+
+  def setValidChEBIs(self, chebis):
+    """
+    Restrict results to synonyms of given ChEBI terms.
+
+    Parameters
+    ----------
+    chebis: set/dict
+        e.g., cn.REF_CHEBI2FORMULA
+    """
+    is_valid_label = np.array([val in chebis for val in self.labels.tolist()], dtype=bool)
+    self.is_valid = is_valid_label[np.asarray(self.owners)]
+
+  def getSharedQgramCounts(self, query, start, end):
+    """
+    Count q-grams (as multisets) shared by
+    the query and each of synonyms[start:end].
+
+    Parameters
+    ----------
+    query: str
+    start: int
+    end: int
+
+    Returns
+    -------
+    : numpy.ndarray
+    """
+    shared = np.zeros(end-start, dtype=np.int64)
+    keys, query_counts = np.unique(getQgramKeys(getCodePoints(query), self.q),
+                                   return_counts=True)
+    if len(self.gram_keys) == 0:
+      return shared
+    gram_idx = np.minimum(np.searchsorted(self.gram_keys, keys), len(self.gram_keys)-1)
+    is_found = self.gram_keys[gram_idx] == keys
+    for one_gram, one_count in zip(gram_idx[is_found], query_counts[is_found]):
+      post_start, post_end = self.gram_starts[one_gram], self.gram_starts[one_gram+1]
+      # postings of a q-gram are sorted by synonym
+      post_strs = self.post_strs[post_start:post_end]
+      lower, upper = np.searchsorted(post_strs, [start, end]) + post_start
+      shared[self.post_strs[lower:upper] - start] += np.minimum(self.post_counts[lower:upper],
+                                                                one_count)
+    return shared
+
+  def getCandidates(self, query, min_score):
+    """
+    Get synonyms that can have
+    an eScore of min_score or above,
+    with upper bounds of their eScores.
+
+    Parameters
+    ----------
+    query: str
+        Lowered query string
+    min_score: float
+
+    Returns
+    -------
+    : numpy.ndarray
+        Indices of synonyms
+    : numpy.ndarray
+        Upper bounds of eScores
+    """
+    query_len = len(query)
+    # length filter; with max_dist = (1-min_score) * max_len,
+    # |query_len - L| <= max_dist
+    min_len, max_len = 0, len(self.len_starts) - 2
+    if min_score > 0:
+      min_len = int(np.ceil(query_len * min_score - 1e-9))
+      max_len = min(max_len, int(np.floor(query_len / min_score + 1e-9)))
+    if min_len > max_len:
+      return np.array([], dtype=np.int64), np.array([])
+    start = self.len_starts[min_len]
+    end = self.len_starts[max_len+1]
+    cand_lens = self.lens[start:end].astype(np.int64)
+    longer = np.maximum(cand_lens, query_len)
+    # count filter; ed <= k requires at least
+    # max_len - q + 1 - k*q shared q-grams
+    shared = self.getSharedQgramCounts(query, start, end)
+    qgram_dist = np.ceil((longer - self.q + 1 - shared) / self.q)
+    min_dist = np.maximum(np.abs(cand_lens - query_len), qgram_dist)
+    upper = getEScoreFromDistance(min_dist, longer)
+    is_cand = (upper >= min_score) & self.is_valid[start:end]
+    return np.flatnonzero(is_cand) + start, upper[is_cand]
+
+  def getCharIds(self, query):
+    """
+    Get character ids of a query string;
+    0 if the character is not used by synonyms.
+
+    Parameters
+    ----------
+    query: str
+
+    Returns
+    -------
+    : numpy.ndarray
+    """
+    code_points = getCodePoints(query)
+    if len(self.chars) == 0:
+      return np.zeros(len(code_points), dtype=np.int64)
+    pos = np.minimum(np.searchsorted(self.chars, code_points), len(self.chars)-1)
+    return np.where(self.chars[pos] == code_points, pos + 1, 0)
+
+  def getDistances(self, query, idxs):
+    """
+    Compute edit distances of the query
+    with synonyms in one batch.
+
+    Parameters
+    ----------
+    query: str
+    idxs: numpy.ndarray
+        Indices of synonyms
+
+    Returns
+    -------
+    : numpy.ndarray (int64)
+    """
+    idxs = np.asarray(idxs, dtype=np.int64)
+    if len(query) == 0:
+      return np.asarray(self.lens[idxs], dtype=np.int64)
+    if len(query) > MAX_BIT_PARALLEL_LEN:
+      return np.fromiter((editdistance.eval(query, self.strs[val]) for val in idxs.tolist()),
+                         dtype=np.int64, count=len(idxs))
+    return getBitParallelDistances(query_ids=self.getCharIds(query),
+                                   char_ids=self.char_ids,
+                                   starts=self.str_starts[idxs],
+                                   lens=self.lens[idxs],
+                                   num_ids=len(self.chars))
+
+  def getEScoreArray(self, query, idxs):
+    """
+    Compute eScores of the query
+    with synonyms in one batch.
+
+    Parameters
+    ----------
+    query: str
+    idxs: numpy.ndarray
+        Indices of synonyms
+
+    Returns
+    -------
+    : numpy.ndarray (float64)
+    """
+    idxs = np.asarray(idxs, dtype=np.int64)
+    longer = np.maximum(np.asarray(self.lens[idxs], dtype=np.int64), len(query))
+    return getEScoreFromDistance(self.getDistances(query, idxs), longer)
+
+  def search(self, query, min_score):
+    """
+    Find synonyms with an eScore
+    of min_score or above.
+
+    Parameters
+    ----------
+    query: str
+        Lowered query string
+    min_score: float
+
+    Returns
+    -------
+    : numpy.ndarray
+        Indices of synonyms
+    : numpy.ndarray
+        eScores
+    """
+    cands, _ = self.getCandidates(query, min_score)
+    scores = self.getEScoreArray(query, cands)
+    is_found = scores >= min_score
+    return cands[is_found], scores[is_found]
+
+  def getBestMatches(self, query, min_score=0.0):
+    """
+    Find synonyms with the highest eScore
+    (at or above min_score). Candidates are evaluated
+    in blocks, in the order of their upper bounds,
+    until no remaining candidate can reach the best.
+
+    Parameters
+    ----------
+    query: str
+        Lowered query string
+    min_score: float
+
+    Returns
+    -------
+    : numpy.ndarray
+        Indices of synonyms
+    : float/None
+        The highest eScore; None if not found
+    """
+    cands, upper = self.getCandidates(query, min_score)
+    order = np.argsort(-upper, kind='stable')
+    cands = cands[order]
+    upper = upper[order]
+    best = None
+    evaluated = []
+    for start in range(0, len(cands), BEST_MATCH_BLOCK):
+      if best is not None and upper[start] < best:
+        break
+      block = cands[start:start+BEST_MATCH_BLOCK]
+      scores = self.getEScoreArray(query, block)
+      evaluated.append((block, scores))
+      block_best = scores.max()
+      if block_best >= min_score and (best is None or block_best > best):
+        best = float(block_best)
+    if best is None:
+      return np.array([], dtype=np.int64), None
+    idxs = np.concatenate([val[0][val[1] == best] for val in evaluated])
+    return idxs, best
+
+  def getChEBIEScores(self, query, chebis):
+    """
+    Get eScores of a query with given ChEBI terms
+    (max. eScore of their synonyms).
+
+    Parameters
+    ----------
+    query: str
+        Lowered query string
+    chebis: list-str
+        ChEBI terms
+
+    Returns
+    -------
+    : numpy.ndarray
+        eScores; NaN if a ChEBI term has no (valid) synonyms
+    """
+    res = np.full(len(chebis), np.nan)
+    label_idxs = [self.label_index.get(val, -1) for val in chebis]
+    idxs = [self.label_strs[self.label_starts[val]:self.label_starts[val+1]] \
+            if val >= 0 else np.array([], dtype=np.int64) for val in label_idxs]
+    seg_ids = np.repeat(np.arange(len(chebis)), [len(val) for val in idxs])
+    idxs = np.concatenate(idxs + [np.array([], dtype=np.int64)]).astype(np.int64)
+    is_valid = self.is_valid[idxs]
+    idxs = idxs[is_valid]
+    np.fmax.at(res, seg_ids[is_valid], self.getEScoreArray(query, idxs))
+    return res
+
+  def hasValidSynonyms(self, chebis):
+    """
+    Check which ChEBI terms have valid synonyms,
+    i.e., get a non-NaN value in getChEBIEScores.
+
+    Parameters
+    ----------
+    chebis: list-str
+        ChEBI terms
+
+    Returns
+    -------
+    : numpy.ndarray (bool)
+    """
+    label_owners = np.repeat(np.arange(len(self.labels)), np.diff(self.label_starts))
+    is_valid_label = np.zeros(len(self.labels)+1, dtype=bool)
+    is_valid_label[label_owners[self.is_valid[self.label_strs]]] = True
+    # unknown ChEBI terms point to the last (False) entry
+    label_idxs = np.array([self.label_index.get(val, -1) for val in chebis],
+                          dtype=np.int64)
+    return is_valid_label[label_idxs]
+
+  def getNearCandidates(self, query):
+    """
+    Get synonyms sharing the query or one of
+    its deletion variants in the deletion index;
+    all synonyms within _DELETE_DISTANCE are included.
+
+    Parameters
+    ----------
+    query: str
+
+    Returns
+    -------
+    : numpy.ndarray
+        Indices of synonyms
+    """
+    keys = np.unique(getDeletionKeys(getCodePoints(query)[None, :]))
+    lower = np.searchsorted(self.del_keys, keys, side='left')
+    upper = np.searchsorted(self.del_keys, keys, side='right')
+    cands = np.unique(np.concatenate([self.del_strs[one_lower:one_upper] \
+                                      for one_lower, one_upper in zip(lower, upper)] + \
+                                     [np.array([], dtype=np.int64)]))
+    return cands[self.is_valid[cands]]
+
+  def getNearScoreBound(self, query):
+    """
+    Get the max. eScore of synonyms
+    farther than _DELETE_DISTANCE from the query,
+    reached with distance _DELETE_DISTANCE+1
+    and length len(query)+_DELETE_DISTANCE+1.
+
+    Parameters
+    ----------
+    query: str
+
+    Returns
+    -------
+    : float
+    """
+    min_dist = _DELETE_DISTANCE + 1
+    return getEScoreFromDistance(min_dist, len(query) + min_dist)
+
+  def getNearEScores(self, query, mssc, cutoff):
+    """
+    Get eScores of a query (as getEScores)
+    from the deletion index only.
+    The result is exact only if it could not be
+    reached by synonyms outside the index.
+
+    Parameters
+    ----------
+    query: str
+    mssc: str
+    cutoff: float
+
+    Returns
+    -------
+    : numpy.ndarray/None
+        Indices of synonyms;
+        None if the result is not exact
+    : numpy.ndarray/None
+        eScores
+    """
+    if len(query) > MAX_NEAR_LEN - _DELETE_DISTANCE:
+      return None, None
+    bound = self.getNearScoreBound(query)
+    cands = self.getNearCandidates(query)
+    scores = self.getEScoreArray(query, cands)
+    if mssc == 'top':
+      best = scores.max(initial=-1.0)
+      if best <= bound:
+        return None, None
+      is_found = (scores == best) & (scores >= cutoff)
+    else:
+      if cutoff <= bound:
+        return None, None
+      is_found = scores >= cutoff
+    return cands[is_found], scores[is_found]
+
+  def getEScores(self, query, mssc, cutoff):
+    """
+    Get eScores of a (lowered) query string
+    with ChEBI terms (max. eScore of their synonyms),
+    evaluating only candidates that can pass
+    the cutoff (mssc='above') or reach
+    the best eScore (mssc='top').
+    Result is the same as computing eScores
+    with all synonyms.
+    The deletion index is tried first;
+    other synonyms are searched only if needed.
+
+    Parameters
+    ----------
+    query: str
+    mssc: str
+    cutoff: float
+
+    Returns
+    -------
+    : list-tuple
+        [(CHEBI:XXXXX, eScore), ...] sorted by eScore
+    """
+    idxs, scores = self.getNearEScores(query, mssc, cutoff)
+    if idxs is None and mssc == 'top':
+      idxs, best = self.getBestMatches(query, cutoff)
+      scores = np.full(len(idxs), best, dtype=np.float64)
+    elif idxs is None:
+      idxs, scores = self.search(query, cutoff)
+    if len(idxs) == 0:
+      return []
+    # max. eScore of each ChEBI term (segments of sorted owners)
+    owners = np.asarray(self.owners[idxs], dtype=np.int64)
+    order = np.argsort(owners, kind='stable')
+    owners = owners[order]
+    seg_starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+    return tools.applyMSSCToArray(labels=self.labels[owners[seg_starts]],
+                                  scores=np.maximum.reduceat(scores[order], seg_starts),
+                                  mssc=mssc,
+                                  cutoff=cutoff)
@@ -36,6 +36,46 @@ def applyMSSC(pred,
     res_pred = filt_pred
   return res_pred
 
+def applyMSSCToArray(labels,
+                     scores,
+                     mssc,
+                     cutoff,
+                     sort=True):
+  """
+  Vectorized version of applyMSSC
+  for labels and scores given as arrays.
+  NaN scores are never recommended.
+
+  Parameters
+  ----------
+  labels: list-str/numpy.ndarray
+      [CHEBI:XXXXX, etc.]
+  scores: numpy.ndarray
+      Match scores, sharing the order with labels
+  mssc: string
+  cutoff: float
+  sort: bool
+      If True, sort the result by score (max -> min);
+      ties keep the order of labels
+
+  Returns
+  -------
+  filt: list-tuple
+      [(CHEBI:XXXXX, 1.0), etc.]
+  """
+  scores = np.asarray(scores)
+  with np.errstate(invalid='ignore'):
+    filt_idx = np.flatnonzero(scores >= cutoff)
+  if len(filt_idx) == 0:
+    return []
+  if mssc == 'top':
+    filt_scores = scores[filt_idx]
+    filt_idx = filt_idx[filt_scores == filt_scores.max()]
+  if sort:
+    filt_idx = filt_idx[np.argsort(-scores[filt_idx], kind='stable')]
+  return list(zip(np.asarray(labels, dtype=object)[filt_idx].tolist(),
+                  scores[filt_idx].tolist()))
+
 def extractExistingSpeciesAnnotation(inp_model, qualifier=cn.CHEBI):
   """
   Get existing annotation of species
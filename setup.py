@@ -8,6 +8,7 @@ INSTALL_REQUIRES = [
     "pandas",
     "python-libsbml",
     "pyyaml",
+    "scipy",
     ]
 
 def doSetup(install_requires):
@@ -0,0 +1,41 @@
+# test_constants.py
+# Testing lazy loading of reference tables
+
+
+import unittest
+
+from AMAS import constants as cn
+
+
+ONE_CHEBI = 'CHEBI:15378'
+ONE_FORMULA = 'H'
+DUMMY_NAME = 'DUMMY_REFERENCE'
+
+
+#############################
+# Tests
+#############################
+class TestConstants(unittest.TestCase):
+
+  def testLoadReference(self):
+    ref = cn.loadReference('REF_CHEBI2FORMULA')
+    self.assertTrue(cn.isReferenceLoaded('REF_CHEBI2FORMULA'))
+    self.assertEqual(ref[ONE_CHEBI], ONE_FORMULA)
+    # the same object is shared afterwards
+    self.assertTrue(cn.REF_CHEBI2FORMULA is ref)
+
+  def testRegisterReference(self):
+    calls = []
+    cn.registerReference(DUMMY_NAME, lambda: calls.append(1) or {'a': 1})
+    self.assertFalse(cn.isReferenceLoaded(DUMMY_NAME))
+    self.assertEqual(cn.loadReference(DUMMY_NAME), {'a': 1})
+    self.assertEqual(cn.loadReference(DUMMY_NAME), {'a': 1})
+    self.assertEqual(len(calls), 1)
+
+  def testGetAttrError(self):
+    with self.assertRaises(AttributeError):
+      cn.NOT_A_REFERENCE
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -100,6 +100,24 @@ class TestIterator(unittest.TestCase):
     self.assertEqual(np.round(res[it.OLD_SCORE], 2),
                      0.90)
     self.assertTrue(res[it.INCREASED])
+    # state of the shared ReactionAnnotation is not changed
+    self.assertEqual(self.anot_iter.reactions.overlaps, dict())
+    self.assertIsNone(self.anot_iter.reactions.rscore_params)
+    self.assertEqual(sorted(self.anot_iter.rscorer.overlaps.keys()), sorted(REACTIONS))
+
+  def testGetUpdatedMatchScoreOfReactionsToUpdate(self):
+    # reactions outside self.r2upd are not averaged
+    spec_formulas = copy.deepcopy(INIT_SPEC_FORMULA)
+    spec_formulas.update({spec:['H'] for spec in self.anot_iter.reactions.reaction_components['R_PGK'] \
+                          if spec not in spec_formulas})
+    self.anot_iter.getOrigRScores()
+    self.anot_iter.rscorer.getRScores(spec_dict=spec_formulas,
+                                      reacs=REACTIONS + ['R_PGK'],
+                                      mssc='top', cutoff=0.0, keep_state=True)
+    res = self.anot_iter.getUpdatedMatchScore(cur_spec_formulas=spec_formulas,
+                                              inp_spec2formula_dict=ONE_SPEC2FORMULA)
+    self.assertEqual(np.round(res[it.NEW_SCORE], 2),
+                     1.00)
 
   def testMatch(self):
     res_match = self.anot_iter.match()
@@ -1,15 +1,22 @@
 # test_reaction_annotation.py
 # Test for ReactionAnnotation class
 
+import itertools
 import libsbml
 import numpy as np
 import os
+import pandas as pd
+from scipy import sparse
+import shutil
 import sys
+import tempfile
 import unittest
+from unittest import mock
 
 from AMAS import species_annotation as sa
 from AMAS import reaction_annotation as ra
 from AMAS import constants as cn
+from AMAS import score_cache as sc
 from AMAS import tools
 
 
@@ -29,6 +36,16 @@ DUMMY_PRED = {'a': ['ABC'],
              'b': ['AAA']}
 
 
+def getDenseRScores(ref_df, query_formulas, mssc, cutoff):
+  overlaps = ref_df[[val for val in ref_df.columns if val in query_formulas]].sum(axis=1).to_numpy()
+  row_nnz = (ref_df.to_numpy() > 0).sum(axis=1)
+  denom = row_nnz[overlaps == overlaps.max()].min()
+  with np.errstate(divide='ignore', invalid='ignore'):
+    scores = overlaps / np.float64(denom)
+  return tools.applyMSSCToArray(labels=ref_df.index, scores=scores,
+                                mssc=mssc, cutoff=cutoff)
+
+
 #############################
 # Tests
 #############################
@@ -65,11 +82,189 @@ class TestReactionAnnotation(unittest.TestCase):
     num_elements = self.reac_cl.getRheaElementNum(inp_rhea=ONE_CANDIDATE)
     self.assertEqual(num_elements, 5)
 
+  def testBuildReferenceMatrix(self):
+    ref_mat = ra.buildReferenceMatrix()
+    self.assertEqual(ref_mat.format, 'csr')
+    self.assertEqual(ref_mat.shape, (len(ra.REF_MAT_INDEX), len(ra.REF_MAT_COLUMNS)))
+    self.assertEqual(set(ref_mat.data), {1})
+    one_row = ra.REF_MAT_INDEX.get_loc(ONE_CANDIDATE)
+    self.assertEqual(ref_mat[one_row, :].nnz, 5)
+
+  def testBuildReferenceFrame(self):
+    ref_df = cn.loadReference('REF_MAT', cache=False)
+    self.assertTrue(ref_df.index.equals(ra.REF_MAT_INDEX))
+    self.assertTrue(ref_df.columns.equals(ra.REF_MAT_COLUMNS))
+    self.assertEqual(ref_df.loc[ONE_CANDIDATE, :].sum(), 5)
+    self.assertEqual(ref_df.to_numpy().sum(), ra.REF_MAT_SPARSE.nnz)
+
+  def testGetRScoresWithDataFrame(self):
+    specs = {'M_f6p_c': ['C6O9P'],
+             'M_fdp_c': ['C6O12P2'],
+             'M_atp_c': ['C10N5O13P3'],
+             'M_h_c': ['H'],
+             'M_adp_c': ['C10N5O10P2']}
+    res = self.reac_cl.getRScores(spec_dict=specs,
+                                  reacs=[R_PFK],
+                                  mssc='top',
+                                  cutoff=0.0)[R_PFK]
+    ref_df = pd.DataFrame(ra.REF_MAT_SPARSE.toarray(),
+                          index=ra.REF_MAT_INDEX,
+                          columns=ra.REF_MAT_COLUMNS)
+    df_res = self.reac_cl.getRScores(spec_dict=specs,
+                                     reacs=[R_PFK],
+                                     mssc='top',
+                                     cutoff=0.0,
+                                     ref_mat=ref_df)[R_PFK]
+    self.assertEqual(res, df_res)
+    self.assertTrue(ONE_CANDIDATE in [val[0] for val in res])
 
+  def testGetOverlapRScores(self):
+    rng = np.random.default_rng(0)
+    ref_df = pd.DataFrame((rng.random((30, 8)) < 0.3).astype(int),
+                          index=['RHEA:%d' % val for val in range(30)],
+                          columns=['F%d' % val for val in range(8)])
+    postings = sparse.csc_matrix(ref_df.to_numpy())
+    row_nnz = (ref_df.to_numpy() > 0).sum(axis=1)
+    for query_formulas in [['F0', 'F3'], ['F1', 'F2', 'F5', 'F7'], []]:
+      rows, counts = ra.getRheaOverlaps(postings, ref_df.columns.get_indexer(query_formulas))
+      self.assertEqual(rows.tolist(),
+                       np.flatnonzero(ref_df[query_formulas].sum(axis=1)).tolist())
+      for mssc, cutoff in [('top', 0.0), ('above', 0.0), ('above', 0.3), ('top', 0.9)]:
+        res = ra.getOverlapRScores(rows, counts, row_nnz,
+                                   ref_df.index.to_numpy(dtype=object), mssc, cutoff)
+        self.assertEqual(res, getDenseRScores(ref_df, query_formulas, mssc, cutoff))
 
+  def testUpdateSpeciesFormulas(self):
+    reacs = ['R_PFK', 'R_PGK', 'R_PGI', 'R_ATPM']
+    specs = {spec:['H'] for spec in itertools.chain(*[self.reac_cl.reaction_components[val] \
+                                                      for val in reacs])}
+    specs.update({'M_f6p_c': ['C6O9P'],
+                  'M_fdp_c': ['C6O12P2'],
+                  'M_adp_c': ['C10N5O10P2']})
+    self.reac_cl.candidates = self.reac_cl.getRScores(spec_dict=specs, reacs=reacs,
+                                                      mssc='above', cutoff=0.1,
+                                                      keep_state=True)
+    self.assertTrue('R_PFK' in self.reac_cl.species_reactions['M_f6p_c'])
+    new_specs = dict(specs)
+    new_specs['M_atp_c'] = ['C10N5O13P3', 'H']
+    new_specs['M_h_c'] = ['C6O9P']
+    expected = self.reac_cl.getRScores(spec_dict=new_specs, reacs=reacs,
+                                       mssc='above', cutoff=0.1)
+    patched = self.reac_cl.getPatchedRScores(new_specs)
+    self.assertEqual(patched, {val:expected[val] for val in patched.keys()})
+    # R_PGI has neither ATP nor H+
+    self.assertEqual(sorted(patched.keys()), ['R_ATPM', 'R_PFK', 'R_PGK'])
+    candidates = self.reac_cl.candidates
+    rescored = self.reac_cl.updateSpeciesFormulas({'M_atp_c': new_specs['M_atp_c'],
+                                                   'M_h_c': new_specs['M_h_c']})
+    self.assertEqual(rescored, patched)
+    self.assertIs(self.reac_cl.candidates, candidates)
+    self.assertEqual(self.reac_cl.candidates, expected)
+    self.assertEqual(self.reac_cl.getPatchedRScores(new_specs), dict())
+    # and back
+    self.reac_cl.updateSpeciesFormulas({'M_atp_c': ['H'], 'M_h_c': ['H']})
+    self.assertEqual(self.reac_cl.candidates,
+                     self.reac_cl.getRScores(spec_dict=specs, reacs=reacs,
+                                             mssc='above', cutoff=0.1))
 
+  def testGetRScoresReplacesState(self):
+    specs = {spec:['H'] for spec in itertools.chain(*[self.reac_cl.reaction_components[val] \
+                                                      for val in ['R_PFK', 'R_PGI']])}
+    self.reac_cl.getRScores(spec_dict=specs, reacs=['R_PFK'],
+                            mssc='above', cutoff=0.1, keep_state=True)
+    self.reac_cl.getRScores(spec_dict=specs, reacs=['R_PGI'],
+                            mssc='top', cutoff=0.0, keep_state=True)
+    self.assertEqual(list(self.reac_cl.overlaps.keys()), ['R_PGI'])
+    self.assertEqual(self.reac_cl.rscore_params, ('top', 0.0))
+    self.reac_cl.resetRScoreState()
+    self.assertEqual(self.reac_cl.overlaps, dict())
+    self.assertIsNone(self.reac_cl.rscore_params)
 
+  def testPatchRheaOverlaps(self):
+    rng = np.random.default_rng(1)
+    postings = sparse.csc_matrix((rng.random((40, 10)) < 0.4).astype(int))
+    for _ in range(20):
+      old_idxs = set(rng.choice(10, size=4, replace=False).tolist())
+      new_idxs = set(rng.choice(10, size=5, replace=False).tolist())
+      rows, counts = ra.getRheaOverlaps(postings, np.array(sorted(old_idxs)))
+      res = ra.patchRheaOverlaps(postings, rows, counts,
+                                 sorted(new_idxs - old_idxs), sorted(old_idxs - new_idxs))
+      expected = ra.getRheaOverlaps(postings, np.array(sorted(new_idxs)))
+      self.assertEqual(res[0].tolist(), expected[0].tolist())
+      self.assertEqual(res[1].tolist(), expected[1].tolist())
 
+  def testGetPatchedRScoresOfSharedRhea(self):
+    # ATP and ADP are both in Rhea terms with F6P
+    reac_cl = ra.ReactionAnnotation(inp_tuple=({'R1': ['s1', 's2']}, {}))
+    reac_cl.getRScores(spec_dict={'s1': ['C6O9P'], 's2': []}, reacs=['R1'],
+                       mssc='top', cutoff=0.0, keep_state=True)
+    new_specs = {'s1': ['C6O9P'], 's2': ['C10N5O13P3', 'C10N5O10P2']}
+    self.assertEqual(reac_cl.getPatchedRScores(new_specs),
+                     reac_cl.getRScores(spec_dict=new_specs, reacs=['R1'],
+                                        mssc='top', cutoff=0.0))
 
+  def testGetRScoresOfSameFormulas(self):
+    reac_cl = ra.ReactionAnnotation(inp_tuple=({'R1': ['a_c', 'b_c'],
+                                                'R2': ['a_e', 'b_e', 'x_e'],
+                                                'R3': ['a_c', 'x_e']},
+                                               {}))
+    specs = {'a_c': ['C6O9P'], 'b_c': ['C6O12P2', 'UNKNOWN'],
+             'a_e': ['C6O12P2'], 'b_e': ['C6O9P'], 'x_e': []}
+    with mock.patch.object(ra, 'getOverlapRScores',
+                           wraps=ra.getOverlapRScores) as scored:
+      res = reac_cl.getRScores(spec_dict=specs, reacs=['R1', 'R2', 'R3'],
+                               mssc='top', cutoff=0.0)
+    self.assertEqual(scored.call_count, 2)
+    self.assertEqual(res['R1'], res['R2'])
+    self.assertIsNot(res['R1'], res['R2'])
+    self.assertNotEqual(res['R1'], res['R3'])
 
+  def testRScoreCache(self):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+      path = os.path.join(tmp_dir, 'scores.sqlite')
+      self.reac_cl.rscore_cache = sc.DiskScoreCache(path, version='test',
+                                                    table=ra.RSCORE_CACHE_TABLE)
+      specs = {'M_f6p_c': ['C6O9P'],
+               'M_fdp_c': ['C6O12P2'],
+               'M_atp_c': ['C10N5O13P3'],
+               'M_h_c': ['H'],
+               'M_adp_c': ['C10N5O10P2']}
+      expected = self.reac_cl.getRScores(spec_dict=specs, reacs=[R_PFK],
+                                         mssc='above', cutoff=0.2, use_cache=False)
+      self.assertEqual(self.reac_cl.getRScores(spec_dict=specs, reacs=[R_PFK],
+                                               mssc='above', cutoff=0.2),
+                       expected)
+      # another object (or process) reads the same file
+      two_cl = ra.ReactionAnnotation(libsbml_fpath=E_COLI_PATH)
+      two_cl.rscore_cache = sc.DiskScoreCache(path, version='test',
+                                              table=ra.RSCORE_CACHE_TABLE)
+      with mock.patch.object(ra, 'getOverlapRScores',
+                             wraps=ra.getOverlapRScores) as scored:
+        res = two_cl.getRScores(spec_dict=specs, reacs=[R_PFK],
+                                mssc='above', cutoff=0.5, keep_state=True)
+      self.assertEqual(scored.call_count, 0)
+      self.assertEqual(res[R_PFK], [val for val in expected[R_PFK] if val[1] >= 0.5])
+      # overlaps are kept even if rScores are cached
+      formula_idxs = two_cl.getFormulaIndices(itertools.chain(*specs.values()))
+      self.assertEqual(two_cl.overlaps[R_PFK][1].tolist(),
+                       ra.getRheaOverlaps(ra.REF_MAT_POSTINGS, formula_idxs)[0].tolist())
+    finally:
+      shutil.rmtree(tmp_dir, ignore_errors=True)
 
+  def testIterRScores(self):
+    reacs = ['R_PFK', 'R_PGK', 'R_PGI', 'R_ATPM', 'R_ACALD']
+    specs = {spec:['H', 'C6O9P'] for spec in itertools.chain(*[self.reac_cl.reaction_components[val] \
+                                                               for val in reacs])}
+    specs['M_atp_c'] = ['C10N5O13P3']
+    chunks = list(self.reac_cl.iterRScores(spec_dict=specs, reacs=reacs,
+                                           mssc='above', cutoff=0.2, chunk_size=2))
+    self.assertEqual([list(val.keys()) for val in chunks],
+                     [reacs[:2], reacs[2:4], reacs[4:]])
+    expected = self.reac_cl.getRScores(spec_dict=specs, reacs=reacs,
+                                       mssc='above', cutoff=0.2)
+    self.assertEqual(dict(itertools.chain(*[val.items() for val in chunks])), expected)
+    self.reac_cl.rscore_chunk_size = None
+    self.assertEqual(list(self.reac_cl.iterRScores(spec_dict=specs, reacs=reacs,
+                                                   mssc='above', cutoff=0.2)),
+                     [expected])
@@ -137,6 +137,23 @@ class TestRecommender(unittest.TestCase):
     self.assertTrue((ONE_CHEBI, 1.0) in self.recom.species.candidates[SPECIES_SAM])
     one_formula = cn.REF_CHEBI2FORMULA[ONE_CHEBI]
     self.assertTrue(one_formula in self.recom.species.formula[SPECIES_SAM])      
+    hybrid_specs = self.recom.getSpeciesListRecommendation(pred_ids=[SPECIES_SAM, SPECIES_ORN],
+                                                           update=False, method='hybrid')
+    self.assertEqual(hybrid_specs[1].id, SPECIES_ORN)
+    self.assertTrue(TWO_SPEC_CAND in hybrid_specs[1].candidates)
+    edist_specs = self.recom.getSpeciesListRecommendation(pred_ids=[SPECIES_SAM, SPECIES_ORN],
+                                                          update=False, method='edist',
+                                                          mssc='above', cutoff=0.6)
+    parallel_specs = self.recom.getSpeciesListRecommendation(pred_ids=[SPECIES_SAM, SPECIES_ORN],
+                                                             update=False, method='edist',
+                                                             mssc='above', cutoff=0.6,
+                                                             workers=2)
+    self.assertEqual(parallel_specs, edist_specs)
+    # species sharing a name get the same, separate candidates
+    same_specs = self.recom.getSpeciesListRecommendation(pred_strs=['ornithine', 'Ornithine'],
+                                                         update=False, method='cdist')
+    self.assertEqual(same_specs[0].candidates, same_specs[1].candidates)
+    self.assertIsNot(same_specs[0].candidates, same_specs[1].candidates)
 
   def testGetReactionRecommendation(self):
     one_res = self.recom.getReactionRecommendation(REACTION_ODC)
@@ -0,0 +1,124 @@
+# test_reference_bundle.py
+# Testing the uncompressed reference bundle
+
+
+import numpy as np
+import os
+import pandas as pd
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from AMAS import constants as cn
+from AMAS import reference_bundle as rb
+from AMAS import synonym_index as si
+
+
+NAMES = ['REF_EC2RHEA', 'REF_RHEA2MASTER', 'REF_DAT']
+DUMMY_FRAME = pd.DataFrame({'a': [0.5, 1.0], 'b': [0.0, 2.0],
+                            cn.CHEBI: ['CHEBI:1', 'CHEBI:2'],
+                            'name': ['x', 'y']})
+# Prints whether a reference is read from the bundle
+BUNDLE_SCRIPT = """
+from AMAS import reference_bundle as rb
+print(rb.hasBundledReference('REF_EC2RHEA'))
+"""
+DUMMY_SYNONYMS = {'CHEBI:1': ['glucose', 'dextrose'],
+                  'CHEBI:2': ['atp']}
+
+
+#############################
+# Tests
+#############################
+class TestReferenceBundle(unittest.TestCase):
+
+  def setUp(self):
+    self.bundle_dir = tempfile.mkdtemp()
+    self.converted = rb.buildBundle(bundle_dir=self.bundle_dir, names=NAMES)
+
+  def tearDown(self):
+    shutil.rmtree(self.bundle_dir)
+
+  def testBuildBundle(self):
+    self.assertEqual(self.converted, NAMES)
+    for name in NAMES:
+      self.assertTrue(rb.hasBundledReference(name, bundle_dir=self.bundle_dir))
+    self.assertFalse(rb.hasBundledReference('REF_CHEBI2LABEL', bundle_dir=self.bundle_dir))
+
+  def testRebuildBundle(self):
+    indptr = rb._loadArray(self.bundle_dir, 'REF_EC2RHEA', 'indptr')
+    expected = np.array(indptr)
+    self.assertEqual(rb.buildBundle(bundle_dir=self.bundle_dir, names=['REF_EC2RHEA']),
+                     ['REF_EC2RHEA'])
+    # mapped files of the old bundle are not overwritten
+    np.testing.assert_array_equal(indptr, expected)
+    for name in NAMES:
+      self.assertTrue(rb.hasBundledReference(name, bundle_dir=self.bundle_dir))
+    parent_dir, base_name = os.path.split(self.bundle_dir)
+    self.assertEqual([val for val in os.listdir(parent_dir) if val.startswith('.' + base_name)], [])
+
+  def testBundleDirEnv(self):
+    env = dict(os.environ)
+    env[cn.BUNDLE_DIR_ENV] = self.bundle_dir
+    env.pop(cn.REFERENCE_STORE_ENV, None)
+    res = subprocess.run([sys.executable, '-c', BUNDLE_SCRIPT],
+                         env=env, capture_output=True, text=True, check=True)
+    self.assertEqual(res.stdout.split(), ['True'])
+
+  def testLoadBundledReference(self):
+    for name in ['REF_EC2RHEA', 'REF_RHEA2MASTER']:
+      self.assertEqual(rb.loadBundledReference(name, bundle_dir=self.bundle_dir),
+                       cn.loadLZMAReference(rb.BUNDLE_SOURCES[name][0]))
+    ref_dat = cn.loadLZMAReference(rb.BUNDLE_SOURCES['REF_DAT'][0])
+    bundled_dat = rb.loadBundledReference('REF_DAT', bundle_dir=self.bundle_dir)
+    self.assertEqual(bundled_dat[0], ref_dat[0])
+    self.assertEqual(bundled_dat[1], ref_dat[1])
+    self.assertEqual({val[0]:sorted(val[1]) for val in bundled_dat[2]},
+                     {val[0]:sorted(val[1]) for val in ref_dat[2]})
+
+  def testLoadSparseArrays(self):
+    indptr, indices, rows, cols = rb.loadSparseArrays('REF_DAT', bundle_dir=self.bundle_dir)
+    self.assertTrue(isinstance(indptr, np.memmap))
+    self.assertEqual(len(indptr), len(rows)+1)
+    self.assertEqual(indptr[-1], len(indices))
+
+  def testSaveSparse(self):
+    # (column, [rows]) pairs with a duplicated (row, column)
+    dummy_dat = (['a', 'b', 'c'], ['r0', 'r1'], [(2, [0, 1]), (0, [1, 1]), (2, [0])])
+    rb._saveSparse(self.bundle_dir, 'DUMMY', dummy_dat)
+    indptr, indices, rows, cols = rb.loadSparseArrays('DUMMY', bundle_dir=self.bundle_dir)
+    self.assertEqual(indptr.tolist(), [0, 1, 3])
+    self.assertEqual(indices.tolist(), [2, 0, 2])
+    self.assertEqual(rows.tolist(), ['r0', 'r1'])
+
+  def testLoadBundledFrame(self):
+    info = rb._saveFrame(self.bundle_dir, 'DUMMY', DUMMY_FRAME)
+    info['kind'] = rb.FRAME
+    rb.getManifest(self.bundle_dir)['references']['DUMMY'] = info
+    res = rb.loadBundledFrame('DUMMY', bundle_dir=self.bundle_dir)
+    pd.testing.assert_frame_equal(res, DUMMY_FRAME)
+    num_res = rb.loadBundledFrame('DUMMY', part='numeric', bundle_dir=self.bundle_dir)
+    self.assertEqual(list(num_res.columns), ['a', 'b'])
+
+  def testSaveSynonyms(self):
+    info = rb._saveSynonyms(self.bundle_dir, 'DUMMY', DUMMY_SYNONYMS)
+    info['kind'] = rb.SYNONYMS
+    rb.getManifest(self.bundle_dir)['references']['DUMMY'] = info
+    res = si.SynonymIndex(**rb.loadBundledReference('DUMMY', bundle_dir=self.bundle_dir))
+    self.assertEqual(res.strs, ['atp', 'glucose', 'dextrose'])
+    self.assertEqual(res.getEScores('glucose', mssc='top', cutoff=0.0),
+                     [('CHEBI:1', 1.0)])
+
+  def testStringTable(self):
+    strs = ['abc', '', 'β-d-glucose']
+    rb._saveStringTable(self.bundle_dir, 'DUMMY', 'strs', strs)
+    one_table = rb.loadStringTable(self.bundle_dir, 'DUMMY', 'strs')
+    self.assertEqual(len(one_table), 3)
+    self.assertEqual(one_table[2], strs[2])
+    self.assertEqual(one_table.tolist(), strs)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,162 @@
+# test_score_cache.py
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from AMAS import score_cache as sc
+
+
+ATP_RESULT = [('CHEBI:15422', 1.0), ('CHEBI:30616', 1.0)]
+ABOVE_RESULT = [('CHEBI:15422', 0.9), ('CHEBI:30616', 0.7), ('CHEBI:456216', 0.5)]
+
+
+#############################
+# Tests
+#############################
+class TestScoreCache(unittest.TestCase):
+
+  def setUp(self):
+    self.cache = sc.ScoreCache(capacity=2)
+    self.num_calls = 0
+
+  def getDummyScores(self, inp_strs, mssc, cutoff):
+    self.num_calls += 1
+    return {val:[one_pred for one_pred in ABOVE_RESULT if one_pred[1] >= cutoff] \
+            for val in inp_strs}
+
+  def testGet(self):
+    self.assertIsNone(self.cache.get('ATP', 'cdist', 'top', 0.0))
+    self.cache.put('atp', 'cdist', 'top', 0.0, ATP_RESULT)
+    self.assertEqual(self.cache.get('ATP', 'cdist', 'top', 0.5), ATP_RESULT)
+    self.assertEqual(self.cache.get('ATP', 'cdist', 'top', 1.1), [])
+    self.assertIsNone(self.cache.get('ATP', 'edist', 'top', 0.0))
+    self.assertEqual(self.cache.hits, 2)
+    self.assertEqual(self.cache.misses, 2)
+    # 'above' is served only at or above the computed cutoff
+    self.cache.put('adp', 'cdist', 'above', 0.6, ABOVE_RESULT[:2])
+    self.assertEqual(self.cache.get('ADP', 'cdist', 'above', 0.8), ABOVE_RESULT[:1])
+    self.assertIsNone(self.cache.get('ADP', 'cdist', 'above', 0.5))
+
+  def testPut(self):
+    self.cache.put('atp', 'cdist', 'top', 0.0, ATP_RESULT)
+    self.cache.put('adp', 'cdist', 'top', 0.0, ATP_RESULT)
+    self.cache.get('atp', 'cdist', 'top', 0.0)
+    self.cache.put('h2o', 'cdist', 'top', 0.0, ATP_RESULT)
+    # least recently used entry is removed
+    self.assertEqual(len(self.cache), 2)
+    self.assertIsNone(self.cache.get('adp', 'cdist', 'top', 0.0))
+    self.assertIsNotNone(self.cache.get('atp', 'cdist', 'top', 0.0))
+    no_cache = sc.ScoreCache(capacity=0)
+    no_cache.put('atp', 'cdist', 'top', 0.0, ATP_RESULT)
+    self.assertEqual(len(no_cache), 0)
+
+  def testGetScores(self):
+    res = self.cache.getScores(inp_strs=['ATP', 'atp', 'ADP'],
+                               method='cdist',
+                               mssc='above',
+                               cutoff=0.6,
+                               score_func=self.getDummyScores)
+    self.assertEqual(self.num_calls, 1)
+    self.assertEqual(res['ATP'], ABOVE_RESULT[:2])
+    self.assertEqual(res['atp'], ABOVE_RESULT[:2])
+    self.assertEqual(len(self.cache), 2)
+    res = self.cache.getScores(inp_strs=['atp'],
+                               method='cdist',
+                               mssc='above',
+                               cutoff=0.8,
+                               score_func=self.getDummyScores)
+    self.assertEqual(self.num_calls, 1)
+    self.assertEqual(res['atp'], ABOVE_RESULT[:1])
+    self.cache.clear()
+    self.assertEqual(len(self.cache), 0)
+    self.assertEqual(self.cache.hits, 0)
+
+  def testGetTopScores(self):
+    cutoffs = []
+    def score_func(inp_strs, mssc, cutoff):
+      cutoffs.append(cutoff)
+      return {val:sc.filterScores(ATP_RESULT, cutoff) for val in inp_strs}
+    # computed with the requested cutoff
+    res = self.cache.getScores(['atp'], 'edist', 'top', 0.6, score_func)
+    self.assertEqual(res['atp'], sc.filterScores(ATP_RESULT, 0.6))
+    self.assertEqual(cutoffs, [0.6])
+    # a higher cutoff is served from the cache, a lower one is not
+    self.cache.getScores(['atp'], 'edist', 'top', 0.8, score_func)
+    self.assertEqual(cutoffs, [0.6])
+    res = self.cache.getScores(['atp'], 'edist', 'top', 0.0, score_func)
+    self.assertEqual(res['atp'], ATP_RESULT)
+    self.assertEqual(cutoffs, [0.6, 0.0])
+
+
+class TestDiskScoreCache(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.tmp_dir, 'scores.sqlite')
+    self.disk = sc.DiskScoreCache(self.path, version='a')
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+  def testGetReferenceVersion(self):
+    fpath = os.path.join(self.tmp_dir, 'ref.lzma')
+    with open(fpath, 'wb') as f:
+      f.write(b'one')
+    one_version = sc.getReferenceVersion(self.tmp_dir)
+    self.assertEqual(one_version, sc.getReferenceVersion(self.tmp_dir))
+    with open(fpath, 'wb') as f:
+      f.write(b'two')
+    self.assertNotEqual(one_version, sc.getReferenceVersion(self.tmp_dir))
+
+  def testGet(self):
+    self.disk.put({'atp': ABOVE_RESULT}, ('hybrid', 50), 'above', 0.5)
+    self.assertEqual(self.disk.get(['atp', 'adp'], ('hybrid', 50), 'above', 0.6),
+                     {'atp': (0.5, ABOVE_RESULT)})
+    self.assertEqual(self.disk.get(['atp'], ('hybrid', 50), 'above', 0.4), {})
+    self.assertEqual(self.disk.get(['atp'], 'cdist', 'above', 0.6), {})
+    # rows of another version of reference data are removed
+    other_disk = sc.DiskScoreCache(self.path, version='b')
+    self.assertEqual(other_disk.get(['atp'], ('hybrid', 50), 'above', 0.6), {})
+    self.assertEqual(self.disk.get(['atp'], ('hybrid', 50), 'above', 0.6), {})
+
+  def testTable(self):
+    self.disk.put({'atp': ATP_RESULT}, 'cdist', 'top', 0.0)
+    # another table with another version keeps the rows
+    other_disk = sc.DiskScoreCache(self.path, version='b', table='other')
+    other_disk.put({'atp': ABOVE_RESULT}, 'cdist', 'top', 0.0)
+    self.assertEqual(self.disk.get(['atp'], 'cdist', 'top', 0.0),
+                     {'atp': (0.0, ATP_RESULT)})
+    self.assertEqual(other_disk.get(['atp'], 'cdist', 'top', 0.0),
+                     {'atp': (0.0, ABOVE_RESULT)})
+
+  def testReferenceFiles(self):
+    for fname in ['one.lzma', 'two.lzma']:
+      with open(os.path.join(self.tmp_dir, fname), 'wb') as f:
+        f.write(fname.encode('ascii'))
+    one_version = sc.getReferenceVersion(self.tmp_dir, fnames=['one.lzma'])
+    with open(os.path.join(self.tmp_dir, 'two.lzma'), 'wb') as f:
+      f.write(b'changed')
+    self.assertEqual(sc.getReferenceVersion(self.tmp_dir, fnames=['one.lzma']), one_version)
+    self.assertNotEqual(sc.getReferenceVersion(self.tmp_dir), one_version)
+
+  def testScoreCache(self):
+    one_cache = sc.ScoreCache()
+    one_cache.disk = self.disk
+    score_func = lambda inp_strs, mssc, cutoff: {val:ATP_RESULT for val in inp_strs}
+    one_cache.getScores(['ATP'], 'cdist', 'top', 0.5, score_func)
+    two_cache = sc.ScoreCache()
+    two_cache.disk = sc.DiskScoreCache(self.path, version='a')
+    res = two_cache.getScores(['atp'], 'cdist', 'top', 0.5,
+                              lambda inp_strs, mssc, cutoff: self.fail('scored again'))
+    self.assertEqual(res, {'atp': ATP_RESULT})
+    self.assertEqual(two_cache.disk_hits, 1)
+    # found in memory afterwards
+    two_cache.getScores(['atp'], 'cdist', 'top', 0.5, score_func)
+    self.assertEqual(two_cache.hits, 1)
+
+
+if __name__ == '__main__':
+  unittest.main()
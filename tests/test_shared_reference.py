@@ -0,0 +1,125 @@
+# test_shared_reference.py
+
+
+import numpy as np
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+from AMAS import constants as cn
+from AMAS import reference_bundle as rb
+from AMAS import shared_reference as sr
+from AMAS import species_annotation as sa
+from AMAS import synonym_index as si
+
+
+DUMMY_SYNONYMS = {'CHEBI:1': ['glucose', 'd-glucose'],
+                  'CHEBI:2': ['atp', 'β-alanine'],
+                  'CHEBI:3': ['water']}
+# Prints the number of formulas read from the store
+ATTACH_SCRIPT = """
+from AMAS import constants as cn
+from AMAS import reference_bundle as rb
+print(len(cn.REF_CHEBI2FORMULA), cn.BUNDLE_DIR in rb._SHARED_ARRAYS)
+"""
+
+
+#############################
+# Tests
+#############################
+class TestFunctions(unittest.TestCase):
+
+  def testPublishArray(self):
+    for arr in [np.arange(12, dtype=np.uint16).reshape(3, 4),
+                np.zeros(0, dtype=np.int64)]:
+      handle, segment = sr.publishArray(arr)
+      try:
+        shared_arr, shared_segment = sr.attachArray(handle)
+        np.testing.assert_array_equal(shared_arr, arr)
+        self.assertEqual(shared_arr.dtype, arr.dtype)
+        self.assertFalse(shared_arr.flags.writeable)
+        del shared_arr
+        shared_segment.close()
+      finally:
+        sr.releaseSegments([segment])
+
+  def testPackSynonyms(self):
+    syn_index = si.SynonymIndex.build(DUMMY_SYNONYMS)
+    syn_index.setValidChEBIs({'CHEBI:1': [], 'CHEBI:2': []})
+    pack, unpack = sr._PACKERS[rb.SYNONYMS]
+    arrays, info = pack(syn_index)
+    res = unpack(arrays, info)
+    self.assertEqual(res.strs, syn_index.strs)
+    self.assertEqual(res.labels.tolist(), syn_index.labels.tolist())
+    np.testing.assert_array_equal(res.is_valid, syn_index.is_valid)
+    for query in ['glucose', 'b-alanine', 'water']:
+      self.assertEqual(res.getEScores(query, mssc='above', cutoff=0.0),
+                       syn_index.getEScores(query, mssc='above', cutoff=0.0))
+
+  def testPackBlocks(self):
+    counts = np.arange(9, dtype=np.uint8).reshape(3, 3)
+    index = sa.CosineBlockIndex(rows=np.array([2, 0, 1]),
+                                starts=np.array([0, 2, 3]),
+                                lower=np.zeros((2, 3)),
+                                upper=np.ones((2, 3)),
+                                counts=counts,
+                                sq_norms=np.sum(counts.astype(np.int32)**2, axis=1),
+                                codes=np.array([1, 0, 0], dtype=np.int32))
+    pack, unpack = sr._PACKERS[rb.BLOCKS]
+    arrays, info = pack(index)
+    res = unpack(arrays, info)
+    for part in index._fields:
+      np.testing.assert_array_equal(getattr(res, part), getattr(index, part))
+
+  def testPackProfiles(self):
+    index = sa.CountProfileIndex(keys=np.array([3, 5, 5], dtype=np.uint64),
+                                 rows=np.array([1, 0, 2]))
+    pack, unpack = sr._PACKERS[rb.PROFILES]
+    res = unpack(*pack(index))
+    for part in index._fields:
+      np.testing.assert_array_equal(getattr(res, part), getattr(index, part))
+
+  def testWaitForStop(self):
+    handler = signal.getsignal(signal.SIGTERM)
+    stop_event = threading.Event()
+    threading.Timer(0.1, os.kill, args=(os.getpid(), signal.SIGTERM)).start()
+    sr.waitForStop(stop_event)
+    self.assertTrue(stop_event.is_set())
+    self.assertEqual(signal.getsignal(signal.SIGTERM), handler)
+
+
+class TestReferenceStore(unittest.TestCase):
+
+  def setUp(self):
+    self.bundle_dir = tempfile.mkdtemp()
+    self.store_name = 'amas_test_%d' % os.getpid()
+
+  def tearDown(self):
+    shutil.rmtree(self.bundle_dir, ignore_errors=True)
+
+  def testPublishStore(self):
+    segments = sr.publishStore(store_name=self.store_name,
+                               names=['REF_CHEBI2FORMULA'],
+                               bundle_dir=self.bundle_dir)
+    try:
+      self.assertEqual(len(segments), len(rb.getBundledParts('REF_CHEBI2FORMULA', self.bundle_dir)) + 1)
+      # another process reads the table from the store, not from the folder
+      shutil.rmtree(self.bundle_dir)
+      env = dict(os.environ)
+      env[cn.REFERENCE_STORE_ENV] = self.store_name
+      res = subprocess.run([sys.executable, '-c', ATTACH_SCRIPT],
+                           env=env, capture_output=True, text=True, check=True)
+      self.assertEqual(res.stdout.split(), [str(len(cn.REF_CHEBI2FORMULA)), 'True'])
+    finally:
+      sr.releaseSegments(segments)
+    with self.assertWarns(UserWarning):
+      self.assertFalse(sr.attachStore('amas_test_missing'))
+
+
+if __name__ == '__main__':
+  unittest.main()
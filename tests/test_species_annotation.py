@@ -5,12 +5,16 @@
 import libsbml
 import numpy as np
 import os
+import pandas as pd
 import sys
 import unittest
+from unittest import mock
 
 from AMAS import species_annotation as sa
 from AMAS import reaction_annotation as ra
 from AMAS import constants as cn
+from AMAS import score_cache as sc
+from AMAS import synonym_index as si
 from AMAS import tools
 
 
@@ -42,6 +46,10 @@ DUMMY_REF = {'a': ['ABC', 'BCD'],
 DUMMY_PRED = {'a': ['ABC'],
              'b': ['AAA']}
 DUMMY_DICT2UPDATE = {M_ATP_C: [ATP_CHEBI]}
+# Dummy reference for character-count (cosine) scores
+DUMMY_CHARCOUNT_DF = pd.DataFrame({'a': [1.0, 0.0, 0.6],
+                                   'b': [0.0, 1.0, 0.8]})
+DUMMY_CHEBI_DF = pd.DataFrame({cn.CHEBI: ['CHEBI:2', 'CHEBI:1', 'CHEBI:2']})
 
 
 #############################
@@ -65,6 +73,47 @@ class TestSpeciesAnnotation(unittest.TestCase):
     self.assertTrue('CHEBI:18276' in chebis[:5])
     self.assertTrue('CHEBI:49637' in chebis[:5])
 
+  def testGetCScoresWithReference(self):
+    res = self.spec_cl.getCScores(inp_strs=['ab', 'bb', 'ab'],
+                                  mssc='above',
+                                  cutoff=0.5,
+                                  ref_df=DUMMY_CHARCOUNT_DF,
+                                  chebi_df=DUMMY_CHEBI_DF)
+    self.assertEqual(set(res.keys()), {'ab', 'bb'})
+    self.assertEqual([val[0] for val in res['ab']], ['CHEBI:1', 'CHEBI:2'])
+    self.assertTrue(abs(res['ab'][1][1] - 1.4/np.sqrt(2)) < cn.TOLERANCE)
+    self.assertEqual([val[0] for val in res['bb']], ['CHEBI:1', 'CHEBI:2'])
+    self.assertTrue(abs(res['bb'][0][1] - 1.0) < cn.TOLERANCE)
+    # scoring strings in blocks gives the same result
+    chunk_res = self.spec_cl.getCScores(inp_strs=['ab', 'bb', 'ab'],
+                                        mssc='above',
+                                        cutoff=0.5,
+                                        ref_df=DUMMY_CHARCOUNT_DF,
+                                        chebi_df=DUMMY_CHEBI_DF,
+                                        chunk_size=1)
+    self.assertEqual(chunk_res, res)
+
+  def testRecoverCharCounts(self):
+    counts = sa.recoverCharCounts(DUMMY_CHARCOUNT_DF.to_numpy())
+    self.assertEqual(counts.tolist(), [[1, 0], [0, 1], [3, 4]])
+
+  def testBuildCompactCharCount(self):
+    compact = sa.buildCompactCharCount(DUMMY_CHARCOUNT_DF, DUMMY_CHEBI_DF)
+    self.assertEqual(compact.counts.dtype, np.uint8)
+    self.assertEqual(list(compact.labels), ['CHEBI:1', 'CHEBI:2'])
+    self.assertEqual(compact.codes.tolist(), [0, 1, 1])
+    self.assertEqual(compact.starts.tolist(), [0, 1])
+    self.assertEqual(compact.sq_norms.tolist(), [1, 1, 25])
+    # same scores as the float reference
+    compact_res = self.spec_cl.getCompactCScoreArray(['ab', 'bb'], compact=compact)
+    self.assertTrue(np.allclose(compact_res, [[1/np.sqrt(2), 1.0], [1.4/np.sqrt(2), 0.8]]))
+
+  def testGetChEBISegments(self):
+    order, starts, chebis = sa.getChEBISegments(DUMMY_CHEBI_DF)
+    self.assertEqual(list(chebis), ['CHEBI:1', 'CHEBI:2'])
+    self.assertEqual(list(starts), [0, 1])
+    self.assertEqual(list(order), [1, 0, 2])
+
   def testGetOneEScore(self):
     res = self.spec_cl.getOneEScore('a', 'ab')
     self.assertEqual(res, 0.5)
@@ -82,6 +131,223 @@ class TestSpeciesAnnotation(unittest.TestCase):
     self.assertTrue('CHEBI:18276' in chebis[:5])
     self.assertTrue('CHEBI:49637' in chebis[:5])
 
+  def testGetQueryRepresentatives(self):
+    reps = sa.getQueryRepresentatives(['ATP', 'atp', 'ADP', 'ATP', 'Atp'])
+    self.assertEqual(reps, {'ATP': 'ATP', 'atp': 'ATP', 'ADP': 'ADP', 'Atp': 'ATP'})
+
+  def testScoreRepeatedNames(self):
+    self.spec_cl.score_cache = None
+    inp_strs = ['hydrogn', 'Hydrogn', 'HYDROGN', 'atp']
+    scored = []
+    get_escores = self.spec_cl.getEScores
+    def countEScores(inp_strs, **kwargs):
+      scored.extend(inp_strs)
+      return get_escores(inp_strs=inp_strs, **kwargs)
+    self.spec_cl.getEScores = countEScores
+    res = self.spec_cl.getTieredScores(inp_strs=inp_strs, method='edist',
+                                       mssc='above', cutoff=0.5)
+    self.assertEqual(scored, ['hydrogn', 'atp'])
+    self.assertEqual(res['Hydrogn'], res['hydrogn'])
+    self.assertEqual(res['HYDROGN'], res['hydrogn'])
+    for method in ['getCScores', 'getEScores', 'getHybridScores']:
+      res = getattr(self.spec_cl, method)(inp_strs=inp_strs, mssc='top',
+                                          cutoff=0.0, use_cache=False)
+      self.assertEqual(list(res.keys()), inp_strs)
+      self.assertEqual(res['HYDROGN'], res['hydrogn'])
+
+  def testGetTieredScores(self):
+    inp_strs = ['hydrogen', 'hydrogn', 'hydrogen']
+    res = self.spec_cl.getTieredScores(inp_strs=inp_strs,
+                                       method='edist',
+                                       mssc='top',
+                                       cutoff=0.0)
+    self.assertEqual(self.spec_cl.tier_counts, {'exact': 1, 'edist': 1})
+    self.assertEqual(res, self.spec_cl.getEScores(inp_strs=inp_strs,
+                                                  mssc='top',
+                                                  cutoff=0.0))
+    res = self.spec_cl.getTieredScores(inp_strs=inp_strs,
+                                       method='edist',
+                                       mssc='above',
+                                       cutoff=0.9)
+    self.assertEqual(self.spec_cl.tier_counts, {'exact': 0, 'edist': 2})
+
+  def testGetExactScores(self):
+    res = self.spec_cl.getExactScores(inp_strs=['Hydrogen', 'hydrogn'],
+                                      method='edist',
+                                      cutoff=0.0)
+    self.assertEqual(list(res.keys()), ['Hydrogen'])
+    self.assertTrue(('CHEBI:18276', 1.0) in res['Hydrogen'])
+    res = self.spec_cl.getCScores(inp_strs=['ATP', 'TPA'], mssc='top', cutoff=0.0)
+    exact_res = self.spec_cl.getExactScores(inp_strs=['ATP', 'TPA'],
+                                            method='cdist',
+                                            cutoff=0.0)
+    self.assertEqual(exact_res, res)
+    with self.assertRaises(KeyError):
+      self.spec_cl.getExactScores(inp_strs=['ATP'], method='bdist', cutoff=0.0)
+
+  def testGetSynonymChEBIs(self):
+    syn_index = si.SynonymIndex.build({'CHEBI:1': ['atp', 'glucose', 'glucose'],
+                                       'CHEBI:2': ['dextrose', 'glucose'],
+                                       'CHEBI:3': ['atp']})
+    syn_index.setValidChEBIs({'CHEBI:1', 'CHEBI:2'})
+    self.assertEqual(sa.getSynonymChEBIs(syn_index),
+                     {'atp': ['CHEBI:1'],
+                      'glucose': ['CHEBI:1', 'CHEBI:2'],
+                      'dextrose': ['CHEBI:2']})
+
+  def testGetHybridScores(self):
+    res = self.spec_cl.getHybridScores(inp_strs=['hydrogen', 'hydrogn'],
+                                       mssc='above',
+                                       cutoff=0.0,
+                                       num_candidates=10)
+    self.assertTrue(10 <= len(res['hydrogn']))
+    vals = [val[1] for val in res['hydrogn']]
+    self.assertEqual(vals, sorted(vals, reverse=True))
+    self.assertEqual(res['hydrogen'][0][1], 1.0)
+    self.assertTrue('CHEBI:18276' in [val[0] for val in res['hydrogen']])
+
+  def testGetHybridScoresWithoutSynonyms(self):
+    # CHEBI:4 has the highest cScore, but no valid synonyms
+    synonyms = {'CHEBI:1': ['glucose'], 'CHEBI:2': ['atp'],
+                'CHEBI:3': ['adp'], 'CHEBI:4': ['water']}
+    syn_index = si.SynonymIndex.build(synonyms)
+    syn_index.setValidChEBIs({'CHEBI:1': [], 'CHEBI:2': [], 'CHEBI:3': []})
+    columns = pd.Index(list(sa.COUNT_CHARS))
+    counts = self.spec_cl.getCounterQueryArray(inp_strs=['glucose', 'atp', 'adp', 'water'],
+                                               ref_cols=columns,
+                                               normalize=False).T.astype(np.uint8)
+    codes = np.arange(4, dtype=np.int32)
+    compact = sa.CompactCharCount(labels=np.array(list(synonyms), dtype=object),
+                                  columns=columns,
+                                  counts=counts,
+                                  sq_norms=np.sum(counts.astype(np.int32)**2, axis=1),
+                                  codes=codes,
+                                  starts=codes)
+    with mock.patch.dict(cn._REF_CACHE, {'CHARCOUNT_COMPACT': compact,
+                                         'CHARCOUNT_BLOCKS': sa.buildCosineBlockIndex(compact),
+                                         'SYNONYM_INDEX': syn_index}):
+      for prune_cscores in [True, False]:
+        self.spec_cl.prune_cscores = prune_cscores
+        res = self.spec_cl.getHybridScores(inp_strs=['water'],
+                                           mssc='above',
+                                           cutoff=0.0,
+                                           num_candidates=2,
+                                           use_cache=False)
+        self.assertEqual(len(res['water']), 2)
+        self.assertTrue('CHEBI:4' not in [val[0] for val in res['water']])
+
+  def testGetParallelScores(self):
+    inp_strs = ['hydrogen', 'hydrogn', 'atp', 'hydrogn', 'glucose']
+    for method in ['cdist', 'hybrid']:
+      res = self.spec_cl.getParallelScores(inp_strs=inp_strs,
+                                           method=method,
+                                           mssc='top',
+                                           cutoff=0.0,
+                                           workers=2)
+      expected = getattr(self.spec_cl, sa.SCORING_METHODS[method])(inp_strs=inp_strs,
+                                                                    mssc='top',
+                                                                    cutoff=0.0)
+      self.assertEqual(res, expected)
+
+  def testScoreCache(self):
+    self.spec_cl.score_cache = sc.ScoreCache()
+    for method in ['cdist', 'edist', 'hybrid']:
+      scoring_method = getattr(self.spec_cl, sa.SCORING_METHODS[method])
+      for mssc, cutoff in [('top', 0.0), ('top', 0.9), ('above', 0.7)]:
+        expected = scoring_method(inp_strs=['ATP', 'hydrogn'], mssc=mssc,
+                                  cutoff=cutoff, use_cache=False)
+        self.assertEqual(scoring_method(inp_strs=['ATP', 'hydrogn'],
+                                        mssc=mssc, cutoff=cutoff),
+                         expected)
+    self.assertEqual(self.spec_cl.score_cache.hits, 6)
+    res = self.spec_cl.getEScores(inp_strs=['atp'], mssc='above', cutoff=0.8)
+    self.assertEqual(self.spec_cl.score_cache.hits, 7)
+    self.assertTrue(min(val[1] for val in res['atp']) >= 0.8)
+
+  def testBuildCosineBlockIndex(self):
+    rng = np.random.default_rng(0)
+    counts = rng.integers(0, 4, size=(300, 5)).astype(np.uint8)
+    compact = sa.CompactCharCount(labels=np.array(['CHEBI:%d' % val for val in range(100)]),
+                                  columns=pd.Index(list('abcde')),
+                                  counts=counts,
+                                  sq_norms=np.sum(counts.astype(np.int32)**2, axis=1),
+                                  codes=np.repeat(np.arange(100), 3),
+                                  starts=np.arange(0, 300, 3))
+    index = sa.buildCosineBlockIndex(compact, block_size=16)
+    self.assertEqual(sorted(index.rows.tolist()), list(range(300)))
+    self.assertTrue(np.all(np.diff(index.starts) <= 16))
+    self.assertEqual(index.codes.tolist(), compact.codes[index.rows].tolist())
+    # bounds are not below the cosines of any row of a block
+    query = np.array([2, 1, 0, 0, 3])
+    query_unit = query / np.linalg.norm(query)
+    codes, scores = sa.scoreCosineBlocks(index, np.arange(len(index.starts)-1),
+                                         query, np.sum(query**2))
+    self.assertEqual(codes.tolist(), index.codes.tolist())
+    blocks = np.repeat(np.arange(len(index.starts)-1), np.diff(index.starts))
+    bounds = sa.getCosineBounds(index, query_unit[:, np.newaxis])[:, 0]
+    self.assertTrue(np.all(np.nan_to_num(scores) <= bounds[blocks] + sa.COSINE_BOUND_MARGIN))
+    dual_bounds = sa.getDualCosineBounds(index, query_unit, np.arange(len(index.starts)-1))
+    self.assertTrue(np.all(np.nan_to_num(scores) <= dual_bounds[blocks] + sa.COSINE_BOUND_MARGIN))
+
+  def testGetKthLargest(self):
+    self.assertEqual(sa.getKthLargest(np.array([0.2, np.nan, 0.9, 0.5]), 2), 0.5)
+    self.assertEqual(sa.getKthLargest(np.array([0.2, 0.9]), 5), 0.2)
+    self.assertIsNone(sa.getKthLargest(np.array([np.nan]), 1))
+
+  def testGetTopCScores(self):
+    inp_strs = ['hydrogen', 'hydrogn', 'ATP', '123']
+    chebi_max = self.spec_cl.getCompactCScoreArray(inp_strs)
+    compact = cn.loadReference('CHARCOUNT_COMPACT')
+    for num_candidates in [1, 10]:
+      res = self.spec_cl.getTopCScores(inp_strs, num_candidates=num_candidates)
+      for idx, one_str in enumerate(inp_strs):
+        threshold = sa.getKthLargest(chebi_max[:, idx], num_candidates)
+        if threshold is None:
+          self.assertEqual(len(res[one_str][0]), 0)
+          continue
+        is_top = chebi_max[:, idx] >= threshold
+        self.assertEqual(list(res[one_str][0]), list(compact.labels[is_top]))
+        self.assertEqual(res[one_str][1].tolist(), chebi_max[is_top, idx].tolist())
+    # the same as scoring all rows
+    self.spec_cl.prune_cscores = False
+    expected = self.spec_cl.getCScores(inp_strs, mssc='top', cutoff=0.0, use_cache=False)
+    self.spec_cl.prune_cscores = True
+    self.assertEqual(self.spec_cl.getCScores(inp_strs, mssc='top', cutoff=0.0, use_cache=False),
+                     expected)
+
+  def testGetTopCScoresOfFewSeedChEBIs(self):
+    # blocks with the highest bounds (seeds) have
+    # rows of fewer ChEBI terms than num_candidates
+    rng = np.random.default_rng(0)
+    near = np.column_stack([np.ones((20000, 3), dtype=np.uint8),
+                            rng.integers(0, 2, size=(20000, 2))])
+    far = np.column_stack([rng.integers(0, 2, size=(2000, 1)),
+                           np.zeros((2000, 2), dtype=np.uint8),
+                           rng.integers(1, 6, size=(2000, 2))])
+    counts = np.concatenate([near, far]).astype(np.uint8)
+    codes = np.concatenate([np.repeat(np.arange(5), 4000),
+                            np.repeat(np.arange(5, 105), 20)]).astype(np.int32)
+    compact = sa.CompactCharCount(labels=np.array(['CHEBI:%d' % val for val in range(105)], dtype=object),
+                                  columns=pd.Index(list('atpxy')),
+                                  counts=counts,
+                                  sq_norms=np.sum(counts.astype(np.int32)**2, axis=1),
+                                  codes=codes,
+                                  starts=np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]))
+    with mock.patch.dict(cn._REF_CACHE, {'CHARCOUNT_COMPACT': compact,
+                                         'CHARCOUNT_BLOCKS': sa.buildCosineBlockIndex(compact)}):
+      chebi_max = self.spec_cl.getCompactCScoreArray(['atp'], compact=compact)[:, 0]
+      res = self.spec_cl.getTopCScores(['atp'], num_candidates=50)
+    is_top = chebi_max >= sa.getKthLargest(chebi_max, 50)
+    self.assertTrue(np.sum(is_top) >= 50)
+    self.assertEqual(list(res['atp'][0]), list(compact.labels[is_top]))
+    self.assertEqual(res['atp'][1].tolist(), chebi_max[is_top].tolist())
+
+  def testGetCountProfiles(self):
+    profiles, keys = sa.getCountProfiles(np.array([[2, 4, 0], [1, 2, 0], [1, 0, 2], [0, 0, 0]]))
+    self.assertEqual(profiles.tolist(), [[1, 2, 0], [1, 2, 0], [1, 0, 2], [0, 0, 0]])
+    self.assertEqual(keys[0], keys[1])
+    self.assertNotEqual(keys[0], keys[2])
+
   def testGetCountOfIndividualCharacters(self):
     one_res = self.spec_cl.getCountOfIndividualCharacters(DUMMY_ID)
     self.assertEqual(one_res['m'], 1)
@@ -95,6 +361,15 @@ class TestSpeciesAnnotation(unittest.TestCase):
     one_val = np.round(one_query.loc['g', M_GLUCOSE], 2)
     self.assertEqual(one_val, 0.35)
 
+  def testGetCounterQueryArray(self):
+    one_query = self.spec_cl.getCounterQueryArray(['Ab1b', '-', 'b'],
+                                                  ['a', 'b', '1', 'z'])
+    self.assertEqual(one_query.dtype, np.float32)
+    self.assertEqual(one_query.shape, (4, 3))
+    self.assertTrue(np.allclose(one_query[:, 0], np.array([1, 2, 1, 0])/np.sqrt(6)))
+    self.assertTrue(np.all(np.isnan(one_query[:, 1])))
+    self.assertTrue(np.allclose(one_query[:, 2], [0, 1, 0, 0]))
+
   def testGetNameToUse(self):
     self.assertEqual(self.spec_cl.getNameToUse(M_GLUCOSE), D_GLUCOSE)  
   
@@ -0,0 +1,154 @@
+# test_synonym_index.py
+
+
+import editdistance
+import numpy as np
+import unittest
+
+from AMAS import synonym_index as si
+from AMAS import tools
+
+
+DUMMY_SYNONYMS = {'CHEBI:1': ['glucose', 'd-glucose', 'dextrose'],
+                  'CHEBI:2': ['atp', "adenosine 5'-triphosphate"],
+                  'CHEBI:3': ['adp', 'adenosine diphosphate'],
+                  'CHEBI:4': ['water', 'h2o'],
+                  'CHEBI:5': ['glucose']}
+DUMMY_CHEBIS = {'CHEBI:1': [], 'CHEBI:2': [], 'CHEBI:3': [], 'CHEBI:5': []}
+QUERIES = ['glucose', 'glc', 'atp', 'adenosine triphosphate', 'h2o', 'x', '']
+
+
+def getBruteForceEScores(query, mssc, cutoff):
+  pred = [(one_k, np.max([1.0 - editdistance.eval(query, val)/max(len(query), len(val), 1) \
+                          for val in DUMMY_SYNONYMS[one_k]])) \
+          for one_k in DUMMY_SYNONYMS.keys() if one_k in DUMMY_CHEBIS]
+  res = tools.applyMSSC(pred=pred, mssc=mssc, cutoff=cutoff)
+  res.sort(key=lambda val: val[1], reverse=True)
+  return res
+
+
+#############################
+# Tests
+#############################
+class TestFunctions(unittest.TestCase):
+
+  def testGetBitParallelDistances(self):
+    strs = ['', 'a', 'kitten', 'sitting', 'abcabcabc', 'β-alanine']
+    chars = sorted(set(''.join(strs)))
+    char_ids = np.array([chars.index(val) + 1 for val in ''.join(strs)])
+    lens = np.array([len(val) for val in strs])
+    starts = np.cumsum(lens) - lens
+    for query in ['kitten', 'b-alanine', 'x' * 64, 'cab']:
+      query_ids = np.array([chars.index(val) + 1 if val in chars else 0 for val in query])
+      res = si.getBitParallelDistances(query_ids, char_ids, starts, lens)
+      self.assertEqual(res.tolist(), [editdistance.eval(query, val) for val in strs])
+
+
+  def testGetDeletionKeys(self):
+    keys = si.getDeletionKeys(si.getCodePoints('atp')[None, :])
+    self.assertEqual(keys.shape, (1, 4))
+    for idx, one_str in enumerate(['atp', 'tp', 'ap', 'at']):
+      self.assertEqual(keys[0, idx],
+                       si.getDeletionKeys(si.getCodePoints(one_str)[None, :])[0, 0])
+
+
+class TestSynonymIndex(unittest.TestCase):
+
+  def setUp(self):
+    self.syn_index = si.SynonymIndex.build(DUMMY_SYNONYMS)
+    self.syn_index.setValidChEBIs(DUMMY_CHEBIS)
+
+  def testBuild(self):
+    self.assertEqual(list(self.syn_index.labels),
+                     ['CHEBI:1', 'CHEBI:2', 'CHEBI:3', 'CHEBI:4', 'CHEBI:5'])
+    self.assertEqual(len(self.syn_index.strs), 10)
+    self.assertTrue(np.all(np.diff(self.syn_index.lens) >= 0))
+    self.assertEqual(self.syn_index.labels[self.syn_index.owners[0]], 'CHEBI:2')
+    self.assertEqual(self.syn_index.len_starts[3], 0)
+    self.assertEqual(self.syn_index.len_starts[4], 3)
+
+  def testSetValidChEBIs(self):
+    self.assertEqual(self.syn_index.is_valid.sum(), 8)
+    self.assertFalse(self.syn_index.is_valid[self.syn_index.strs.index('h2o')])
+
+  def testGetSharedQgramCounts(self):
+    shared = self.syn_index.getSharedQgramCounts('glucose', 0, len(self.syn_index.strs))
+    glucose_idx = self.syn_index.strs.index('glucose')
+    self.assertEqual(shared[glucose_idx], 6)
+    self.assertEqual(shared[self.syn_index.strs.index('d-glucose')], 6)
+    self.assertEqual(shared[self.syn_index.strs.index('atp')], 0)
+
+  def testGetCandidates(self):
+    cands, upper = self.syn_index.getCandidates('glucose', 0.9)
+    self.assertEqual(sorted(self.syn_index.strs[val] for val in cands),
+                     ['glucose', 'glucose'])
+    self.assertTrue(np.all(upper >= 0.9))
+    cands, upper = self.syn_index.getCandidates('glucose', 0.0)
+    self.assertEqual(len(cands), self.syn_index.is_valid.sum())
+
+  def testSearch(self):
+    idxs, scores = self.syn_index.search('glucose', 0.7)
+    self.assertEqual(sorted(self.syn_index.strs[val] for val in idxs),
+                     ['d-glucose', 'glucose', 'glucose'])
+    self.assertTrue(min(scores) >= 0.7)
+
+  def testGetBestMatches(self):
+    idxs, best = self.syn_index.getBestMatches('glucos')
+    self.assertEqual(best, 1.0 - 1/7)
+    self.assertEqual(sorted(self.syn_index.owners[idxs].tolist()), [0, 4])
+    idxs, best = self.syn_index.getBestMatches('glucose', 1.1)
+    self.assertEqual(len(idxs), 0)
+    self.assertIsNone(best)
+    # water is not a valid ChEBI term
+    idxs, best = self.syn_index.getBestMatches('water')
+    self.assertNotEqual(self.syn_index.strs[idxs[0]], 'water')
+
+  def testGetDistances(self):
+    idxs = np.arange(len(self.syn_index.strs))
+    for query in QUERIES + ['glucose' * 10]:
+      self.assertEqual(self.syn_index.getDistances(query, idxs).tolist(),
+                       [editdistance.eval(query, val) for val in self.syn_index.strs])
+
+  def testGetChEBIEScores(self):
+    res = self.syn_index.getChEBIEScores('glucos', ['CHEBI:5', 'CHEBI:4', 'CHEBI:0', 'CHEBI:1'])
+    self.assertEqual(res[0], 1.0 - 1/7)
+    # CHEBI:4 is not valid and CHEBI:0 doesn't exist
+    self.assertTrue(np.isnan(res[1]))
+    self.assertTrue(np.isnan(res[2]))
+    self.assertEqual(res[3], 1.0 - 1/7)
+
+  def testHasValidSynonyms(self):
+    res = self.syn_index.hasValidSynonyms(['CHEBI:5', 'CHEBI:4', 'CHEBI:0', 'CHEBI:1'])
+    self.assertEqual(res.tolist(), [True, False, False, True])
+
+  def testGetNearCandidates(self):
+    cands = self.syn_index.getNearCandidates('glucos')
+    self.assertEqual(sorted(self.syn_index.strs[val] for val in cands),
+                     ['glucose', 'glucose'])
+    # water is not a valid ChEBI term
+    self.assertEqual(len(self.syn_index.getNearCandidates('water')), 0)
+
+  def testGetNearEScores(self):
+    idxs, scores = self.syn_index.getNearEScores('glucos', mssc='top', cutoff=0.0)
+    self.assertEqual(len(idxs), 2)
+    self.assertEqual(scores.tolist(), [1.0 - 1/7] * 2)
+    idxs, scores = self.syn_index.getNearEScores('glc', mssc='top', cutoff=0.0)
+    self.assertIsNone(idxs)
+    idxs, scores = self.syn_index.getNearEScores('glucos', mssc='above', cutoff=0.5)
+    self.assertIsNone(idxs)
+    idxs, scores = self.syn_index.getNearEScores('glucos', mssc='above', cutoff=0.8)
+    self.assertEqual(sorted(self.syn_index.owners[idxs].tolist()), [0, 4])
+
+  def testGetEScores(self):
+    for query in QUERIES:
+      for mssc in ['top', 'above']:
+        for cutoff in [0.0, 0.3, 0.6, 1.0]:
+          res = self.syn_index.getEScores(query, mssc=mssc, cutoff=cutoff)
+          expected = getBruteForceEScores(query, mssc, cutoff)
+          self.assertEqual([val[0] for val in res], [val[0] for val in expected])
+          np.testing.assert_allclose([val[1] for val in res],
+                                     [val[1] for val in expected])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -2,6 +2,7 @@
 
 
 import libsbml
+import numpy as np
 import os
 import compress_pickle
 import sys
@@ -55,6 +56,18 @@ class TestFunctions(unittest.TestCase):
     self.assertEqual(tools.applyMSSC(dummy, mssc='above', cutoff=0.3),
                      dummy)
 
+  def testApplyMSSCToArray(self):
+    labels = ['CHEBI:59789', 'CHEBI:15414', 'CHEBI:15422', 'CHEBI:30616']
+    scores = np.array([0.5, 0.9, np.nan, 0.9])
+    self.assertEqual(tools.applyMSSCToArray(labels, scores, mssc='top', cutoff=2.0),
+                     [])
+    self.assertEqual(tools.applyMSSCToArray(labels, scores, mssc='top', cutoff=0.3),
+                     [('CHEBI:15414', 0.9), ('CHEBI:30616', 0.9)])
+    self.assertEqual(tools.applyMSSCToArray(labels, scores, mssc='above', cutoff=0.3),
+                     [('CHEBI:15414', 0.9), ('CHEBI:30616', 0.9), ('CHEBI:59789', 0.5)])
+    self.assertEqual(tools.applyMSSCToArray(labels, scores, mssc='above', cutoff=0.3, sort=False),
+                     [('CHEBI:59789', 0.5), ('CHEBI:15414', 0.9), ('CHEBI:30616', 0.9)])
+
   def testExtractExistingSpeciesAnnotation(self):
     spec_annotation = tools.extractExistingSpeciesAnnotation(inp_model=self.model)
     self.assertTrue(spec_annotation[ATP], ATP_CHEBI)